@@ -18,7 +18,7 @@ https://github.com/Miceuz/i2c-moisture-sensor/blob/master/README.md
 from __future__ import division
 from datetime import datetime
 
-import smbus
+import struct
 import sys
 import time
 
@@ -28,8 +28,14 @@ class Chirp(object):
 
     Attributes:
         address (int): I2C address
-        busy_sleep (float): Sleep time in seconds while waiting for a new
+        batch (bool): True if registers are read in combined i2c_rdwr
+                      transactions.
+        busy_sleep (float): Longest sleep time in seconds between two checks
+                            of the busy flag while waiting for a new
                             measurement. Default: 0.01 second
+        busy_sleep_min (float): First sleep time in seconds while waiting for
+                                a new measurement, doubled on every check up
+                                to busy_sleep. Default: 0.0005 second
         light (int): Light measurement. False if no measurement taken.
         light_timestamp (datetime): Timestamp for light measurement.
         max_moist (int): Calibrated maximum value for moisture, required for moist_percent
@@ -46,11 +52,12 @@ class Chirp(object):
     """
     def __init__(self, bus=1, address=0x20, min_moist=False, max_moist=False,
                  temp_scale='celsius', temp_offset=0, read_temp=True,
-                 read_moist=True, read_light=True):
+                 read_moist=True, read_light=True, batch=None):
         """Chir soil moisture sensor.
 
         Args:
-            bus (int, optional): I2C bus. Default: 1
+            bus (int or SMBus, optional): I2C bus number, or an already
+                                          opened bus. Default: 1
             address (int, optional): I2C address. Default: 0x20
             min_moist (bool, optional): Set to calibrated value to enable moist_percent
             max_moist (bool, optional): Set to calibrated value to enable moist_percent
@@ -64,10 +71,34 @@ class Chirp(object):
                                          Default: True
             read_light (bool, optional): Enable or disable light measurements.
                                          Default: True
+            batch (bool, optional): Read the registers of a measurement in a
+                                    single combined i2c_rdwr transaction
+                                    instead of one transaction each. Needs
+                                    an smbus2 bus. Default: if the bus
+                                    supports it
+
+        Raises:
+            ImportError: If batch is True and smbus2 is not installed.
         """
-        self.bus_num = bus
-        self.bus = smbus.SMBus(bus)
+        if isinstance(bus, int):
+            import smbus
+            self.bus_num = bus
+            self.bus = smbus.SMBus(bus)
+        else:
+            self.bus_num = getattr(bus, 'bus', -1)
+            self.bus = bus
+        self._i2c_msg = None
+        if batch is not False and hasattr(self.bus, 'i2c_rdwr'):
+            try:
+                from smbus2 import i2c_msg
+                self._i2c_msg = i2c_msg
+            except ImportError:
+                if batch:
+                    raise
+        self.batch = self._i2c_msg is not None
         self.busy_sleep = 0.01
+        self.busy_sleep_min = 0.0005
+        self._last_waits = {}
         self.address = address
         self.min_moist = min_moist
         self.max_moist = max_moist
@@ -97,13 +128,104 @@ class Chirp(object):
 
     def trigger(self):
         """Triggers measurements on the activated sensors
+
+        The conversions are all started before waiting, light first as it
+        takes the longest, so that the measurements take as long as the
+        slowest of them instead of the sum of all.
+        """
+        self.start_measurements()
+        self._wait_until_ready((self.read_temp, self.read_moist, self.read_light))
+        self.read_measurements()
+
+    def start_measurements(self):
+        """Starts the conversions of the activated sensors, without waiting
+        for them to be over. Lets the conversions of several sensors run at
+        the same time.
+        """
+        commands = [self._MEASURE_LIGHT] if self.read_light is True else []
+        # These return the last reading, and trigger a new. Discard old values.
+        registers = []
+        if self.read_moist is True:
+            registers.append(self._GET_CAPACITANCE)
+        if self.read_temp is True:
+            registers.append(self._GET_TEMPERATURE)
+        self._read_regs(registers, commands)
+
+    def read_measurements(self):
+        """Retrieves the measurements started by start_measurements, once the
+        sensor is no longer busy.
         """
+        registers = []
         if self.read_temp is True:
-            self.temp = self._read_temp()
+            registers.append(self._GET_TEMPERATURE)
         if self.read_moist is True:
-            self.moist = self._read_moist()
+            registers.append(self._GET_CAPACITANCE)
         if self.read_light is True:
-            self.light = self._read_light()
+            registers.append(self._GET_LIGHT)
+        values = dict(zip(registers, self._read_regs(registers)))
+
+        now = datetime.now()
+        if self.read_temp is True:
+            self.temp = self._to_scale(values[self._GET_TEMPERATURE])
+            self.temp_timestamp = now
+        if self.read_moist is True:
+            self.moist = values[self._GET_CAPACITANCE]
+            self.moist_timestamp = now
+        if self.read_light is True:
+            self.light = values[self._GET_LIGHT]
+            self.light_timestamp = now
+
+    def _read_regs(self, registers, commands=()):
+        """Sends commands, then reads 2 bytes from each register. In batch
+        mode it all goes in one combined transaction, with repeated starts,
+        and the words are converted from big endian all at once.
+
+        Args:
+            registers (list): Register numbers to read
+            commands (list, optional): Commands to send first
+
+        Returns:
+            list: The register values, in order
+        """
+        if not self.batch:
+            for command in commands:
+                self.bus.write_byte(self.address, command)
+            return [self.get_reg(reg) for reg in registers]
+
+        messages = [self._i2c_msg.write(self.address, [command]) for command in commands]
+        reads = []
+        for reg in registers:
+            reads.append(self._i2c_msg.read(self.address, 2))
+            messages += [self._i2c_msg.write(self.address, [reg]), reads[-1]]
+        if not messages:
+            return []
+
+        self.bus.i2c_rdwr(*messages)
+        data = b''.join(bytes(read) for read in reads)
+        return list(struct.unpack('>{}H'.format(len(reads)), data))
+
+    def _wait_until_ready(self, measurement):
+        """Waits for the sensor to finish its measurements.
+
+        Most of the time the last wait for the same measurements took is
+        slept first, as light barely changes between two reads. The busy flag
+        is then checked often at first, then less and less often, so that a
+        measurement is read as soon as it is over without flooding the bus
+        with checks.
+
+        Args:
+            measurement (hashable): What is being measured, to remember its
+                                    wait
+        """
+        start = time.monotonic()
+        last_wait = self._last_waits.get(measurement, 0)
+        if last_wait:
+            time.sleep(last_wait * 0.9)
+        sleep = self.busy_sleep_min
+        while self.busy:
+            time.sleep(sleep)
+            sleep = min(sleep * 2, self.busy_sleep)
+        self._last_waits[measurement] = time.monotonic() - start
 
     def get_reg(self, reg):
         """Read 2 bytes from register
@@ -241,8 +363,7 @@ class Chirp(object):
         measurement = self.get_reg(self._GET_CAPACITANCE)
 
         # Wait for sensor to finish measurement
-        while self.busy:
-            time.sleep(self.busy_sleep)
+        self._wait_until_ready('moist')
         self.moist_timestamp = datetime.now()
 
         # Retrieve the measurement just triggered.
@@ -263,13 +384,25 @@ class Chirp(object):
         measurement = self.get_reg(self._GET_TEMPERATURE)
 
         # Wait for sensor to finish measurement
-        while self.busy:
-            time.sleep(self.busy_sleep)
+        self._wait_until_ready('temp')
         self.temp_timestamp = datetime.now()
 
         # Retrieve the measurement just triggered.
-        measurement = self.get_reg(self._GET_TEMPERATURE)
+        return self._to_scale(self.get_reg(self._GET_TEMPERATURE))
+
+    def _to_scale(self, measurement):
+        """Converts a temperature register value to the selected scale,
+        adjusted for temperature offset
 
+        Args:
+            measurement (int): Temperature register value
+
+        Returns:
+            float: Temperature in selected scale (temp_scale)
+
+        Raises:
+            ValueError: If temp_scale is not properly defined.
+        """
         # The chirp sensor returns an integer. But the return measurement is
         # actually a float with one decimal. Needs to be converted to float by
         # dividing by ten. And adjusted for temperature offset (if used).
@@ -301,8 +434,7 @@ class Chirp(object):
         self.bus.write_byte(self.address, self._MEASURE_LIGHT)
 
         # Wait for sensor to finish measurement. Takes longer in low light.
-        while self.busy:
-            time.sleep(self.busy_sleep)
+        self._wait_until_ready('light')
         self.light_timestamp = datetime.now()
         measurement = self.get_reg(self._GET_LIGHT)
         return measurement
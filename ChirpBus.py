@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from Chirp import Chirp
+import threading
+import time
+
+
+class ChirpBus:
+	"""
+	Every Chirp sensor found on an i2c bus, measured together
+	The conversions of all the sensors are started first, then each sensor is read as soon as it is no longer busy,
+	so that measuring several pots takes about as long as measuring the slowest one. Every bus transaction goes through
+	a single lock, the waits happen outside of it
+	In batch mode, on an smbus2 bus, the registers of a sensor are read in one combined transaction and the busy flags
+	of all the sensors still measuring are checked in one too
+	"""
+
+	FIRST_ADDRESS = 0x08
+	LAST_ADDRESS = 0x77
+
+	# Calibration of a sensor without one of its own
+	DEFAULT_CALIBRATION = {'minMoist': 217, 'maxMoist': 626, 'tempOffset': -0.5}
+
+	_GET_ADDRESS = 0x02
+	_GET_BUSY = 0x09
+
+	def __init__(self, bus, calibrations=None, defaultCalibration=None, busySleep=0.01, busySleepMin=0.0005, batch=False):
+		"""
+		:param bus: smbus.SMBus like object
+		:param calibrations: dict, address to dict with any of minMoist, maxMoist and tempOffset
+		:param defaultCalibration: dict, calibration of the sensors not in calibrations, DEFAULT_CALIBRATION if None
+		:param busySleep: float, longest sleep between two checks of the sensors still busy, in seconds
+		:param busySleepMin: float, first sleep between two checks, doubled every check up to busySleep
+		:param batch: boolean, use combined i2c_rdwr transactions, needs an smbus2 bus
+		:raises ImportError: in batch mode, if smbus2 isn't installed
+		"""
+		self._bus = bus
+		self._calibrations = calibrations or dict()
+		self._defaultCalibration = dict(self.DEFAULT_CALIBRATION)
+		self._defaultCalibration.update(defaultCalibration or dict())
+		self._busySleep = busySleep
+		self._busySleepMin = busySleepMin
+		self._lock = threading.Lock()
+		self._sensors = dict()
+		self._lastWait = 0
+		self._i2cMsg = None
+		if batch:
+			from smbus2 import i2c_msg
+			self._i2cMsg = i2c_msg
+
+
+	@property
+	def sensors(self):
+		"""
+		:return: dict, address to Chirp, every sensor in use
+		"""
+		return dict(self._sensors)
+
+
+	@property
+	def addresses(self):
+		"""
+		:return: list of integers, sorted
+		"""
+		return sorted(self._sensors)
+
+
+	def scan(self, first=FIRST_ADDRESS, last=LAST_ADDRESS):
+		"""
+		Looks for Chirp sensors on the bus and adds the ones found. A Chirp answers its own address when asked for it
+		:param first: integer, lowest address probed
+		:param last: integer, highest address probed
+		:return: list of integers, addresses found
+		"""
+		found = list()
+		for address in range(first, last + 1):
+			if self._probe(address):
+				self.add(address)
+				found.append(address)
+		return found
+
+
+	def add(self, address):
+		"""
+		Uses the sensor at this address, even if it isn't answering yet
+		:param address: integer
+		:return: Chirp
+		"""
+		calibration = dict(self._defaultCalibration)
+		calibration.update(self._calibrations.get(address, dict()))
+		sensor = Chirp(
+			bus=self._bus,
+			address=address,
+			read_moist=True,
+			read_temp=True,
+			read_light=True,
+			min_moist=calibration['minMoist'],
+			max_moist=calibration['maxMoist'],
+			temp_scale='celsius',
+			temp_offset=calibration['tempOffset'],
+			batch=self._i2cMsg is not None
+		)
+		with self._lock:
+			self._sensors[address] = sensor
+		return sensor
+
+
+	def trigger(self, addresses=None):
+		"""
+		Measures the sensors, all at once
+		:param addresses: list of integers, the sensors to measure, all of them if None
+		:return: dict, address to the exception that sensor failed with. Empty if every measurement went well
+		"""
+		sensors = [(address, self._sensors[address]) for address in (addresses if addresses is not None else self.addresses)]
+		failed = dict()
+		pending = list()
+		with self._lock:
+			for address, sensor in sensors:
+				try:
+					sensor.start_measurements()
+					pending.append((address, sensor))
+				except OSError as e:
+					failed[address] = e
+
+		# Most of the time the last wait is slept at once, light barely changes between two reads
+		start = time.monotonic()
+		if pending and self._lastWait:
+			time.sleep(self._lastWait * 0.9)
+
+		sleep = self._busySleepMin
+		while pending:
+			with self._lock:
+				busy = self._busy(pending)
+				for address, sensor in list(pending):
+					try:
+						flag = busy.get(address)
+						if flag is None:
+							flag = sensor.busy
+						if flag:
+							continue
+						sensor.read_measurements()
+					except OSError as e:
+						failed[address] = e
+					pending.remove((address, sensor))
+
+			if pending:
+				time.sleep(sleep)
+				sleep = min(sleep * 2, self._busySleep)
+
+		if len(failed) < len(sensors):
+			self._lastWait = time.monotonic() - start
+		return failed
+
+
+	def _busy(self, sensors):
+		"""
+		Checks the busy flags of the sensors in a single transaction, in batch mode
+		:param sensors: list of (address, Chirp) tuples
+		:return: dict, address to boolean. Empty if not in batch mode or if a sensor didn't answer, they are then checked
+		one by one
+		"""
+		if self._i2cMsg is None or len(sensors) < 2:
+			return dict()
+
+		messages = list()
+		for address, _ in sensors:
+			messages += [self._i2cMsg.write(address, [self._GET_BUSY]), self._i2cMsg.read(address, 1)]
+		try:
+			self._bus.i2c_rdwr(*messages)
+		except OSError:
+			return dict()
+		return {address: bytes(message)[0] == 1 for (address, _), message in zip(sensors, messages[1::2])}
+
+
+	def _probe(self, address):
+		"""
+		:param address: integer
+		:return: boolean, True if a Chirp answers at this address
+		"""
+		# A sleeping Chirp fails the first command it gets, and wakes up
+		for _ in range(2):
+			try:
+				with self._lock:
+					return self._bus.read_byte_data(address, self._GET_ADDRESS) == address
+			except OSError:
+				continue
+		return False
+
+
+if __name__ == '__main__':
+	# Measures 1 to N simulated Chirp sensors, one after the other like a loop over single sensors would, then all at
+	# once through the bus, and reports how the acquisition time grows with the number of sensors
+	# Batch mode, with smbus2 installed, is measured as well
+	# Usage: python3 ChirpBus.py [sensors] [reads]
+	from FakeSmbus import FakeChirp, FakeSMBus
+	import sys
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+	reads = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+	fakeBus = FakeSMBus(1)
+	for i in range(count):
+		fakeBus.attach(FakeChirp(0x20 + i, capacitance=300 + 20 * i, light=5000 + 4000 * i))
+
+	chirps = ChirpBus(fakeBus, calibrations={0x21: {'minMoist': 240, 'maxMoist': 600}})
+	start = time.perf_counter()
+	transactions = fakeBus.transactions
+	found = chirps.scan()
+	print('Scan: {} sensors in {:.1f}ms, {} i2c transactions'.format(len(found), (time.perf_counter() - start) * 1000, fakeBus.transactions - transactions))
+
+	def measure(function):
+		transactions = fakeBus.transactions
+		start = time.perf_counter()
+		for _ in range(reads):
+			function()
+		return (time.perf_counter() - start) / reads * 1000, (fakeBus.transactions - transactions) / reads
+
+	try:
+		batched = ChirpBus(fakeBus, calibrations={0x21: {'minMoist': 240, 'maxMoist': 600}}, batch=True)
+		batched.scan()
+	except ImportError:
+		print('smbus2 is not installed, batch mode is not measured')
+		batched = None
+
+	for n in range(1, count + 1):
+		addresses = found[:n]
+		sensors = [chirps.sensors[address] for address in addresses]
+		oneByOne = measure(lambda: [sensor.trigger() for sensor in sensors])
+		together = measure(lambda: chirps.trigger(addresses))
+		line = '{} sensors  one by one: {:7.1f}ms {:5.1f} transactions  together: {:7.1f}ms {:5.1f} transactions'.format(n, oneByOne[0], oneByOne[1], together[0], together[1])
+		if batched is not None:
+			line += '  batched: {:7.1f}ms {:5.1f} transactions'.format(*measure(lambda: batched.trigger(addresses)))
+		print(line)
+
+	if batched is not None:
+		# Sensors finishing together: each poll must cost one busy transaction for all of them, plus one transaction
+		# per sensor to start its conversions and one to read them
+		checkBus = FakeSMBus(1)
+		devices = [FakeChirp(0x20 + i) for i in range(count)]
+		for device in devices:
+			checkBus.attach(device)
+		check = ChirpBus(checkBus, batch=True)
+		for device in devices:
+			check.add(device.address)
+		for _ in range(reads):
+			polls = devices[0].busyChecks
+			transactions = checkBus.transactions
+			check.trigger()
+			polls = devices[0].busyChecks - polls
+			assert all(device.busyChecks == devices[0].busyChecks for device in devices)
+			assert checkBus.transactions - transactions == 2 * count + polls, 'busy flags not checked in one transaction per poll'
+		print('Batched busy checks: one transaction per poll for {} sensors'.format(count))
+
+	for address, sensor in chirps.sensors.items():
+		print('{:#04x}  moisture {:5.1f}%  temperature {}  light {}'.format(address, sensor.moist_percent, sensor.temp, sensor.light))
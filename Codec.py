@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+import json
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
+
+
+class Codec:
+	"""
+	Json encoding and decoding of every mqtt payload, for the main unit and the satellites
+	Uses the fastest json library installed, orjson then ujson, and falls back to the standard library
+	Payloads are always encoded to bytes and decoded straight from the bytes paho gives us
+	"""
+
+	if orjson is not None:
+		NAME = 'orjson'
+		_loads = staticmethod(orjson.loads)
+		_dumps = staticmethod(orjson.dumps)
+	elif ujson is not None:
+		NAME = 'ujson'
+		_loads = staticmethod(ujson.loads)
+		_dumps = staticmethod(lambda obj: ujson.dumps(obj).encode('utf-8'))
+	else:
+		NAME = 'json'
+		_loads = staticmethod(json.loads)
+		_dumps = staticmethod(lambda obj: json.dumps(obj).encode('utf-8'))
+
+	@classmethod
+	def loads(cls, data):
+		"""
+		:param data: bytes, or string
+		:return: decoded object
+		:raises ValueError: if data is not valid json
+		"""
+		return cls._loads(data)
+
+
+	@classmethod
+	def dumps(cls, obj):
+		"""
+		:param obj: object to encode
+		:return: bytes
+		"""
+		return cls._dumps(obj)
+
+
+	@staticmethod
+	@lru_cache(maxsize=1024)
+	def siteIdPayload(siteId):
+		"""
+		The {'siteId': siteId} payload of most commands, encoded once per site id
+		:param siteId: string
+		:return: bytes
+		"""
+		return Codec.dumps({'siteId': siteId})
+
+
+	@staticmethod
+	@lru_cache(maxsize=1024)
+	def constant(*items):
+		"""
+		A payload that never changes, like an alert, encoded once
+		:param items: (key, value) tuples
+		:return: bytes
+		"""
+		return Codec.dumps(dict(items))
+
+
+	@classmethod
+	def partial(cls, constant, key):
+		"""
+		Pre-serializes the constant fields of a payload that only has one varying field
+		:param constant: dict, fields that never change
+		:param key: string, name of the varying field
+		:return: callable taking the varying value and returning the encoded payload
+		"""
+		head = cls.dumps(constant)[:-1]
+		if constant:
+			head += b','
+		head += cls.dumps(key) + b':'
+		dumps = cls._dumps
+		return lambda value: head + dumps(value) + b'}'
+
+
+if __name__ == '__main__':
+	# Reports messages/sec for every installed codec on a typical telemetry report
+	# Usage: python3 Codec.py [messages]
+	import sys
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	message = {'siteId': 'ficus', 'plant': 'ficus', 'data': {'siteId': 'ficus', 'temperature': 21.5, 'luminosity': 64.22, 'moisture': 41.3, 'water': 75}}
+	payload = json.dumps(message).encode('utf-8')
+
+	codecs = [('json', json.loads, lambda obj: json.dumps(obj).encode('utf-8'))]
+	if ujson is not None:
+		codecs.append(('ujson', ujson.loads, lambda obj: ujson.dumps(obj).encode('utf-8')))
+	if orjson is not None:
+		codecs.append(('orjson', orjson.loads, orjson.dumps))
+
+	print('Selected codec: {}'.format(Codec.NAME))
+	for name, loads, dumps in codecs:
+		start = time.perf_counter()
+		for _ in range(count):
+			loads(payload)
+		decode = count / (time.perf_counter() - start)
+
+		start = time.perf_counter()
+		for _ in range(count):
+			dumps(message)
+		encode = count / (time.perf_counter() - start)
+		print('{:8s} decode: {:10.0f} msg/s  encode: {:10.0f} msg/s'.format(name, decode, encode))
+
+	start = time.perf_counter()
+	for _ in range(count):
+		json.loads(payload.decode('utf-8'))
+	print('{:8s} decode: {:10.0f} msg/s  (previous decode().loads path)'.format('json', count / (time.perf_counter() - start)))
+
+	report = Codec.partial({'siteId': 'ficus', 'plant': 'ficus'}, 'data')
+	start = time.perf_counter()
+	for _ in range(count):
+		report(message['data'])
+	print('{:8s} encode: {:10.0f} msg/s  (pre-serialized constant fields)'.format(Codec.NAME, count / (time.perf_counter() - start)))
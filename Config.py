@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import configparser
+
+
+class Config:
+	"""
+	Reads the app settings. Defaults come from config.default, overridden by the user's config.ini
+	"""
+
+	_DEFAULT_FILE = 'config.default'
+	_USER_FILE = 'config.ini'
+
+	def __init__(self, overrides=None):
+		"""
+		:param overrides: dict, section to dict of settings that win over both files, for a unit that must not behave
+		like the installed one
+		"""
+		self._parser = configparser.ConfigParser()
+		try:
+			self._parser.read([self._DEFAULT_FILE, self._USER_FILE], encoding='utf-8')
+		except configparser.Error as e:
+			print('Error loading configuration: {}'.format(e))
+
+		for section, settings in (overrides or dict()).items():
+			if not self._parser.has_section(section):
+				self._parser.add_section(section)
+			for key, value in settings.items():
+				self._parser.set(section, key, str(value))
+
+
+	def get(self, section, key, fallback=None):
+		"""
+		:param section: string
+		:param key: string
+		:param fallback: value returned if the setting is missing
+		:return: string
+		"""
+		return self._parser.get(section, key, fallback=fallback)
+
+
+	def getInt(self, section, key, fallback=0):
+		try:
+			return self._parser.getint(section, key, fallback=fallback)
+		except ValueError:
+			print('Invalid integer for {}.{}'.format(section, key))
+			return fallback
+
+
+	def getFloat(self, section, key, fallback=0.0):
+		try:
+			return self._parser.getfloat(section, key, fallback=fallback)
+		except ValueError:
+			print('Invalid number for {}.{}'.format(section, key))
+			return fallback
+
+
+	def getBoolean(self, section, key, fallback=False):
+		try:
+			return self._parser.getboolean(section, key, fallback=fallback)
+		except ValueError:
+			print('Invalid boolean for {}.{}'.format(section, key))
+			return fallback
+
+
+	def sections(self, prefix=''):
+		"""
+		:param prefix: string, only the sections whose name starts with it
+		:return: list of strings
+		"""
+		return [section for section in self._parser.sections() if section.startswith(prefix)]
+
+
+	def items(self, section):
+		"""
+		:param section: string
+		:return: dict, every key of the section
+		"""
+		if not self._parser.has_section(section):
+			return dict()
+		return dict(self._parser.items(section))
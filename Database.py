@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from RowStream import RowStream
+import sqlite3
+import threading
+import time
+try:
+	import queue as Queue
+except ImportError:
+	import Queue as Queue
+
+
+class Database:
+	"""
+	Long lived sqlite connections for the main unit
+	One writer connection in WAL mode, serialized by a lock, and a small pool of read only connections
+	so that intent queries never wait on telemetry writes
+	"""
+
+	_PRAGMAS = {
+		'journal_mode': 'WAL',
+		'synchronous': 'NORMAL', # Safe in WAL mode, only the last transactions can be lost on power cut, the db can't be corrupted
+		'cache_size': -8000, # Negative means KiB, so 8MB of page cache per connection
+		'mmap_size': 67108864, # 64MB
+		'temp_store': 'MEMORY'
+	}
+
+	def __init__(self, dbFile, readers=3, timeout=5.0, metrics=None):
+		"""
+		Opens the writer connection and the reader pool
+		:param dbFile: Path, database file
+		:param readers: integer, number of read only connections in the pool
+		:param timeout: float, seconds to wait on a locked database or for a free reader
+		:param metrics: Metrics, query timings are recorded there if given
+		"""
+		self._dbFile = str(dbFile)
+		self._timeout = timeout
+		self._writeLock = threading.RLock()
+		self._writer = self._connect()
+		self._readers = Queue.Queue()
+		for _ in range(max(1, readers)):
+			self._readers.put(self._connect(readOnly=True))
+
+		self._writeTime = None
+		self._readTime = None
+		self._readerWait = None
+		if metrics is not None:
+			# Write timings include waiting for the write lock, read timings only count sqlite, not the consumer
+			self._writeTime = metrics.histogram('sqlite_seconds', 'Time spent in sqlite calls', {'kind': 'write'})
+			self._readTime = metrics.histogram('sqlite_seconds', 'Time spent in sqlite calls', {'kind': 'read'})
+			self._readerWait = metrics.histogram('sqlite_reader_wait_seconds', 'Time spent waiting for a free reader connection')
+			metrics.callback('sqlite_free_readers', 'Reader connections currently in the pool', self._readers.qsize)
+
+
+	def _connect(self, readOnly=False):
+		"""
+		Opens a connection and applies our pragmas. Connections are shared across threads, access is serialized by us
+		:param readOnly: boolean
+		:return: connection
+		"""
+		if readOnly:
+			con = sqlite3.connect('file:{}?mode=ro'.format(self._dbFile), uri=True, timeout=self._timeout, check_same_thread=False)
+			con.execute('PRAGMA query_only = ON')
+		else:
+			con = sqlite3.connect(self._dbFile, timeout=self._timeout, check_same_thread=False)
+
+		for pragma, value in self._PRAGMAS.items():
+			if readOnly and pragma == 'journal_mode':
+				continue
+			con.execute('PRAGMA {} = {}'.format(pragma, value))
+
+		return con
+
+
+	def execute(self, query, replace=()):
+		"""
+		Executes a write query on the writer connection and commits it
+		:param query: string
+		:param replace: tuple, if your query has placeholders
+		:return: integer, last row id
+		"""
+		start = time.perf_counter()
+		with self._writeLock:
+			with self._writer:
+				cursor = self._writer.execute(query, replace)
+		if self._writeTime is not None:
+			self._writeTime.observe(time.perf_counter() - start)
+		return cursor.lastrowid
+
+
+	def executemany(self, query, rows):
+		"""
+		Executes a write query for each row in one single transaction
+		:param query: string
+		:param rows: iterable of tuples
+		:return: integer, number of rows affected
+		"""
+		start = time.perf_counter()
+		with self._writeLock:
+			with self._writer:
+				cursor = self._writer.executemany(query, rows)
+		if self._writeTime is not None:
+			self._writeTime.observe(time.perf_counter() - start)
+		return cursor.rowcount
+
+
+	@contextmanager
+	def transaction(self):
+		"""
+		Holds the writer connection for several statements that must be committed together
+		Rolled back if anything raises
+		:return: connection
+		"""
+		start = time.perf_counter()
+		try:
+			with self._writeLock:
+				with self._writer:
+					yield self._writer
+		finally:
+			if self._writeTime is not None:
+				self._writeTime.observe(time.perf_counter() - start)
+
+
+	def executescript(self, script):
+		"""
+		Executes a sql script on the writer connection, used for schema creation
+		:param script: string
+		"""
+		with self._writeLock:
+			self._writer.executescript(script)
+
+
+	def fetch(self, query, replace=()):
+		"""
+		Runs a read query on a pooled read only connection and returns every row at once
+		Only meant for results known to be small, iterate() streams the others
+		:param query: string
+		:param replace: tuple, if your query has placeholders
+		:return: list
+		"""
+		return list(self.iterate(query, replace))
+
+
+	def iterate(self, query, replace=(), size=1000):
+		"""
+		Runs a read query on a pooled read only connection, rows are fetched lazily as they are consumed
+		The query runs, and can raise, when the first row is asked for
+		:param query: string
+		:param replace: tuple, if your query has placeholders
+		:param size: integer, rows fetched at once
+		:return: RowStream
+		"""
+		return RowStream(self.batches(query, replace, size))
+
+
+	def batches(self, query, replace=(), size=1000):
+		"""
+		Runs a read query on a pooled read only connection and yields its rows a batch at a time, so that a large result
+		never sits in memory all at once. The connection goes back to the pool once the generator is exhausted or closed
+		:param query: string
+		:param replace: tuple, if your query has placeholders
+		:param size: integer, rows per batch
+		:return: generator of lists
+		:raises sqlite3.OperationalError: if no reader got free within the timeout
+		"""
+		start = time.perf_counter()
+		try:
+			con = self._readers.get(timeout=self._timeout)
+		except Queue.Empty:
+			raise sqlite3.OperationalError('reader pool exhausted')
+		began = time.perf_counter()
+		if self._readerWait is not None:
+			self._readerWait.observe(began - start)
+		elapsed = 0.0
+		cursor = None
+		try:
+			cursor = con.execute(query, replace)
+			while True:
+				rows = cursor.fetchmany(size)
+				elapsed += time.perf_counter() - began
+				if not rows:
+					return
+				yield rows
+				began = time.perf_counter()
+		finally:
+			if cursor is not None:
+				cursor.close()
+			self._readers.put(con)
+			if self._readTime is not None:
+				self._readTime.observe(elapsed)
+
+
+	def explain(self, query, replace=()):
+		"""
+		Returns the query plan sqlite would use for the given query, one step per line
+		:param query: string
+		:param replace: tuple, if your query has placeholders
+		:return: string
+		"""
+		return '\n'.join(row[-1] for row in self.iterate('EXPLAIN QUERY PLAN {}'.format(query), replace))
+
+
+	def close(self):
+		"""
+		Closes every connection. The writer is checkpointed so the wal file doesn't stay behind
+		"""
+		while not self._readers.empty():
+			self._readers.get_nowait().close()
+
+		with self._writeLock:
+			try:
+				self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+			except sqlite3.Error as e:
+				print(e)
+			self._writer.close()
+
+
+if __name__ == '__main__':
+	# Compares the historical connect per call access with the long lived connections
+	# Usage: python3 Database.py [rows]
+	import os
+	import sys
+	import tempfile
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	schema = 'CREATE TABLE IF NOT EXISTS telemetry (id integer PRIMARY KEY, siteId TEXT NOT NULL, timestamp integer NOT NULL, temperature REAL, luminosity REAL, moisture REAL, water INTEGER);'
+	insert = 'INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)'
+	select = 'SELECT * FROM telemetry WHERE siteId = ? ORDER BY timestamp DESC LIMIT 1'
+
+	with tempfile.TemporaryDirectory() as tmp:
+		before = os.path.join(tmp, 'before.db')
+		con = sqlite3.connect(before)
+		con.execute(schema)
+		con.close()
+
+		start = time.perf_counter()
+		for i in range(count):
+			con = sqlite3.connect(before)
+			con.execute(insert, ('site{}'.format(i % 50), i, 20.0, 50.0, 40.0, 75))
+			con.commit()
+			con.close()
+		insertBefore = count / (time.perf_counter() - start)
+
+		start = time.perf_counter()
+		for i in range(count):
+			con = sqlite3.connect(before)
+			con.execute(select, ('site{}'.format(i % 50),)).fetchall()
+			con.close()
+		queryBefore = (time.perf_counter() - start) / count * 1000
+
+		db = Database(os.path.join(tmp, 'after.db'))
+		db.executescript(schema)
+
+		start = time.perf_counter()
+		for i in range(count):
+			db.execute(insert, ('site{}'.format(i % 50), i, 20.0, 50.0, 40.0, 75))
+		insertAfter = count / (time.perf_counter() - start)
+
+		start = time.perf_counter()
+		for i in range(count):
+			db.fetch(select, ('site{}'.format(i % 50),))
+		queryAfter = (time.perf_counter() - start) / count * 1000
+		db.close()
+
+	print('Inserts/sec  before: {:10.1f}  after: {:10.1f}'.format(insertBefore, insertAfter))
+	print('Query ms     before: {:10.3f}  after: {:10.3f}'.format(queryBefore, queryAfter))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import zlib
+try:
+	import queue as Queue
+except ImportError:
+	import Queue as Queue
+
+
+class Dispatcher:
+	"""
+	Hands the incoming messages to a pool of worker threads so that the mqtt network loop never waits on a handler
+	Each worker has its own queue and a given key, the site id, always goes to the same worker, so messages
+	from one site are processed in the order they arrived
+	"""
+
+	POLICY_BLOCK = 'block' # Wait for room, up to blockTimeout, then drop the message
+	POLICY_DROP_NEWEST = 'dropNewest' # Drop the incoming message
+	POLICY_DROP_OLDEST = 'dropOldest' # Drop the oldest queued message of that worker to make room
+
+	_STOP = object()
+
+	def __init__(self, handler, workers=4, maxQueue=1000, policy=POLICY_BLOCK, blockTimeout=1.0):
+		"""
+		Starts the workers
+		:param handler: callable, called with the dispatched arguments
+		:param workers: integer, number of worker threads
+		:param maxQueue: integer, queued messages per worker
+		:param policy: string, what to do when a worker queue is full
+		:param blockTimeout: float, seconds to wait for room with the block policy
+		"""
+		if policy not in (self.POLICY_BLOCK, self.POLICY_DROP_NEWEST, self.POLICY_DROP_OLDEST):
+			print('Unknown dispatcher policy "{}", using "{}"'.format(policy, self.POLICY_BLOCK))
+			policy = self.POLICY_BLOCK
+
+		self._handler = handler
+		self._policy = policy
+		self._blockTimeout = blockTimeout
+		self._lock = threading.Lock()
+		self._stats = dict()
+		self._queues = list()
+		self._threads = list()
+		for i in range(max(1, workers)):
+			queue = Queue.Queue(maxsize=maxQueue)
+			thread = threading.Thread(target=self._run, args=[queue], name='Dispatcher-{}'.format(i))
+			thread.setDaemon(True)
+			self._queues.append(queue)
+			self._threads.append(thread)
+			thread.start()
+
+
+	def dispatch(self, key, name, *args):
+		"""
+		Queues a message for the worker owning the given key
+		:param key: string, messages with the same key are processed in order
+		:param name: string, handler name the metrics are recorded under
+		:param args: passed to the handler
+		:return: boolean, False if the message was dropped
+		"""
+		queue = self._queues[zlib.crc32(key.encode('utf-8')) % len(self._queues)]
+		item = (name, time.perf_counter(), args)
+		self._record(name, 'received')
+
+		try:
+			queue.put_nowait(item)
+		except Queue.Full:
+			if self._policy == self.POLICY_DROP_OLDEST:
+				try:
+					evicted = queue.get_nowait()
+					self._record(evicted[0], 'evicted')
+				except Queue.Empty:
+					pass
+				return self._put(queue, item, timeout=0)
+
+			if self._policy == self.POLICY_BLOCK:
+				return self._put(queue, item, timeout=self._blockTimeout)
+
+			self._record(name, 'dropped')
+			return False
+
+		return True
+
+
+	def stats(self):
+		"""
+		Per handler counters, queue depth and latencies in seconds
+		:return: dict
+		"""
+		with self._lock:
+			stats = {name: dict(values) for name, values in self._stats.items()}
+
+		for values in stats.values():
+			values['depth'] = values['received'] - values['processed'] - values['dropped'] - values['evicted']
+			values['averageLatency'] = values['totalLatency'] / values['processed'] if values['processed'] else 0
+			values['averageWait'] = values['totalWait'] / values['processed'] if values['processed'] else 0
+
+		return {
+			'policy': self._policy,
+			'queueDepths': [queue.qsize() for queue in self._queues],
+			'handlers': stats
+		}
+
+
+	def onStop(self, timeout=5):
+		"""
+		Lets the workers finish what is already queued and stops them
+		:param timeout: float, seconds to wait for each worker
+		"""
+		for queue in self._queues:
+			queue.put(self._STOP)
+
+		for thread in self._threads:
+			thread.join(timeout=timeout)
+
+
+	def _put(self, queue, item, timeout):
+		try:
+			if timeout:
+				queue.put(item, timeout=timeout)
+			else:
+				queue.put_nowait(item)
+		except Queue.Full:
+			self._record(item[0], 'dropped')
+			return False
+
+		return True
+
+
+	def _run(self, queue):
+		"""
+		Worker thread
+		:param queue: this worker's queue
+		"""
+		while True:
+			item = queue.get()
+			if item is self._STOP:
+				return
+			self._execute(item)
+
+
+	def _execute(self, item):
+		name, queuedAt, args = item
+		start = time.perf_counter()
+		try:
+			self._handler(*args)
+		except Exception as e:
+			print('Error handling {}: {}'.format(name, e))
+			self._record(name, 'errors')
+
+		end = time.perf_counter()
+		with self._lock:
+			stats = self._handlerStats(name)
+			stats['processed'] += 1
+			latency = end - start
+			stats['totalLatency'] += latency
+			stats['maxLatency'] = max(stats['maxLatency'], latency)
+			stats['totalWait'] += start - queuedAt
+
+
+	def _record(self, name, counter):
+		with self._lock:
+			stats = self._handlerStats(name)
+			stats[counter] += 1
+
+
+	def _handlerStats(self, name):
+		"""
+		Must be called with the lock held
+		"""
+		stats = self._stats.get(name)
+		if stats is None:
+			stats = self._stats[name] = {
+				'received': 0,
+				'processed': 0,
+				'dropped': 0,
+				'evicted': 0,
+				'errors': 0,
+				'totalLatency': 0.0,
+				'maxLatency': 0.0,
+				'totalWait': 0.0
+			}
+		return stats
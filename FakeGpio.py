@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+try:
+	import queue as Queue
+except ImportError:
+	import Queue as Queue
+
+
+class FakeGpio:
+	"""
+	Stand in for RPi.GPIO, to run the satellite code on a machine without gpios
+	Inputs are driven with drive(). Like RPi.GPIO, edge callbacks run on a single event thread, in order, and an edge
+	coming less than bouncetime milliseconds after the last one accepted on that channel is ignored
+	"""
+
+	BOARD = 10
+	BCM = 11
+	OUT = 0
+	IN = 1
+	LOW = 0
+	HIGH = 1
+	PUD_OFF = 20
+	PUD_DOWN = 21
+	PUD_UP = 22
+	RISING = 31
+	FALLING = 32
+	BOTH = 33
+
+	_STOP = object()
+
+	def __init__(self):
+		self._mode = None
+		self._directions = dict()
+		self._values = dict()
+		self._events = dict()
+		self._lock = threading.Lock()
+		self._queue = Queue.Queue()
+		self._thread = None
+		self._reads = 0
+
+
+	def setmode(self, mode):
+		self._mode = mode
+
+
+	def getmode(self):
+		return self._mode
+
+
+	def setwarnings(self, flag):
+		pass
+
+
+	def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=-1):
+		"""
+		:param channel: integer or list of integers
+		"""
+		for pin in self._channels(channel):
+			with self._lock:
+				self._directions[pin] = direction
+				if direction == self.OUT:
+					self._values[pin] = initial if initial != -1 else self.LOW
+				else:
+					self._values[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+
+	def input(self, channel):
+		with self._lock:
+			self._reads += 1
+			return self._values[self._checked(channel)]
+
+
+	def output(self, channel, value):
+		for pin in self._channels(channel):
+			with self._lock:
+				if self._directions.get(pin) != self.OUT:
+					raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+				self._values[pin] = self.HIGH if value else self.LOW
+
+
+	def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+		"""
+		:param edge: RISING, FALLING or BOTH
+		:param bouncetime: integer, milliseconds
+		"""
+		with self._lock:
+			self._checked(channel)
+			if self._directions[channel] != self.IN:
+				raise RuntimeError('You must setup() the GPIO channel as an input first')
+			if channel in self._events:
+				raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+			self._events[channel] = {
+				'edge': edge,
+				'callbacks': [callback] if callback is not None else [],
+				'bouncetime': (bouncetime or 0) / 1000,
+				'last': None
+			}
+
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name='FakeGpioEvents')
+				self._thread.setDaemon(True)
+				self._thread.start()
+
+
+	def add_event_callback(self, channel, callback):
+		with self._lock:
+			if channel not in self._events:
+				raise RuntimeError('Add event detection using add_event_detect first before adding a callback')
+			self._events[channel]['callbacks'].append(callback)
+
+
+	def remove_event_detect(self, channel):
+		with self._lock:
+			self._events.pop(channel, None)
+
+
+	def cleanup(self, channel=None):
+		thread = None
+		with self._lock:
+			pins = list(self._directions) if channel is None else self._channels(channel)
+			for pin in pins:
+				self._directions.pop(pin, None)
+				self._values.pop(pin, None)
+				self._events.pop(pin, None)
+			if channel is None:
+				thread, self._thread = self._thread, None
+
+		if thread is not None:
+			self._queue.put(self._STOP)
+			thread.join(timeout=2)
+
+
+	def drive(self, channel, value):
+		"""
+		Simulates the outside world changing an input, firing its edge callbacks if edge detection is on
+		:param channel: integer
+		:param value: HIGH or LOW
+		"""
+		value = self.HIGH if value else self.LOW
+		with self._lock:
+			self._checked(channel)
+			previous = self._values[channel]
+			self._values[channel] = value
+			event = self._events.get(channel)
+			if event is None or previous == value:
+				return
+
+			edge = self.RISING if value == self.HIGH else self.FALLING
+			if event['edge'] != self.BOTH and event['edge'] != edge:
+				return
+
+			now = time.monotonic()
+			if event['last'] is not None and now - event['last'] < event['bouncetime']:
+				return
+			event['last'] = now
+			callbacks = list(event['callbacks'])
+
+		for callback in callbacks:
+			self._queue.put((callback, channel))
+
+
+	@property
+	def reads(self):
+		"""
+		:return: integer, input() calls so far
+		"""
+		return self._reads
+
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			if item is self._STOP:
+				return
+			callback, channel = item
+			try:
+				callback(channel)
+			except Exception as e:
+				print('Error in gpio callback: {}'.format(e))
+
+
+	def _checked(self, channel):
+		if channel not in self._directions:
+			raise RuntimeError('The GPIO channel has not been set up')
+		return channel
+
+
+	@staticmethod
+	def _channels(channel):
+		return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+class FakeTank:
+	"""
+	Water tank seen through the level sensor pins of a FakeGpio
+	"""
+
+	def __init__(self, gpio, levelPins, level=-1):
+		"""
+		:param gpio: FakeGpio, level pins already set up as inputs
+		:param levelPins: list of (pin, level) tuples
+		:param level: integer, starting level, -1 when below every pin
+		"""
+		self._gpio = gpio
+		self._levelPins = sorted(levelPins, key=lambda item: item[1])
+		self._level = None
+		self.setLevel(level)
+
+
+	@property
+	def level(self):
+		return self._level
+
+
+	def setLevel(self, level):
+		"""
+		Every pin at or under the level is wet. Pins change in the order water would reach or leave them
+		:param level: integer
+		"""
+		pins = self._levelPins if self._level is None or level >= self._level else reversed(self._levelPins)
+		for pin, pinLevel in pins:
+			self._gpio.drive(pin, pinLevel <= level)
+		self._level = level
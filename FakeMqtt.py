@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from TopicRouter import TopicRouter
+try:
+	import queue as Queue
+except ImportError:
+	import Queue as Queue
+
+
+class FakeMessage:
+	"""
+	What paho hands to on_message
+	"""
+
+	def __init__(self, topic, payload):
+		self.topic = topic
+		self.payload = payload
+		self.qos = 0
+		self.retain = False
+		self.timestamp = time.monotonic()
+
+
+class FakeBroker:
+	"""
+	In process stand in for the mqtt broker, routes every publish to the clients subscribed to a matching topic filter
+	"""
+
+	def __init__(self):
+		self._clients = list()
+		self._lock = threading.Lock()
+		self._published = 0
+
+
+	def attach(self, client):
+		with self._lock:
+			if client not in self._clients:
+				self._clients.append(client)
+
+
+	def detach(self, client):
+		with self._lock:
+			if client in self._clients:
+				self._clients.remove(client)
+
+
+	def publish(self, topic, payload):
+		"""
+		:param topic: string
+		:param payload: bytes
+		"""
+		levels = topic.split('/')
+		with self._lock:
+			self._published += 1
+			clients = list(self._clients)
+
+		for client in clients:
+			if client.subscribed(levels):
+				client.deliver(FakeMessage(topic, payload))
+
+
+	@property
+	def published(self):
+		return self._published
+
+
+class FakeClient:
+	"""
+	Enough of the paho client api for our units to run against a FakeBroker
+	Like paho, on_connect and on_message are called on the client's own loop thread, started by loop_start
+	"""
+
+	_STOP = object()
+	_CONNECT = object()
+
+	def __init__(self, broker):
+		"""
+		:param broker: FakeBroker
+		"""
+		self.on_connect = None
+		self.on_message = None
+		self._broker = broker
+		self._filters = list()
+		self._queue = Queue.Queue()
+		self._loop = None
+		self.connected = threading.Event() # Set once on_connect returned, subscriptions are then in place
+
+
+	def connect(self, host='localhost', port=1883, keepalive=60):
+		self._broker.attach(self)
+		self._queue.put(self._CONNECT)
+		return 0
+
+
+	def disconnect(self):
+		self._broker.detach(self)
+		return 0
+
+
+	def subscribe(self, topic, qos=0):
+		"""
+		:param topic: string, or list of (topic, qos) tuples like paho accepts
+		"""
+		topics = [topic] if isinstance(topic, str) else [item[0] for item in topic]
+		for name in topics:
+			self._filters.append(name.split('/'))
+		return 0, 0
+
+
+	def unsubscribe(self, topic):
+		self._filters = [levels for levels in self._filters if '/'.join(levels) != topic]
+		return 0, 0
+
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		if isinstance(payload, str):
+			payload = payload.encode('utf-8')
+		self._broker.publish(topic, payload if payload is not None else b'')
+		return 0
+
+
+	def subscribed(self, levels):
+		"""
+		:param levels: list, topic split on '/'
+		:return: boolean, True if one of our filters matches the topic
+		"""
+		for pattern in self._filters:
+			if TopicRouter.matches(pattern, levels):
+				return True
+		return False
+
+
+	def deliver(self, message):
+		self._queue.put(message)
+
+
+	@property
+	def pending(self):
+		"""
+		:return: integer, messages not yet handed to on_message
+		"""
+		return self._queue.qsize()
+
+
+	def loop_start(self):
+		if self._loop is not None:
+			return
+		self._loop = threading.Thread(target=self._run)
+		self._loop.setDaemon(True)
+		self._loop.start()
+
+
+	def loop_stop(self, force=False):
+		if self._loop is None:
+			return
+		self._queue.put(self._STOP)
+		self._loop.join()
+		self._loop = None
+
+
+	def _run(self):
+		while True:
+			message = self._queue.get()
+			if message is self._STOP:
+				return
+
+			try:
+				if message is self._CONNECT:
+					if self.on_connect is not None:
+						self.on_connect(self, None, {}, 0)
+					self.connected.set()
+				elif self.on_message is not None:
+					self.on_message(self, None, message)
+			except Exception as e:
+				print('Error in fake mqtt callback: {}'.format(e))
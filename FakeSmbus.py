@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+import errno
+import threading
+import time
+
+
+class FakeSMBus:
+	"""
+	Stand in for smbus.SMBus and smbus2.SMBus. Devices are attached at an address and answer the reads and writes sent
+	to it, an address with nothing attached fails like the real bus does
+	Every call is a transaction, like every call is a round trip to the kernel on the real bus, i2c_rdwr included
+	"""
+
+	_I2C_M_RD = 0x0001
+
+	def __init__(self, bus=1):
+		self.bus = bus
+		self._devices = list()
+		self._lock = threading.Lock()
+		self._transactions = 0
+
+
+	def attach(self, device):
+		"""
+		:param device: object with an address attribute, read(register, length) and write(register, data) methods.
+		Devices are looked up by their current address, so that they can change it
+		"""
+		with self._lock:
+			self._devices.append(device)
+
+
+	def detach(self, device):
+		with self._lock:
+			if device in self._devices:
+				self._devices.remove(device)
+
+
+	@property
+	def transactions(self):
+		"""
+		:return: integer, bus transactions so far, failed ones included
+		"""
+		return self._transactions
+
+
+	def read_byte_data(self, address, register):
+		return self._device(address).read(register, 1)[0]
+
+
+	def read_word_data(self, address, register):
+		"""
+		Like smbus, the first byte received is the low byte of the word
+		"""
+		data = self._device(address).read(register, 2)
+		return data[0] | (data[1] << 8)
+
+
+	def read_i2c_block_data(self, address, register, length=32):
+		return list(self._device(address).read(register, length))
+
+
+	def write_byte(self, address, value):
+		self._device(address).write(value, b'')
+
+
+	def write_byte_data(self, address, register, value):
+		self._device(address).write(register, bytes([value]))
+
+
+	def write_word_data(self, address, register, value):
+		self._device(address).write(register, bytes([value & 0xFF, value >> 8]))
+
+
+	def i2c_rdwr(self, *messages):
+		"""
+		Runs smbus2 i2c_msg messages as one combined transaction. A write selects the register the next read of the same
+		device starts at, and is handed to the device as a command
+		:param messages: smbus2.i2c_msg
+		"""
+		with self._lock:
+			self._transactions += 1
+
+		registers = dict()
+		for message in messages:
+			device = self._find(message.addr)
+			if message.flags & self._I2C_M_RD:
+				data = device.read(registers.get(message.addr, 0), message.len)
+				ctypes.memmove(message.buf, data, message.len)
+			else:
+				data = bytes(message)
+				registers[message.addr] = data[0]
+				device.write(data[0], data[1:])
+
+
+	def close(self):
+		pass
+
+
+	def _device(self, address):
+		with self._lock:
+			self._transactions += 1
+		return self._find(address)
+
+
+	def _find(self, address):
+		with self._lock:
+			for device in self._devices:
+				if device.address == address:
+					return device
+		raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+
+
+class FakeChirp:
+	"""
+	Simulated Chirp soil moisture sensor, register for register
+	Reading the capacitance or the temperature returns the previous measurement and starts a new one, asking for light
+	starts a light measurement. Conversions can run at the same time, the sensor is busy until they are all over,
+	light taking longer the darker it is. A value is only updated once its conversion is over.
+	Registers are sent most significant byte first, which is why Chirp swaps the words it reads.
+	Once asleep, the first command fails and wakes the sensor up
+	"""
+
+	GET_CAPACITANCE = 0x00
+	SET_ADDRESS = 0x01
+	GET_ADDRESS = 0x02
+	MEASURE_LIGHT = 0x03
+	GET_LIGHT = 0x04
+	GET_TEMPERATURE = 0x05
+	RESET = 0x06
+	GET_VERSION = 0x07
+	SLEEP = 0x08
+	GET_BUSY = 0x09
+
+	VERSION = 0x26
+
+	# Seconds a measurement keeps the sensor busy
+	CAPACITANCE_TIME = 0.02
+	TEMPERATURE_TIME = 0.02
+	LIGHT_TIME = 0.05
+	DARK_LIGHT_TIME = 0.5 # Added in full darkness, in proportion to the darkness
+
+	def __init__(self, address=0x20, capacitance=400, temperature=21.5, light=20000, clock=time.monotonic):
+		"""
+		:param address: integer
+		:param capacitance: integer, raw moisture reading
+		:param temperature: float, celsius
+		:param light: integer, 0 is bright, 65535 is dark
+		:param clock: callable, returns seconds, to drive the timings from a test
+		"""
+		self.address = address
+		self.capacitance = capacitance
+		self.temperature = temperature
+		self.light = light
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._asleep = False
+		self._newAddress = None
+		self.busyChecks = 0
+		self._measured = {
+			self.GET_CAPACITANCE: capacitance,
+			self.GET_TEMPERATURE: int(round(temperature * 10)),
+			self.GET_LIGHT: light
+		}
+		# Conversions in progress, register to (value, end time). They run side by side, the sensor is busy until the last ends
+		self._converting = dict()
+
+
+	def read(self, register, length):
+		with self._lock:
+			self._wake()
+			now = self._clock()
+			self._settle(now)
+			if register == self.GET_BUSY:
+				self.busyChecks += 1
+				return bytes([1 if self._converting else 0])
+			if register == self.GET_VERSION:
+				return bytes([self.VERSION])
+			if register == self.GET_ADDRESS:
+				return bytes([self.address])
+
+			if register not in self._measured:
+				raise OSError(errno.EIO, 'Input/output error')
+
+			value = self._measured[register]
+			if register == self.GET_CAPACITANCE:
+				self._converting[register] = (int(self.capacitance), now + self.CAPACITANCE_TIME)
+			elif register == self.GET_TEMPERATURE:
+				self._converting[register] = (int(round(self.temperature * 10)), now + self.TEMPERATURE_TIME)
+
+			data = bytes([(value >> 8) & 0xFF, value & 0xFF])
+			return data[:length] + bytes(max(0, length - 2))
+
+
+	def write(self, register, data):
+		with self._lock:
+			self._wake()
+			now = self._clock()
+			self._settle(now)
+			if register == self.MEASURE_LIGHT:
+				self._converting[self.GET_LIGHT] = (int(self.light), now + self.LIGHT_TIME + self.DARK_LIGHT_TIME * self.light / 65535)
+			elif register == self.SET_ADDRESS:
+				self._newAddress = data[0]
+			elif register == self.RESET:
+				if self._newAddress is not None:
+					self.address, self._newAddress = self._newAddress, None
+				self._converting.clear()
+			elif register == self.SLEEP:
+				self._asleep = True
+
+
+	@property
+	def busy(self):
+		with self._lock:
+			self._settle(self._clock())
+			return bool(self._converting)
+
+
+	def _settle(self, now):
+		"""
+		Makes the values of the conversions that are over readable
+		"""
+		for register, (value, end) in list(self._converting.items()):
+			if now >= end:
+				self._measured[register] = value
+				del self._converting[register]
+
+
+	def _wake(self):
+		if self._asleep:
+			self._asleep = False
+			raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+
+
+if __name__ == '__main__':
+	# Reads a simulated Chirp the way trigger() used to, one value after the other checking the busy flag every 10ms,
+	# then with every conversion started at once, then with the registers read in combined transactions if smbus2 is
+	# installed, and reports how long a full acquisition takes and its i2c transactions
+	# Usage: python3 FakeSmbus.py [reads] [light]
+	from Chirp import Chirp
+	import sys
+
+	reads = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	light = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+	bus = FakeSMBus(1)
+	bus.attach(FakeChirp(0x20, light=light))
+	chirp = Chirp(bus=bus, address=0x20, min_moist=217, max_moist=626, batch=False)
+
+	def sequential():
+		chirp.temp = chirp._read_temp()
+		chirp.moist = chirp._read_moist()
+		chirp.light = chirp._read_light()
+
+	runs = [
+		('sequential, 10ms polling', chirp, sequential, False),
+		('pipelined, 10ms polling', chirp, chirp.trigger, False),
+		('pipelined, adaptive wait', chirp, chirp.trigger, True)
+	]
+	try:
+		batched = Chirp(bus=bus, address=0x20, min_moist=217, max_moist=626, batch=True)
+		runs.append(('batched, adaptive wait', batched, batched.trigger, True))
+	except ImportError:
+		print('smbus2 is not installed, the batched reads are not measured')
+
+	for name, sensor, acquire, adaptive in runs:
+		sensor.busy_sleep_min = 0.0005 if adaptive else sensor.busy_sleep
+		transactions = bus.transactions
+		elapsed = 0
+		for _ in range(reads):
+			if not adaptive:
+				sensor._last_waits.clear()
+			start = time.perf_counter()
+			acquire()
+			elapsed += time.perf_counter() - start
+		print('{:25s} {:7.1f}ms  {:5.1f} i2c transactions  moist {}% temp {} light {}'.format(
+			name,
+			elapsed / reads * 1000,
+			(bus.transactions - transactions) / reads,
+			sensor.moist_percent, sensor.temp, sensor.light
+		))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import threading
+
+
+class FakeSpi:
+	"""
+	Stand in for busio.SPI that records every frame written to it, for the leds to run without a strip
+	"""
+
+	def __init__(self, keep=100):
+		"""
+		:param keep: integer, frames kept, the oldest are forgotten
+		"""
+		self._frames = deque(maxlen=keep)
+		self._lock = threading.Lock()
+		self._locked = False
+		self._baudrate = 100000
+		self._count = 0
+		self._bytes = 0
+
+
+	def try_lock(self):
+		with self._lock:
+			if self._locked:
+				return False
+			self._locked = True
+			return True
+
+
+	def unlock(self):
+		with self._lock:
+			self._locked = False
+
+
+	def configure(self, baudrate=100000, polarity=0, phase=0, bits=8):
+		self._baudrate = baudrate
+
+
+	def write(self, buf, start=0, end=None):
+		frame = bytes(buf[start:end])
+		with self._lock:
+			self._frames.append(frame)
+			self._count += 1
+			self._bytes += len(frame)
+
+
+	def deinit(self):
+		self.unlock()
+
+
+	@property
+	def frames(self):
+		"""
+		:return: list of bytes, the last frames written, oldest first
+		"""
+		with self._lock:
+			return list(self._frames)
+
+
+	@property
+	def count(self):
+		"""
+		:return: integer, frames written so far
+		"""
+		return self._count
+
+
+	@property
+	def busTime(self):
+		"""
+		:return: float, seconds the frames written so far would have kept the bus busy at the configured baudrate
+		"""
+		return self._bytes * 8 / self._baudrate
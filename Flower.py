@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from Chirp import Chirp
+from ChirpBus import ChirpBus
+from Codec import Codec
+from Config import Config
 from FlowerStates import State
-import json
+from Hardware import Hardware
 from Leds import Leds
 import logging
+from Metrics import Metrics
 import os
 import paho.mqtt.client as mqtt
+from Profiler import Profiler
 import pytoml
-import RPi.GPIO as gpio
 import sys
 import threading
 import time
+from TopicRouter import TopicRouter
+from WaterLevel import WaterLevel
 
 class Flower:
 
@@ -26,6 +31,23 @@ class Flower:
 
 	_PUMP_PIN = 26 #37
 
+	_WATER_BOUNCE_TIME = 50 # Milliseconds, the level pins chatter while the water surface moves
+
+	_CHIRP_ATTEMPTS = 3 # Measurements of a failing chirp sensor before its pot is skipped until the next report
+
+	# Leds lit for each water level, while filling and while emptying
+	# Level each level pin stands for, highest first
+	WATER_LEVEL_PINS = [
+		(_WATER_FULL_PIN, 100),
+		(_WATER_75_PIN, 75),
+		(_WATER_50_PIN, 50),
+		(_WATER_25_PIN, 25),
+		(_WATER_EMPTY_PIN, 0)
+	]
+
+	_FILLING_LEDS = {50: 3, 25: 2, 0: 1, -1: 0}
+	_EMPTYING_LEDS = {100: 5, 75: 4, 50: 3, 25: 2}
+
 	_MQTT_DO_WATER = 'snipsmyflower/flowers/doWater'
 	_MQTT_GET_TELEMETRY = 'snipsmyflower/flowers/getTelemetry'
 	_MQTT_TELEMETRY_REPORT = 'snipsmyflower/flowers/telemetryData'
@@ -37,27 +59,54 @@ class Flower:
 
 	_MQTT_REFUSED = 'snipsmyflower/flowers/refused'
 	_MQTT_ALERT_USER = 'snipsmyflower/flowers/alertUser'
+	_MQTT_STATS = 'snipsmyflower/stats'
+	_MQTT_PROFILE = 'snipsmyflower/admin/profile'
+	_MQTT_PROFILE_RESULT = 'snipsmyflower/admin/profileResult'
 
-	def __init__(self):
+	def __init__(self, hardware=None, mqttClient=None, snipsConf=None):
 		"""
 		Initiliazes the flower instance
 		Tries to connect to master mqtt, gets its site id, loads itself and starts the 5 minute monitoring thread
 		It also tells the master device that it is connected
+		:param hardware: Hardware, the one set in config if None. Simulated hardware lets a flower run off a pi
+		:param mqttClient: paho client like object to use instead of a new paho client
+		:param snipsConf: dict, snips configuration to use instead of /etc/snips.toml
 		"""
 		self._logger = logging.getLogger('SnipsMyFlower')
 		self._state = State.BOOTING
-		gpio.setmode(gpio.BCM)
-		gpio.setwarnings(False)
-		gpio.setup(self._PUMP_PIN, gpio.OUT)
-		gpio.setup(self._WATER_SENSOR_PIN, gpio.OUT)
-		gpio.setup(self._WATER_EMPTY_PIN, gpio.IN, gpio.PUD_DOWN)
-		gpio.setup(self._WATER_25_PIN, gpio.IN, gpio.PUD_DOWN)
-		gpio.setup(self._WATER_50_PIN, gpio.IN, gpio.PUD_DOWN)
-		gpio.setup(self._WATER_75_PIN, gpio.IN, gpio.PUD_DOWN)
-		gpio.setup(self._WATER_FULL_PIN, gpio.IN, gpio.PUD_DOWN)
-
+		self._potStates = dict()
+		self._config = Config()
+		self._hardware = hardware if hardware is not None else Hardware(
+			self._config.get('hardware', 'backend', Hardware.PI),
+			self._config.get('hardware', 'i2c', Hardware.SMBUS)
+		)
+		self._gpio = self._hardware.gpio
+		self._gpio.setmode(self._gpio.BCM)
+		self._gpio.setwarnings(False)
+		self._gpio.setup(self._PUMP_PIN, self._gpio.OUT)
+		self._gpio.setup(self._WATER_SENSOR_PIN, self._gpio.OUT)
+		self._gpio.setup(self._WATER_EMPTY_PIN, self._gpio.IN, self._gpio.PUD_DOWN)
+		self._gpio.setup(self._WATER_25_PIN, self._gpio.IN, self._gpio.PUD_DOWN)
+		self._gpio.setup(self._WATER_50_PIN, self._gpio.IN, self._gpio.PUD_DOWN)
+		self._gpio.setup(self._WATER_75_PIN, self._gpio.IN, self._gpio.PUD_DOWN)
+		self._gpio.setup(self._WATER_FULL_PIN, self._gpio.IN, self._gpio.PUD_DOWN)
+		self._waterLevel = WaterLevel(
+			self._gpio,
+			self._WATER_SENSOR_PIN,
+			self.WATER_LEVEL_PINS,
+			bounceTime=self._WATER_BOUNCE_TIME,
+			listener=self._onWaterLevel
+		)
+
+		self._metrics = Metrics()
+		self._received = self._metrics.counter('mqtt_received_total', 'Mqtt messages received')
+		self._chirpTime = self._metrics.histogram('chirp_trigger_seconds', 'Time spent reading the chirp sensor')
+		self._chirpErrors = self._metrics.counter('chirp_errors_total', 'Chirp readings that failed or made no sense')
+
+		self._profiler = self._createProfiler()
 		self._mqtt = None
-		self._snipsConf = self._loadSnipsConfiguration()
+		self._router = self._buildRouter()
+		self._snipsConf = snipsConf if snipsConf is not None else self._loadSnipsConfiguration()
 		if self._snipsConf is None:
 			self._logger.error('snips-audio-server not installed, stopping')
 			sys.exit()
@@ -66,7 +115,7 @@ class Flower:
 			self._logger.error("Snips satellite is not configured. Please edit /etc/snips.toml and configure ['snips-common']['mqtt'] and try to start me again")
 			sys.exit()
 		else:
-			self._mqtt = self._connectMqtt()
+			self._mqtt = self._connectMqtt(mqttClient)
 			if not self._mqtt:
 				self._logger.error("Couldn't connect to mqtt broker")
 				sys.exit()
@@ -77,31 +126,106 @@ class Flower:
 			sys.exit()
 
 		self._me = {'type': str(self._siteId).replace('_', ' ')}
-		self._moistureSensor = Chirp(address=0x20,
-                    read_moist=True,
-                    read_temp=True,
-                    read_light=True,
-                    min_moist=217,
-                    max_moist=626,
-                    temp_scale='celsius',
-                    temp_offset=-0.5)
-		self._leds = Leds()
+		self._siteIdPayload = Codec.siteIdPayload(self._siteId)
+		self._chirps = self._createChirpBus()
+		self._pots = self._createPots()
+		self._siteIds = set(pot['siteId'] for pot in self._pots)
+		self._siteIds.add(self._siteId)
+		self._metrics.callback('chirp_sensors', 'Chirp sensors in use', lambda: len(self._pots))
+		self._leds = Leds(self._hardware, self._metrics)
 		self._leds.onStart()
 		self._watering = threading.Timer(interval=10.0, function=self._pump, args=[False])
 		self._monitoring = None
 		self._refilling = None
 		self._emptying = None
 		self._onFiveMinute()
+		self._startMetrics()
 		self._state = State.READY
 
 
-	def _connectMqtt(self):
+	def _createChirpBus(self):
+		"""
+		Finds the Chirp sensors, each calibrated from its own config section if it has one
+		:return: ChirpBus
+		"""
+		calibrations = dict()
+		for section in self._config.sections('chirp '):
+			calibrations[int(section.split()[1], 0)] = self._chirpCalibration(section)
+
+		chirps = ChirpBus(
+			self._hardware.i2c(self._config.getInt('chirp', 'bus', 1)),
+			calibrations,
+			self._chirpCalibration('chirp'),
+			batch=self._hardware.i2cDriver == Hardware.SMBUS2
+		)
+		if not chirps.scan():
+			self._logger.error('No chirp sensor found, using the one at 0x20')
+			chirps.add(0x20)
+		return chirps
+
+
+	def _chirpCalibration(self, section):
+		"""
+		:param section: string, config section
+		:return: dict, the calibration settings present in that section
+		"""
+		calibration = dict()
+		for key, fallback in ChirpBus.DEFAULT_CALIBRATION.items():
+			if self._config.get(section, key) is not None:
+				calibration[key] = self._config.getFloat(section, key, fallback)
+		return calibration
+
+
+	def _createPots(self):
+		"""
+		Each sensor is a plant of its own for the main unit. The first one is the satellite itself
+		:return: list of dicts, the address, site id, plant and telemetry payload of every sensor
+		"""
+		pots = list()
+		for address in self._chirps.addresses:
+			section = 'chirp {:#04x}'.format(address)
+			siteId = self._siteId if not pots else '{}_{:02x}'.format(self._siteId, address)
+			siteId = self._config.get(section, 'siteId', siteId)
+			plant = self._config.get(section, 'plant', self._me['type'])
+			pots.append({
+				'address': address,
+				'siteId': siteId,
+				'plant': plant,
+				'payload': Codec.partial({'siteId': siteId, 'plant': plant}, 'data')
+			})
+			self._logger.info('Chirp sensor at {:#04x} reports as {}, a {}'.format(address, siteId, plant))
+		return pots
+
+
+	def _startMetrics(self):
+		"""
+		Serves our metrics over http and publishes them to the main unit, each if enabled in config
+		"""
+		port = self._config.getInt('metrics', 'port', 9108)
+		if port > 0:
+			self._metrics.serve(port, self._config.get('metrics', 'host', '127.0.0.1'))
+
+		interval = self._config.getFloat('metrics', 'statsInterval', 60)
+		if interval > 0:
+			self._metrics.report(self._publishStats, interval)
+
+
+	def _publishStats(self, snapshot):
+		"""
+		:param snapshot: dict, our metrics
+		"""
+		self._mqtt.publish(topic=self._MQTT_STATS, payload=Codec.dumps({'siteId': self._siteId, 'metrics': snapshot}))
+
+
+	def _connectMqtt(self, mqttClient=None):
 		"""
 		Connects to master mqtt as defined in snips.toml
+		:param mqttClient: client to connect, a new paho client if None
 		:return:
 		"""
 		try:
-			mqttClient = mqtt.Client()
+			if mqttClient is None:
+				mqttClient = mqtt.Client()
 			mqttClient.on_connect = self._onConnect
 			mqttClient.on_message = self._onMessage
 			mqttClient.connect(self._snipsConf['snips-common']['mqtt'].split(':')[0], int(self._snipsConf['snips-common']['mqtt'].split(':')[1]))
@@ -143,127 +267,195 @@ class Flower:
 		Called when the program goes down. Joins the threads and cleans up the gpios
 		:return:
 		"""
-		if self._watering.isAlive():
+		if self._watering.is_alive():
 			self._watering.cancel()
 			self._watering.join(timeout=2)
 
-		if self._monitoring.isAlive():
+		if self._monitoring.is_alive():
 			self._monitoring.cancel()
 			self._monitoring.join(timeout=2)
 
-		if self._refilling is not None and self._refilling.isAlive():
+		if self._refilling is not None and self._refilling.is_alive():
 			self._refilling.join(timeout=2)
 
-		if self._emptying is not None and self._emptying.isAlive():
+		if self._emptying is not None and self._emptying.is_alive():
 			self._emptying.join(timeout=2)
 
+		self._waterLevel.stop()
+
+		self._metrics.onStop()
+		if self._profiler is not None:
+			self._profiler.onStop()
 		self._leds.onStop()
-		gpio.cleanup()
+		self._gpio.cleanup()
 
 
 	def _onConnect(self, client, userdata, flags, rc):
 		"""
 		Called when mqtt connects. Does subscribe to all our intents
+		This can run before _connectMqtt returned, the client is the one given here
+		"""
+		client.subscribe([(topic, 0) for topic in self._router.topics])
+
+
+	def _buildRouter(self):
+		"""
+		Maps every topic we handle to its handler, along with the payload fields that handler needs
+		:return: TopicRouter
+		"""
+		router = TopicRouter(self._metrics)
+		router.register(self._MQTT_DO_WATER, self._onDoWater)
+		router.register(self._MQTT_PLANT_ALERT, self._onPlantAlert, fields=('telemetry', 'limit'))
+		router.register(self._MQTT_REFILL_MODE, self._onRefillMode)
+		router.register(self._MQTT_EMPTY_WATER, self._onEmptyWater)
+		if self._profiler is not None:
+			router.register(self._MQTT_PROFILE, self._onProfile)
+		return router
+
+
+	def _createProfiler(self):
+		"""
+		Profiling on demand is only possible if enabled in config, otherwise the topic isn't even subscribed to
+		:return: Profiler, or None
 		"""
-		self._mqtt.subscribe([
-			(self._MQTT_GET_TELEMETRY, 0),
-			(self._MQTT_DO_WATER, 0),
-			(self._MQTT_PLANT_ALERT, 0),
-			(self._MQTT_REFILL_MODE, 0),
-			(self._MQTT_EMPTY_WATER, 0)
-		])
+		if not self._config.getBoolean('profiler', 'enabled', False):
+			return None
+
+		return Profiler(
+			'profiles',
+			interval=self._config.getInt('profiler', 'interval', 5),
+			maxDuration=self._config.getFloat('profiler', 'maxDuration', 60)
+		)
 
 
 	def _onMessage(self, client, userdata, message):
 		"""
 		Called whenever a message we are subscribed to enters
 		"""
+		self._received.inc()
 		try:
-			payload = json.loads(message.payload.decode('utf-8'))
+			payload = Codec.loads(message.payload)
 		except:
 			payload = dict()
 
-		if 'siteId' not in payload or payload['siteId'] != self._siteId:
+		if not isinstance(payload, dict) or 'siteId' not in payload or payload['siteId'] not in self._siteIds:
+			return
+
+		self._router.route(message.topic, payload)
+
+
+	def _onProfile(self, topic, payload):
+		try:
+			duration = float(payload.get('duration', 10))
+		except (TypeError, ValueError):
+			self._logger.error('Invalid profile duration: {}'.format(payload.get('duration')))
 			return
 
-		topic = message.topic
-
-		if topic == self._MQTT_DO_WATER:
-			if self._state == State.FILLING or self._state == State.EMPTYING or self._state == State.WATERING or self._watering.isAlive():
-				return
-
-			self._doWater()
-
-		elif topic == self._MQTT_PLANT_ALERT:
-			if self._state == State.EMPTYING or self._state == State.FILLING:
-				return
-
-			telemetry = payload['telemetry']
-			limit = payload['limit']
-			if telemetry == 'temperature':
-				if limit == 'min':
-					if self._state != State.COLD:
-						self._state = State.COLD
-						self._alertUser(telemetry, limit)
-				else:
-					if self._state != State.HOT:
-						self._state = State.HOT
-						self._alertUser(telemetry, limit)
-			elif telemetry == 'moisture':
-				if limit == 'min':
-					self._state = State.THIRSTY
-					self._doWater()
-				else:
-					if self._state != State.DRAWNED:
-						self._state = State.DRAWNED
-						self._alertUser(telemetry, limit)
-			elif telemetry == 'luminosity':
-				if limit == 'min':
-					if self._state != State.TOO_DARK:
-						self._state = State.TOO_DARK
-						self._alertUser(telemetry, limit)
-				else:
-					if self._state != State.TOO_BRIGHT:
-						self._state = State.TOO_BRIGHT
-						self._alertUser(telemetry, limit)
-			elif telemetry == 'water':
-				if self._state != State.OUT_OF_WATER:
-					self._state = State.OUT_OF_WATER
-					self._alertUser(telemetry, limit)
+		if not self._profiler.start(duration, self._publishProfile):
+			self._logger.warning('A profile is already running')
+
+
+	def _publishProfile(self, summary):
+		"""
+		:param summary: dict, where the profile was written and the functions we spent the most time in
+		"""
+		self._logger.info('Profile written to {}'.format(summary['file']))
+		summary['siteId'] = self._siteId
+		self._mqtt.publish(topic=self._MQTT_PROFILE_RESULT, payload=Codec.dumps(summary))
+
+
+	def _isBusy(self):
+		"""
+		:return: boolean, True if we are filling, emptying or watering
+		"""
+		return self._state == State.FILLING or self._state == State.EMPTYING or self._state == State.WATERING or self._watering.is_alive()
+
+
+	def _onDoWater(self, topic, payload):
+		if self._isBusy():
+			return
+
+		self._doWater()
+
+
+	def _onPlantAlert(self, topic, payload):
+		"""
+		Each pot has an alert state of its own, so that a pot doing fine doesn't clear the alert of another one and the
+		user is only alerted once per pot. The tank is shared, running out of water is the satellite state
+		"""
+		if self._state == State.EMPTYING or self._state == State.FILLING:
+			return
+
+		siteId = payload['siteId']
+		telemetry = payload['telemetry']
+		limit = payload['limit']
+		if telemetry == 'temperature':
+			self._setPotState(siteId, State.COLD if limit == 'min' else State.HOT, telemetry, limit)
+		elif telemetry == 'moisture':
+			if limit == 'min':
+				self._potStates[siteId] = State.THIRSTY
+				self._doWater(siteId)
 			else:
+				self._setPotState(siteId, State.DRAWNED, telemetry, limit)
+		elif telemetry == 'luminosity':
+			self._setPotState(siteId, State.TOO_DARK if limit == 'min' else State.TOO_BRIGHT, telemetry, limit)
+		elif telemetry == 'water':
+			if self._state != State.OUT_OF_WATER:
+				self._state = State.OUT_OF_WATER
+				self._alertUser(telemetry, limit, siteId)
+		else:
+			self._potStates[siteId] = State.OK
+			# Every pot drinks from the same tank, one doing fine means there's water
+			if self._state == State.OUT_OF_WATER:
 				self._state = State.OK
-				self._leds.clear()
+			self._leds.clear()
+
+		self._onAlert(telemetry, limit)
+
+
+	def _setPotState(self, siteId, state, telemetry, limit):
+		"""
+		Alerts the user if the pot wasn't in that state already
+		:param siteId: string, the pot
+		:param state: State
+		:param telemetry: string
+		:param limit: string
+		"""
+		if self._potStates.get(siteId) != state:
+			self._potStates[siteId] = state
+			self._alertUser(telemetry, limit, siteId)
 
-			self._onAlert(telemetry, limit)
 
-		elif topic == self._MQTT_REFILL_MODE:
-			if self._state == State.FILLING or self._state == State.EMPTYING or self._state == State.WATERING or self._watering.isAlive():
-				self._mqtt.publish(topic=self._MQTT_REFUSED, payload=json.dumps({'siteId': self._siteId}))
-				return
+	def _onRefillMode(self, topic, payload):
+		if self._isBusy():
+			self._mqtt.publish(topic=self._MQTT_REFUSED, payload=self._siteIdPayload)
+			return
+
+		self._refilling = threading.Thread(target=self._refillingMode)
+		self._refilling.setDaemon(True)
+		self._refilling.start()
 
-			self._refilling = threading.Thread(target=self._refillingMode)
-			self._refilling.setDaemon(True)
-			self._refilling.start()
 
-		elif topic == self._MQTT_EMPTY_WATER:
-			if self._state == State.FILLING or self._state == State.EMPTYING or self._state == State.WATERING or self._watering.isAlive():
-				self._mqtt.publish(topic=self._MQTT_REFUSED, payload=json.dumps({'siteId': self._siteId}))
-				return
+	def _onEmptyWater(self, topic, payload):
+		if self._isBusy():
+			self._mqtt.publish(topic=self._MQTT_REFUSED, payload=self._siteIdPayload)
+			return
 
-			self._emptying = threading.Thread(target=self._emptyingMode)
-			self._emptying.setDaemon(True)
-			self._emptying.start()
+		self._emptying = threading.Thread(target=self._emptyingMode)
+		self._emptying.setDaemon(True)
+		self._emptying.start()
 
 
-	def _doWater(self):
+	def _doWater(self, siteId=None):
 		"""
 		Turns the internal pump on and starts a 5 second timer to turn it off again
+		:param siteId: string, the pot that needs water, the satellite if None
 		"""
-		if self._watering.isAlive():
+		if self._watering.is_alive():
 			return
 
 		if self._state == State.OUT_OF_WATER:
-			self._alertUser('water', 'min')
+			self._alertUser('water', 'min', siteId)
 			return
 
 		self._pump()
@@ -272,105 +464,72 @@ class Flower:
 		self._watering.start()
 
 
-	def _alertUser(self, telemetry, limit):
+	def _alertUser(self, telemetry, limit, siteId=None):
 		"""
-		Sends a message to main unit for it to alert the user
+		Sends a message to main unit for it to alert the user, through the satellite the pot stands next to
 		:param telemetry: string
 		:param limit: string
+		:param siteId: string, the pot the alert is about, the satellite if None
 		"""
-		self._mqtt.publish(topic=self._MQTT_ALERT_USER, payload=json.dumps({'siteId': self._siteId, 'telemetry': telemetry, 'limit': limit}))
+		siteId = siteId if siteId is not None else self._siteId
+		self._mqtt.publish(topic=self._MQTT_ALERT_USER, payload=Codec.constant(('siteId', siteId), ('satellite', self._siteId), ('telemetry', telemetry), ('limit', limit)))
 
 
 	def _refillingMode(self):
 		"""
-		User asked for tank refilling. We need to update the led indicator according to water level
-		and to alert the user when the level is full which will stop the refilling mode
+		User asked for tank refilling. The level tracker updates the led indicator as the water rises,
+		this waits for the level to be full, which alerts the user and stops the refilling mode
 		"""
 		self._state = State.FILLING
 		self._leds.clear()
-		gpio.output(self._WATER_SENSOR_PIN, gpio.HIGH)
-		was = 0
+		self._waterLevel.start()
 		while self._state == State.FILLING:
-			if gpio.input(self._WATER_75_PIN):
+			if self._waterLevel.wait(lambda level: level >= 75, timeout=1):
 				self._state = State.OK
 				self._leds.onDisplayLevel(4, [0, 0, 255])
 				time.sleep(2)
 				self._leds.onDisplayLevel(5, [0, 0, 255])
-				self._mqtt.publish(topic=self._MQTT_REFILL_FULL, payload=json.dumps({'siteId': self._siteId}))
+				self._mqtt.publish(topic=self._MQTT_REFILL_FULL, payload=self._siteIdPayload)
 				self._onFiveMinute() # Manually trigger onFiveMinutes to send data to the main unit
 				time.sleep(5)
 				self._leds.clear()
-			#elif gpio.input(self._WATER_75_PIN):
-			#	if was != 75:
-			#		was = 75
-			#		self._leds.onDisplayLevel(4, [0, 0, 255])
-			elif gpio.input(self._WATER_50_PIN):
-				if was != 50:
-					was = 50
-					self._leds.onDisplayLevel(3, [0, 0, 255])
-			elif gpio.input(self._WATER_25_PIN):
-				if was != 25:
-					was = 25
-					self._leds.onDisplayLevel(2, [0, 0, 255])
-			elif gpio.input(self._WATER_EMPTY_PIN):
-				if was != 0:
-					was = 0
-					self._leds.onDisplayLevel(1, [0, 0, 255])
-			else:
-				if was != -1:
-					was = -1
-					self._leds.onDisplayLevel(0, [0, 0, 255])
-
-			time.sleep(0.25)
 
-		gpio.output(self._WATER_SENSOR_PIN, gpio.LOW)
+		self._waterLevel.stop()
 
 
 	def _emptyingMode(self):
 		"""
-		User asked to empty the tank. Let's run the pump for as long as the sensor returns not -1
+		User asked to empty the tank. Let's run the pump until the level drops below the lowest pin,
+		the level tracker updates the led indicator meanwhile
 		"""
 		self._state = State.EMPTYING
 		self._leds.clear()
-		gpio.output(self._WATER_SENSOR_PIN, gpio.HIGH)
+		self._waterLevel.start()
 		self._pump()
-		was = 0
 		while self._state == State.EMPTYING:
-			if gpio.input(self._WATER_FULL_PIN):
-				if was != 100:
-					was = 100
-					self._leds.onDisplayLevel(5, [0, 0, 255])
-			elif gpio.input(self._WATER_75_PIN):
-				if was != 75:
-					was = 75
-					self._leds.onDisplayLevel(4, [0, 0, 255])
-			elif gpio.input(self._WATER_50_PIN):
-				if was != 50:
-					was = 50
-					self._leds.onDisplayLevel(3, [0, 0, 255])
-			elif gpio.input(self._WATER_25_PIN):
-				if was != 25:
-					was = 25
-					self._leds.onDisplayLevel(2, [0, 0, 255])
-			#elif gpio.input(self._WATER_EMPTY_PIN):
-			#	if was != 0:
-			#		was = 0
-			#		self._leds.onDisplayLevel(1, [0, 0, 255])
-			else:
-				if was != -1:
-					was = -1
-					self._leds.onDisplayLevel(1, [0, 0, 255])
-					time.sleep(5)
-					self._leds.onDisplayLevel(0, [0, 0, 255])
-					time.sleep(10)
-					self._pump(False)
-					self._mqtt.publish(topic=self._MQTT_WATER_EMPTIED, payload=json.dumps({'siteId': self._siteId}))
-					self._state = State.OUT_OF_WATER
-					self._onFiveMinute()  # Manually trigger onFiveMinutes to send data to the main unit
+			if self._waterLevel.wait(lambda level: level <= 0, timeout=1):
+				self._leds.onDisplayLevel(1, [0, 0, 255])
+				time.sleep(5)
+				self._leds.onDisplayLevel(0, [0, 0, 255])
+				time.sleep(10)
+				self._pump(False)
+				self._mqtt.publish(topic=self._MQTT_WATER_EMPTIED, payload=self._siteIdPayload)
+				self._state = State.OUT_OF_WATER
+				self._onFiveMinute()  # Manually trigger onFiveMinutes to send data to the main unit
+
+		self._waterLevel.stop()
 
-			time.sleep(0.25)
 
-		gpio.output(self._WATER_SENSOR_PIN, gpio.LOW)
+	def _onWaterLevel(self, level):
+		"""
+		Called by the level tracker whenever the water level changes while filling or emptying
+		Reaching full while filling and empty while emptying are shown by the refilling and emptying threads
+		:param level: integer
+		"""
+		if self._state == State.FILLING and level < 75:
+			self._leds.onDisplayLevel(self._FILLING_LEDS[level], [0, 0, 255])
+		elif self._state == State.EMPTYING and level > 0:
+			self._leds.onDisplayLevel(self._EMPTYING_LEDS[level], [0, 0, 255])
 
 
 	def _onFiveMinute(self):
@@ -378,7 +537,7 @@ class Flower:
 		Called every 5 minutes, this method does ask for the latest sensor data and sends them to the main unit
 		It also runs checks on the data to alert the user if needed
 		"""
-		if self._monitoring is not None and self._monitoring.isAlive():
+		if self._monitoring is not None and self._monitoring.is_alive():
 			self._monitoring.cancel()
 
 		self._monitoring = threading.Timer(interval=300, function=self._onFiveMinute)
@@ -391,14 +550,12 @@ class Flower:
 
 	def _sendData(self):
 		"""
-		Sends telemetry data to main unit
+		Sends the telemetry data of every pot to main unit
 		"""
-		data = self._queryTelemetryData()
-		self._mqtt.publish(topic=self._MQTT_TELEMETRY_REPORT, payload=json.dumps({
-			'siteId': self._siteId,
-			'plant': self._me['type'],
-			'data': data
-		}))
+		telemetry = self._queryTelemetryData()
+		for pot in self._pots:
+			if pot['siteId'] in telemetry:
+				self._mqtt.publish(topic=self._MQTT_TELEMETRY_REPORT, payload=pot['payload'](telemetry[pot['siteId']]))
 
 
 	def _onAlert(self, sensor, limit):
@@ -428,52 +585,53 @@ class Flower:
 		"""
 		if on:
 			#self._state = State.WATERING
-			gpio.output(self._PUMP_PIN, gpio.HIGH)
+			self._gpio.output(self._PUMP_PIN, self._gpio.HIGH)
 		else:
 			#self._state = State.OK
-			gpio.output(self._PUMP_PIN, gpio.LOW)
+			self._gpio.output(self._PUMP_PIN, self._gpio.LOW)
 
 
 	def _queryTelemetryData(self):
 		"""
-		Gets and returns all sensors data
-		:return: dict
-		"""
-		data = dict({'siteId': self._siteId})
-		try: # Chirp sometimes crashes, in which case we simply recall the telemetry query
-			#self._moistureSensor.wake_up()
-			self._moistureSensor.trigger()
-			time.sleep(1)
-			moisture = self._moistureSensor.moist_percent
-			light = self._moistureSensor.light
-			temperature = self._moistureSensor.temp
-			#self._moistureSensor.sleep()
-			if moisture > 100 or moisture < 0 or temperature > 100:
-				raise Exception('Impossible chirp sensor values')
-			else:
-				light = round((100 / 65535) * light, 2) # 65535 is dark, 0 is bright, turn this to percentage before sending
-				data['temperature'] = temperature
-				data['luminosity'] = light
-				data['moisture'] = moisture
-		except Exception as e:
-			self._logger.error(e)
-			return self._queryTelemetryData()
-
-		gpio.output(self._WATER_SENSOR_PIN, gpio.HIGH)
-		if gpio.input(self._WATER_FULL_PIN):
-			data['water'] = 100
-		elif gpio.input(self._WATER_75_PIN):
-			data['water'] = 75
-		elif gpio.input(self._WATER_50_PIN):
-			data['water'] = 50
-		elif gpio.input(self._WATER_25_PIN):
-			data['water'] = 25
-		elif gpio.input(self._WATER_EMPTY_PIN):
-			data['water'] = 0
-		else:
-			data['water'] = -1
-		gpio.output(self._WATER_SENSOR_PIN, gpio.LOW)
-
-		#print('Moisture: {}% temperature: {:.1f}°C light: {} lux water: {}'.format(moisture, temperature, light, data['water']))
-		return data
-
+		Gets and returns all sensors data. The sensors are measured all at once
+		Chirp sometimes crashes, in which case the sensors that failed are measured again, a pot still failing is skipped
+		:return: dict, site id to data, for every pot measured
+		"""
+		water = self._waterLevel.read()
+		telemetry = dict()
+		pots = list(self._pots)
+		for _ in range(self._CHIRP_ATTEMPTS):
+			start = time.perf_counter()
+			failed = self._chirps.trigger([pot['address'] for pot in pots])
+			self._chirpTime.observe(time.perf_counter() - start)
+
+			retry = list()
+			for pot in pots:
+				sensor = self._chirps.sensors[pot['address']]
+				try:
+					if pot['address'] in failed:
+						raise failed[pot['address']]
+
+					moisture = sensor.moist_percent
+					temperature = sensor.temp
+					if moisture > 100 or moisture < 0 or temperature > 100:
+						raise Exception('Impossible chirp sensor values')
+				except Exception as e:
+					self._chirpErrors.inc()
+					self._logger.error('Chirp sensor at {:#04x}: {}'.format(pot['address'], e))
+					retry.append(pot)
+					continue
+
+				telemetry[pot['siteId']] = {
+					'siteId': pot['siteId'],
+					'temperature': temperature,
+					'luminosity': round((100 / 65535) * sensor.light, 2), # 65535 is dark, 0 is bright, turn this to percentage before sending
+					'moisture': moisture,
+					'water': water
+				}
+
+			if not retry:
+				break
+			pots = retry
+
+		return telemetry
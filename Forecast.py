@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import threading
+
+
+class LinearTrends:
+	"""
+	Least squares lines through the recent samples of many series at once, one row per series
+	Each row keeps its last samples in a ring buffer along with the running sums of the normal equations, so that a new
+	sample costs O(1) and the slopes of every series are solved in a single vectorized computation
+	"""
+
+	def __init__(self, window, capacity=64):
+		"""
+		:param window: integer, number of samples the lines are fitted on
+		:param capacity: integer, initial number of rows, grown as needed
+		"""
+		self._window = window
+		self._times = np.zeros((capacity, window))
+		self._values = np.zeros((capacity, window))
+		self._origin = np.zeros(capacity) # Timestamp the row's times are relative to, keeps the sums small
+		self._position = np.zeros(capacity, dtype=np.int64)
+		self._count = np.zeros(capacity, dtype=np.int64)
+		# Running sums, t, y, t², ty, with t in hours since the origin
+		self._sums = np.zeros((capacity, 4))
+
+
+	def __len__(self):
+		return len(self._count)
+
+
+	def grow(self, capacity):
+		"""
+		:param capacity: integer, new number of rows
+		"""
+		extra = capacity - len(self._count)
+		if extra <= 0:
+			return
+
+		self._times = np.concatenate((self._times, np.zeros((extra, self._window))))
+		self._values = np.concatenate((self._values, np.zeros((extra, self._window))))
+		self._origin = np.concatenate((self._origin, np.zeros(extra)))
+		self._position = np.concatenate((self._position, np.zeros(extra, dtype=np.int64)))
+		self._count = np.concatenate((self._count, np.zeros(extra, dtype=np.int64)))
+		self._sums = np.concatenate((self._sums, np.zeros((extra, 4))))
+
+
+	def reset(self, row):
+		"""
+		Forgets a series, like when a plant is watered and its moisture decay starts over
+		:param row: integer
+		"""
+		self._count[row] = 0
+		self._position[row] = 0
+		self._sums[row] = 0
+
+
+	def counts(self, rows):
+		"""
+		:param rows: numpy array of row indexes
+		:return: numpy array, number of samples in each series
+		"""
+		return self._count[rows]
+
+
+	def last(self, row):
+		"""
+		:param row: integer
+		:return: float, the latest value of the series, or None if empty
+		"""
+		if not self._count[row]:
+			return None
+		return self._values[row, (self._position[row] - 1) % self._window]
+
+
+	def add(self, row, timestamp, value):
+		"""
+		Adds a sample to a series, the oldest one leaves the window if it is full
+		:param row: integer
+		:param timestamp: float, seconds
+		:param value: float
+		"""
+		if not self._count[row]:
+			self._origin[row] = timestamp
+
+		position = self._position[row]
+		if self._count[row] == self._window:
+			t = self._times[row, position]
+			y = self._values[row, position]
+			self._sums[row] -= (t, y, t * t, t * y)
+		else:
+			self._count[row] += 1
+
+		t = (timestamp - self._origin[row]) / 3600
+		self._times[row, position] = t
+		self._values[row, position] = value
+		self._sums[row] += (t, value, t * t, t * value)
+		self._position[row] = (position + 1) % self._window
+
+		if self._position[row] == 0:
+			self._rebase(row)
+
+
+	def solve(self, rows):
+		"""
+		Fits every given series at once, y = slope * t + intercept with t in hours since the origin
+		:param rows: numpy array of row indexes
+		:return: tuple of numpy arrays, slopes per hour, intercepts and origins as timestamps in seconds. Series with less
+		than two distinct times have a nan slope
+		"""
+		count = self._count[rows].astype(float)
+		st, sy, stt, sty = self._sums[rows].T
+		with np.errstate(divide='ignore', invalid='ignore'):
+			denominator = count * stt - st * st
+			slope = np.where(denominator > 1e-9, (count * sty - st * sy) / denominator, np.nan)
+			intercept = (sy - slope * st) / count
+		return slope, intercept, self._origin[rows]
+
+
+	def _rebase(self, row):
+		# Once per window, the origin moves to the oldest sample and the sums are recomputed from the buffer,
+		# so that floating point errors of the running sums never pile up
+		times = self._times[row]
+		shift = times.min()
+		times -= shift
+		self._origin[row] += shift * 3600
+		values = self._values[row]
+		self._sums[row] = (times.sum(), values.sum(), (times * times).sum(), (times * values).sum())
+
+
+class Forecast:
+	"""
+	Predicts, for every site, when the soil moisture will go under the plant's limit and when the water tank will run dry
+	The moisture decay and the tank decline are fitted over the recent reports, a rise means the plant was watered or the
+	tank refilled, and the fit starts over. Forecasts are cached and only the sites that got a new sample are solved again,
+	all in one batch
+	"""
+
+	MOISTURE = 0
+	WATER = 1
+
+	# A moisture or water rise bigger than this is a watering or a refill, not noise
+	_RISE = 5.0
+	# Samples needed before trusting a line
+	_MIN_SAMPLES = 6
+
+	def __init__(self, window=288, capacity=64):
+		"""
+		:param window: integer, number of reports the trends are fitted on
+		:param capacity: integer, initial number of sites, grown as needed
+		"""
+		self._trends = (LinearTrends(window, capacity), LinearTrends(window, capacity))
+		self._rows = dict()
+		self._siteIds = list()
+		self._thresholds = np.full((capacity, 2), np.nan)
+		self._thresholds[:, self.WATER] = 0
+		self._dirty = np.zeros(capacity, dtype=bool)
+		# Cached results, timestamp at which the threshold is crossed and slope per hour, nan when unknown
+		self._crossing = np.full((capacity, 2), np.nan)
+		self._slopes = np.full((capacity, 2), np.nan)
+		self._lock = threading.Lock()
+
+
+	def setThreshold(self, siteId, moisture):
+		"""
+		Sets the moisture under which the site's plant is thirsty
+		:param siteId: string
+		:param moisture: float
+		"""
+		with self._lock:
+			row = self._row(siteId)
+			if self._thresholds[row, self.MOISTURE] != moisture:
+				self._thresholds[row, self.MOISTURE] = moisture
+				self._dirty[row] = True
+
+
+	def add(self, siteId, timestamp, moisture, water):
+		"""
+		Adds a telemetry report
+		:param siteId: string
+		:param timestamp: integer, seconds
+		:param moisture: float
+		:param water: float
+		"""
+		with self._lock:
+			row = self._row(siteId)
+			for metric, value in ((self.MOISTURE, moisture), (self.WATER, water)):
+				if value is None:
+					continue
+				trend = self._trends[metric]
+				last = trend.last(row)
+				if last is not None and value - last > self._RISE:
+					trend.reset(row)
+				trend.add(row, timestamp, value)
+			self._dirty[row] = True
+
+
+	def refresh(self):
+		"""
+		Solves the forecasts of every site that changed since the last refresh, in one batch
+		"""
+		with self._lock:
+			self._refresh()
+
+
+	def get(self, siteId):
+		"""
+		The forecasts of a site, from the cache
+		:param siteId: string
+		:return: dict with 'thirsty' and 'empty' timestamps, None if not declining or not enough data, and the
+		'moistureSlope' and 'waterSlope' per hour. None if the site never reported
+		"""
+		with self._lock:
+			row = self._rows.get(siteId)
+			if row is None:
+				return None
+			if self._dirty[row]:
+				self._refresh()
+
+			crossing = self._crossing[row]
+			slopes = self._slopes[row]
+			return {
+				'thirsty': None if np.isnan(crossing[self.MOISTURE]) else int(crossing[self.MOISTURE]),
+				'empty': None if np.isnan(crossing[self.WATER]) else int(crossing[self.WATER]),
+				'moistureSlope': None if np.isnan(slopes[self.MOISTURE]) else float(slopes[self.MOISTURE]),
+				'waterSlope': None if np.isnan(slopes[self.WATER]) else float(slopes[self.WATER])
+			}
+
+
+	def _refresh(self):
+		rows = np.flatnonzero(self._dirty[:len(self._siteIds)])
+		if not len(rows):
+			return
+
+		for metric, trend in enumerate(self._trends):
+			slope, intercept, origin = trend.solve(rows)
+			enough = trend.counts(rows) >= self._MIN_SAMPLES
+			slope = np.where(enough, slope, np.nan)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				# Hours after the origin at which the line reaches the threshold, only for declining series
+				hours = (self._thresholds[rows, metric] - intercept) / slope
+				crossing = np.where(slope < 0, origin + hours * 3600, np.nan)
+			self._slopes[rows, metric] = slope
+			self._crossing[rows, metric] = crossing
+
+		self._dirty[rows] = False
+
+
+	def _row(self, siteId):
+		row = self._rows.get(siteId)
+		if row is not None:
+			return row
+
+		row = len(self._siteIds)
+		if row >= len(self._dirty):
+			capacity = 2 * len(self._dirty)
+			for trend in self._trends:
+				trend.grow(capacity)
+			extra = capacity - len(self._dirty)
+			thresholds = np.full((extra, 2), np.nan)
+			thresholds[:, self.WATER] = 0
+			self._thresholds = np.concatenate((self._thresholds, thresholds))
+			self._dirty = np.concatenate((self._dirty, np.zeros(extra, dtype=bool)))
+			self._crossing = np.concatenate((self._crossing, np.full((extra, 2), np.nan)))
+			self._slopes = np.concatenate((self._slopes, np.full((extra, 2), np.nan)))
+
+		self._rows[siteId] = row
+		self._siteIds.append(siteId)
+		return row
+
+
+if __name__ == '__main__':
+	# Feeds a day of reports for many sites, then compares the batched solve with fitting each site with numpy.polyfit
+	# Usage: python3 Forecast.py [sites]
+	import sys
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	window = 288
+	rng = np.random.default_rng(1)
+	now = int(time.time())
+	timestamps = now - 300 * np.arange(window)[::-1]
+	decay = rng.uniform(0.05, 0.5, count) # Moisture points lost per hour
+	moisture = 60 - decay[:, None] * (timestamps - timestamps[0]) / 3600 + rng.normal(0, 0.3, (count, window))
+	water = 90 - 0.1 * (timestamps - timestamps[0]) / 3600 + rng.normal(0, 0.2, (count, window))
+
+	forecast = Forecast(window)
+	for site in range(count):
+		forecast.setThreshold('site{}'.format(site), 20)
+
+	start = time.perf_counter()
+	for i, timestamp in enumerate(timestamps.tolist()):
+		for site in range(count):
+			forecast.add('site{}'.format(site), timestamp, moisture[site, i], water[site, i])
+	added = time.perf_counter() - start
+
+	start = time.perf_counter()
+	forecast.refresh()
+	batched = time.perf_counter() - start
+
+	start = time.perf_counter()
+	expected = list()
+	for site in range(count):
+		slope, intercept = np.polyfit((timestamps - now) / 3600, moisture[site], 1)
+		expected.append(now + (20 - intercept) / slope * 3600)
+	polyfit = time.perf_counter() - start
+
+	start = time.perf_counter()
+	forecast.add('site0', now + 300, moisture[0, -1] - 0.1, water[0, -1])
+	forecast.get('site0')
+	incremental = time.perf_counter() - start
+
+	error = max(abs(forecast._crossing[site, Forecast.MOISTURE] - expected[site]) for site in range(1, count))
+	print('{} sites, {} reports each, {:.1f}µs per report added'.format(count, window, added / count / window * 1000000))
+	print('batched solve of every site: {:8.2f}ms'.format(batched * 1000))
+	print('numpy.polyfit per site:      {:8.2f}ms'.format(polyfit * 1000))
+	print('new report then cached get:  {:8.3f}ms'.format(incremental * 1000))
+	print('largest difference with polyfit: {:.3f}s'.format(error))
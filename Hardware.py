@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from FakeGpio import FakeGpio
+from FakeSmbus import FakeChirp, FakeSMBus
+from FakeSpi import FakeSpi
+
+
+class Hardware:
+	"""
+	Gives the satellite its gpios, i2c buses and led strip, either the Raspberry Pi ones or in memory simulators
+	The Pi libraries are only imported when that backend is selected, so that the satellite code loads and runs anywhere.
+	The simulated i2c bus 1 comes with a Chirp sensor at 0x20, like a satellite has
+	"""
+
+	PI = 'pi'
+	SIMULATOR = 'simulator'
+
+	SMBUS = 'smbus'
+	SMBUS2 = 'smbus2'
+
+	def __init__(self, backend=PI, i2cDriver=SMBUS):
+		"""
+		:param backend: string, Hardware.PI or Hardware.SIMULATOR
+		:param i2cDriver: string, Hardware.SMBUS or Hardware.SMBUS2, the python package the Pi i2c buses are opened with
+		:raises ValueError: on an unknown backend or i2c driver
+		"""
+		if i2cDriver not in (self.SMBUS, self.SMBUS2):
+			raise ValueError('Unknown i2c driver: {}'.format(i2cDriver))
+
+		self._backend = backend
+		self._i2cDriver = i2cDriver
+		self._buses = dict()
+		self.chirps = dict()
+		if backend == self.PI:
+			import RPi.GPIO
+			self._gpio = RPi.GPIO
+			self._spi = None
+		elif backend == self.SIMULATOR:
+			self._gpio = FakeGpio()
+			self._spi = FakeSpi()
+			self.addChirp(FakeChirp(0x20))
+		else:
+			raise ValueError('Unknown hardware backend: {}'.format(backend))
+
+
+	@property
+	def backend(self):
+		return self._backend
+
+
+	@property
+	def simulated(self):
+		return self._backend == self.SIMULATOR
+
+
+	@property
+	def i2cDriver(self):
+		"""
+		:return: string, smbus2 buses can combine several reads and writes in one transaction. The simulated buses can too
+		"""
+		return self._i2cDriver
+
+
+	@property
+	def gpio(self):
+		"""
+		:return: RPi.GPIO or FakeGpio
+		"""
+		return self._gpio
+
+
+	@property
+	def spi(self):
+		"""
+		:return: FakeSpi, None on the Pi where the led driver opens the spi pins itself
+		"""
+		return self._spi
+
+
+	def i2c(self, bus=1):
+		"""
+		:param bus: integer
+		:return: smbus.SMBus, smbus2.SMBus or FakeSMBus, opened once per bus
+		"""
+		if bus not in self._buses:
+			if self.simulated:
+				self._buses[bus] = FakeSMBus(bus)
+			elif self._i2cDriver == self.SMBUS2:
+				import smbus2
+				self._buses[bus] = smbus2.SMBus(bus)
+			else:
+				import smbus
+				self._buses[bus] = smbus.SMBus(bus)
+		return self._buses[bus]
+
+
+	def addChirp(self, chirp, bus=1):
+		"""
+		Plugs a simulated Chirp sensor on a simulated bus
+		:param chirp: FakeChirp
+		:param bus: integer
+		"""
+		if not self.simulated:
+			raise ValueError('Sensors can only be added to simulated hardware')
+		self.i2c(bus).attach(chirp)
+		self.chirps[chirp.address] = chirp
+
+
+	def dotstar(self, count, brightness=1.0, autoWrite=True):
+		"""
+		:param count: integer, leds on the strip
+		:param brightness: float, 0 to 1
+		:param autoWrite: boolean, push every change right away instead of on show()
+		:return: adafruit_dotstar.DotStar
+		"""
+		import adafruit_dotstar
+		if self._spi is not None:
+			return adafruit_dotstar.DotStar(None, None, count, brightness=brightness, auto_write=autoWrite, spi=self._spi)
+
+		from adafruit_blinka.board import raspi_40pin as board
+		return adafruit_dotstar.DotStar(board.SCK, board.MOSI, count, brightness=brightness, auto_write=autoWrite)
+
+
+if __name__ == '__main__':
+	# Runs a whole satellite on simulated hardware against an in process broker: boot, telemetry reads and a tank refill
+	# Usage: python3 Hardware.py [reads] [pots] [smbus|smbus2]
+	from FakeGpio import FakeTank
+	from FakeMqtt import FakeBroker, FakeClient
+	from Flower import Flower
+	from FlowerStates import State
+	from Codec import Codec
+	import sys
+	import threading
+	import time
+
+	reads = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+	pots = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+	hardware = Hardware(Hardware.SIMULATOR, sys.argv[3] if len(sys.argv) > 3 else Hardware.SMBUS)
+	for address in range(0x21, 0x20 + pots):
+		hardware.addChirp(FakeChirp(address, capacitance=300 + 20 * (address - 0x20)))
+	snipsConf = {'snips-common': {'mqtt': 'localhost:1883'}, 'snips-audio-server': {'bind': 'bench@mqtt'}}
+	broker = FakeBroker()
+	main = FakeClient(broker)
+	received = list()
+	full = threading.Event()
+	main.on_message = lambda client, userdata, message: (received.append(message.topic), message.topic.endswith('refillFull') and full.set())
+	main.connect()
+	main.subscribe('snipsmyflower/#')
+	main.loop_start()
+
+	start = time.perf_counter()
+	flower = Flower(hardware=hardware, mqttClient=FakeClient(broker), snipsConf=snipsConf)
+	print('Boot:              {:8.1f}ms'.format((time.perf_counter() - start) * 1000))
+	tank = FakeTank(hardware.gpio, Flower.WATER_LEVEL_PINS, level=25)
+
+	bus = hardware.i2c(1)
+	transactions = bus.transactions
+	start = time.perf_counter()
+	for _ in range(reads):
+		data = flower._queryTelemetryData()
+	elapsed = (time.perf_counter() - start) / reads
+	print('Telemetry read:    {:8.1f}ms, {:.0f} i2c transactions for {} pots'.format(elapsed * 1000, (bus.transactions - transactions) / reads, len(data)))
+	for siteId, telemetry in sorted(data.items()):
+		print('                   {}'.format(telemetry))
+
+	frames = hardware.spi.count
+	start = time.perf_counter()
+	main.publish('snipsmyflower/flowers/refillMode', Codec.dumps({'siteId': 'bench'}))
+	while flower._state != State.FILLING:
+		time.sleep(0.01)
+	for level in (50, 75):
+		time.sleep(0.2)
+		reached = time.perf_counter()
+		tank.setLevel(level)
+	while flower._state == State.FILLING:
+		time.sleep(0.0001)
+	print('Refill seen full:  {:8.1f}ms after the level reached it'.format((time.perf_counter() - reached) * 1000))
+	full.wait(10)
+	flower._refilling.join()
+	print('Refill done:       {:8.1f}s, {} led frames, {} gpio reads'.format(time.perf_counter() - start, hardware.spi.count - frames, hardware.gpio.reads))
+	print('Main unit got:     {}'.format(', '.join(sorted(set(received)))))
+
+	flower.onStop()
+	main.loop_stop()
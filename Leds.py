@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import adafruit_dotstar
-from adafruit_blinka.board import raspi_40pin as board
 import threading
 import time
 try:
@@ -14,8 +12,18 @@ class Leds:
 	"""
 	This class runs the dotstar leds
 	"""
-	def __init__(self):
-		self._pixels = adafruit_dotstar.DotStar(board.SCK, board.MOSI, 5, brightness=0.2)
+	def __init__(self, hardware, metrics=None):
+		"""
+		:param hardware: Hardware, gives us the led strip
+		:param metrics: Metrics, frame render timings are recorded there if given
+		"""
+		# Frames are pushed by _render once they are complete, instead of on every pixel change
+		self._pixels = hardware.dotstar(5, brightness=0.2, autoWrite=False)
+		self._renderTime = None
+		self._animations = None
+		if metrics is not None:
+			self._renderTime = metrics.histogram('led_render_seconds', 'Time spent pushing a frame to the leds', buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+			self._animations = metrics.counter('led_animations_total', 'Led animations played')
 		self._queue = Queue.Queue()
 		self._active = threading.Event()
 		self._animating = threading.Event()
@@ -31,7 +39,7 @@ class Leds:
 		"""
 		self._active.clear()
 		self.clear()
-		if self._thread.isAlive():
+		if self._thread.is_alive():
 			self._thread.join(timeout=2)
 
 
@@ -53,6 +61,8 @@ class Leds:
 		self._active.set()
 		while self._active.isSet():
 			func = self._queue.get()
+			if self._animations is not None:
+				self._animations.inc()
 			func()
 
 
@@ -91,6 +101,7 @@ class Leds:
 		i = 0
 		while i < 5:
 			self._pixels[i] = [0, 0, 255]
+			self._render()
 			time.sleep(0.5)
 			i += 1
 		time.sleep(1)
@@ -109,6 +120,7 @@ class Leds:
 		while i < numLeds:
 			self._pixels[i] = color
 			i += 1
+		self._render()
 
 
 	def _displayMeter(self, color, percentage, brightness=1, autoAlert=False):
@@ -124,6 +136,7 @@ class Leds:
 		i = 0
 		while i < ledsToLight:
 			self._pixels[i] = color
+			self._render()
 			i += 1
 			if autoAlert:
 				time.sleep(0.1)
@@ -137,6 +150,7 @@ class Leds:
 
 		bri = brightness
 		self._pixels.brightness = bri
+		self._render()
 		direction = -1
 
 		# If we want to have a constant speed on the animation whatever brightness we have, we need to calculate
@@ -153,6 +167,7 @@ class Leds:
 			bri += direction * 0.04
 			bri = round(bri, 2)
 			self._pixels.brightness = bri
+			self._render()
 			time.sleep(sleep)
 
 
@@ -163,12 +178,23 @@ class Leds:
 		self._clearAnimation()
 		self._pixels.fill(0)
 		self._pixels.brightness = 1.0
+		self._render()
+
+
+	def _render(self):
+		"""
+		Pushes the current frame to the leds
+		"""
+		start = time.perf_counter()
+		self._pixels.show()
+		if self._renderTime is not None:
+			self._renderTime.observe(time.perf_counter() - start)
 
 
 	def _clearAnimation(self):
 		"""
 		Clears any running animation and cancels timer
 		"""
-		if self._timer is not None and self._timer.isAlive:
+		if self._timer is not None and self._timer.is_alive():
 			self._timer.cancel()
 		self._animating.clear()
\ No newline at end of file
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+
+class Counter:
+	"""
+	Only ever goes up
+	"""
+
+	__slots__ = ('_value', '_lock')
+
+	def __init__(self):
+		self._value = 0
+		self._lock = threading.Lock()
+
+
+	def inc(self, amount=1):
+		with self._lock:
+			self._value += amount
+
+
+	@property
+	def value(self):
+		return self._value
+
+
+class Gauge:
+	"""
+	Goes up and down
+	"""
+
+	__slots__ = ('_value', '_lock')
+
+	def __init__(self):
+		self._value = 0
+		self._lock = threading.Lock()
+
+
+	def set(self, value):
+		self._value = value
+
+
+	def inc(self, amount=1):
+		with self._lock:
+			self._value += amount
+
+
+	def dec(self, amount=1):
+		with self._lock:
+			self._value -= amount
+
+
+	@property
+	def value(self):
+		return self._value
+
+
+class Histogram:
+	"""
+	Counts the observed values into fixed buckets, along with their sum
+	Buckets are upper bounds, a value lands in the first bucket it doesn't exceed, or in the implicit +Inf one
+	"""
+
+	__slots__ = ('_bounds', '_counts', '_sum', '_lock')
+
+	# Seconds, from half a millisecond to ten seconds
+	DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self._bounds = tuple(sorted(buckets))
+		self._counts = [0] * (len(self._bounds) + 1)
+		self._sum = 0.0
+		self._lock = threading.Lock()
+
+
+	def observe(self, value):
+		index = bisect_left(self._bounds, value)
+		with self._lock:
+			self._counts[index] += 1
+			self._sum += value
+
+
+	@property
+	def value(self):
+		"""
+		:return: tuple, upper bounds, cumulative counts per bound with +Inf last, sum
+		"""
+		with self._lock:
+			counts = list(self._counts)
+			total = self._sum
+
+		cumulative = list()
+		count = 0
+		for bucketCount in counts:
+			count += bucketCount
+			cumulative.append(count)
+		return self._bounds, cumulative, total
+
+
+class Metrics:
+	"""
+	Registry of the counters, gauges and histograms a unit keeps about itself
+	Metrics are created once, at startup, and then updated from the hot paths without any lookup. A metric can also be
+	a callback, read only when the metrics are exported, for values some other class already keeps.
+	Everything is exported in prometheus text format, over http if serve() was called, or as a json snapshot
+	"""
+
+	COUNTER = 'counter'
+	GAUGE = 'gauge'
+	HISTOGRAM = 'histogram'
+
+	def __init__(self, namespace='snipsmyflower'):
+		"""
+		:param namespace: string, prefixed to every metric name
+		"""
+		self._namespace = namespace
+		self._families = dict()
+		self._lock = threading.Lock()
+		self._server = None
+		self._reporting = None
+
+
+	def counter(self, name, description, labels=None):
+		"""
+		:param name: string, without the namespace
+		:param description: string, exported as the metric help
+		:param labels: dict, label names and values telling this metric apart from the others of the same name
+		:return: Counter
+		"""
+		return self._register(name, self.COUNTER, description, labels, Counter())
+
+
+	def gauge(self, name, description, labels=None):
+		"""
+		:return: Gauge
+		"""
+		return self._register(name, self.GAUGE, description, labels, Gauge())
+
+
+	def histogram(self, name, description, labels=None, buckets=Histogram.DEFAULT_BUCKETS):
+		"""
+		:param buckets: tuple, upper bounds
+		:return: Histogram
+		"""
+		return self._register(name, self.HISTOGRAM, description, labels, Histogram(buckets))
+
+
+	def callback(self, name, description, function, labels=None, kind=GAUGE):
+		"""
+		Registers a value computed when the metrics are exported
+		:param function: callable, returns a number
+		:param kind: string, Metrics.GAUGE or Metrics.COUNTER
+		"""
+		self._register(name, kind, description, labels, function)
+
+
+	def _register(self, name, kind, description, labels, metric):
+		name = '{}_{}'.format(self._namespace, name) if self._namespace else name
+		key = self._labels(labels)
+		with self._lock:
+			family = self._families.get(name)
+			if family is None:
+				family = self._families[name] = (kind, description, dict())
+			elif family[0] != kind:
+				raise ValueError('Metric {} is already registered as a {}'.format(name, family[0]))
+
+			if key in family[2]:
+				# Asking twice for the same metric gives the same one back
+				return family[2][key]
+			family[2][key] = metric
+		return metric
+
+
+	@staticmethod
+	def _labels(labels):
+		"""
+		:return: string, labels as written in the prometheus text format, empty if none
+		"""
+		if not labels:
+			return ''
+		return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in sorted(labels.items()))
+
+
+	def _collect(self):
+		"""
+		:return: list of (name, kind, description, list of (labels, value)) tuples, callbacks resolved
+		"""
+		with self._lock:
+			families = [(name, kind, description, list(metrics.items())) for name, (kind, description, metrics) in sorted(self._families.items())]
+
+		collected = list()
+		for name, kind, description, metrics in families:
+			values = list()
+			for labels, metric in metrics:
+				if callable(metric):
+					try:
+						values.append((labels, metric()))
+					except Exception as e:
+						print('Error reading metric {}: {}'.format(name, e))
+				else:
+					values.append((labels, metric.value))
+			collected.append((name, kind, description, values))
+		return collected
+
+
+	def render(self):
+		"""
+		:return: string, every metric in prometheus text format
+		"""
+		lines = list()
+		for name, kind, description, values in self._collect():
+			lines.append('# HELP {} {}'.format(name, description.replace('\\', '\\\\').replace('\n', '\\n')))
+			lines.append('# TYPE {} {}'.format(name, kind))
+			for labels, value in values:
+				if kind != self.HISTOGRAM:
+					lines.append('{}{} {}'.format(name, '{{{}}}'.format(labels) if labels else '', self._number(value)))
+					continue
+
+				bounds, cumulative, total = value
+				separator = ',' if labels else ''
+				for bound, count in zip(bounds + ('+Inf',), cumulative):
+					lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, bound, count))
+				suffix = '{{{}}}'.format(labels) if labels else ''
+				lines.append('{}_sum{} {}'.format(name, suffix, self._number(total)))
+				lines.append('{}_count{} {}'.format(name, suffix, cumulative[-1]))
+		return '\n'.join(lines) + '\n'
+
+
+	def snapshot(self):
+		"""
+		Compact view of the metrics, for the mqtt stats topic. Histograms are reduced to their count, sum and average
+		:return: dict, metric name to value, or to a dict of label string to value for labelled metrics
+		"""
+		snapshot = dict()
+		for name, kind, description, values in self._collect():
+			if self._namespace:
+				name = name[len(self._namespace) + 1:]
+			for labels, value in values:
+				if kind == self.HISTOGRAM:
+					_, cumulative, total = value
+					value = {'count': cumulative[-1], 'sum': total, 'average': total / cumulative[-1] if cumulative[-1] else 0}
+				if labels:
+					snapshot.setdefault(name, dict())[labels] = value
+				else:
+					snapshot[name] = value
+		return snapshot
+
+
+	@staticmethod
+	def _number(value):
+		if isinstance(value, bool):
+			return int(value)
+		if isinstance(value, float) and value != value:
+			return 'NaN'
+		return value
+
+
+	def serve(self, port, host='127.0.0.1'):
+		"""
+		Serves the metrics in prometheus text format on http://host:port/metrics, from a daemon thread
+		:param port: integer
+		:param host: string, only reachable locally by default
+		:return: boolean, False if the port couldn't be bound
+		"""
+		metrics = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?')[0] not in ('/', '/metrics'):
+					self.send_error(404)
+					return
+				body = metrics.render().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		try:
+			self._server = ThreadingHTTPServer((host, port), Handler)
+		except OSError as e:
+			print('Cannot serve metrics on {}:{}: {}'.format(host, port, e))
+			return False
+
+		self._server.daemon_threads = True
+		thread = threading.Thread(target=self._server.serve_forever, name='Metrics')
+		thread.setDaemon(True)
+		thread.start()
+		return True
+
+
+	def report(self, function, interval):
+		"""
+		Calls the given function with a snapshot every interval seconds, to publish it on mqtt
+		:param function: callable, called with the snapshot dict
+		:param interval: float, seconds
+		"""
+		self._reporting = threading.Timer(interval=interval, function=self._onReport, args=[function, interval])
+		self._reporting.setDaemon(True)
+		self._reporting.start()
+
+
+	def _onReport(self, function, interval):
+		self.report(function, interval)
+		try:
+			function(self.snapshot())
+		except Exception as e:
+			print('Error reporting metrics: {}'.format(e))
+
+
+	def onStop(self):
+		"""
+		Stops the reporting timer and the http server
+		"""
+		if self._reporting is not None and self._reporting.is_alive():
+			self._reporting.cancel()
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+
+
+if __name__ == '__main__':
+	# Measures the cost of recording one sample, uncontended, and of a scrape
+	# Usage: python3 Metrics.py [samples]
+	import sys
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	metrics = Metrics()
+	counter = metrics.counter('bench_total', 'Benchmark counter')
+	gauge = metrics.gauge('bench_gauge', 'Benchmark gauge')
+	histogram = metrics.histogram('bench_seconds', 'Benchmark histogram', labels={'topic': 'bench'})
+
+	start = time.perf_counter()
+	for _ in range(count):
+		pass
+	loop = time.perf_counter() - start
+
+	for label, record in (('counter.inc', lambda: counter.inc()), ('gauge.set', lambda: gauge.set(1)), ('histogram.observe', lambda: histogram.observe(0.003))):
+		start = time.perf_counter()
+		for _ in range(count):
+			record()
+		print('{:20s} {:6.3f}µs per sample'.format(label, (time.perf_counter() - start - loop) / count * 1000000))
+
+	perfCounter = time.perf_counter
+	start = perfCounter()
+	for _ in range(count):
+		began = perfCounter()
+		histogram.observe(perfCounter() - began)
+	print('{:20s} {:6.3f}µs per sample'.format('timed observe', (perfCounter() - start - loop) / count * 1000000))
+
+	for i in range(100):
+		metrics.histogram('bench_seconds', 'Benchmark histogram', labels={'topic': 'topic{}'.format(i)}).observe(0.01)
+	start = time.perf_counter()
+	for _ in range(100):
+		metrics.render()
+	print('{:20s} {:6.3f}ms per scrape, {} lines'.format('render', (time.perf_counter() - start) * 10, metrics.render().count('\n')))
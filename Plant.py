@@ -2,9 +2,14 @@
 # -*- coding: utf-8 -*-
 
 class Plant(object):
+	# Tolerance applied to the plant limits before alerting
+	LOW_TOLERANCE = 0.9
+	HIGH_TOLERANCE = 1.1
+
 	def __init__(self, name, data):
 		self._name = name
 		self._scientificName = data['scientific_name']
+		self._aliases = tuple(data.get('aliases', ()))
 		self._moistureMin = data['moisture_min']
 		self._moistureMax = data['moisture_max']
 		self._temperatureMin = data['temperature_min']
@@ -14,6 +19,13 @@ class Plant(object):
 		self._luminosityMin = data['luminosity_min']
 		self._luminosityMax = data['luminosity_max']
 
+		# Alert bands, (low, high) per telemetry, computed once
+		self._bands = {
+			'moisture': (self._moistureMin * self.LOW_TOLERANCE, self._moistureMax * self.HIGH_TOLERANCE),
+			'temperature': (self._temperatureMin * self.LOW_TOLERANCE, self._temperatureMax * self.HIGH_TOLERANCE),
+			'luminosity': (self._luminosityMin * self.LOW_TOLERANCE, self._luminosityMax * self.HIGH_TOLERANCE)
+		}
+
 
 	@property
 	def name(self):
@@ -25,6 +37,16 @@ class Plant(object):
 		return self._scientificName
 
 
+	@property
+	def aliases(self):
+		return self._aliases
+
+
+	@property
+	def bands(self):
+		return self._bands
+
+
 	@property
 	def moistureMin(self):
 		return self._moistureMin
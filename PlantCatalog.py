@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import pickle
+from Plant import Plant
+from SpeciesIndex import SpeciesIndex
+
+
+class PlantCatalog:
+	"""
+	Every supported plant, indexed by common name, scientific name and aliases
+	Names are normalized for case, underscores and whitespace so that a lookup is a single dict access
+	Names that don't match exactly, as the speech recognition often gets them, are resolved through a fuzzy species index
+	"""
+
+	# Bump whenever the pickled layout changes, older cache files are then rebuilt
+	_CACHE_VERSION = 1
+
+	def __init__(self):
+		self._plants = dict()
+		self._index = dict()
+		self._species = SpeciesIndex()
+
+
+	@staticmethod
+	def normalize(name):
+		"""
+		:param name: string
+		:return: string, lower cased with single spaces
+		"""
+		return ' '.join(str(name).replace('_', ' ').split()).lower()
+
+
+	def load(self, file='plantsData.json', cacheFile=None):
+		"""
+		Loads the flower data file. This file holds the values for each supported flowers
+		If a cache file is given, the catalog and its indexes are loaded from it as long as it was built from the
+		same data file, otherwise the json is parsed and the cache file is written for the next start
+		:param file: string, path to the json file
+		:param cacheFile: string, path to the prebuilt catalog
+		"""
+		if cacheFile is not None and self._loadCache(file, cacheFile):
+			return
+
+		with open(file, 'r') as f:
+			data = json.load(f)
+
+		for name, values in data.items():
+			self.add(Plant(name, values))
+
+		if cacheFile is not None:
+			self._saveCache(file, cacheFile)
+
+
+	def add(self, plant):
+		"""
+		Adds a plant to the catalog. A common name always wins over another plant's scientific name or alias
+		:param plant: Plant
+		"""
+		self._plants[plant.name] = plant
+		self._index[self.normalize(plant.name)] = plant
+		for name in (plant.scientificName,) + plant.aliases:
+			self._index.setdefault(self.normalize(name), plant)
+
+		for name in {self.normalize(name) for name in (plant.name, plant.scientificName) + plant.aliases}:
+			self._species.add(name, plant.name)
+
+
+	def get(self, name):
+		"""
+		Finds a plant by any of its names
+		:param name: string
+		:return: Plant, or None if unknown
+		"""
+		return self._index.get(self.normalize(name))
+
+
+	def search(self, name, limit=1):
+		"""
+		Finds the plants whose names are the closest to the given one, typos and misheard names included
+		:param name: string
+		:param limit: integer, number of results
+		:return: list of (Plant, distance) tuples, closest first, distance being 0 for an exact match
+		"""
+		plant = self.get(name)
+		if plant is not None and limit == 1:
+			return [(plant, 0)]
+
+		return [(self._plants[plantName], distance) for plantName, _, distance in self._species.search(self.normalize(name), limit)]
+
+
+	def _loadCache(self, file, cacheFile):
+		if not os.path.exists(cacheFile):
+			return False
+
+		try:
+			with open(cacheFile, 'rb') as f:
+				cache = pickle.load(f)
+
+			if cache['stamp'] != self._stamp(file):
+				return False
+		except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError, TypeError) as e:
+			print('Rebuilding plant catalog cache: {}'.format(e))
+			return False
+
+		self._plants = cache['plants']
+		self._index = cache['index']
+		self._species = cache['species']
+		return True
+
+
+	def _saveCache(self, file, cacheFile):
+		cache = {
+			'stamp': self._stamp(file),
+			'plants': self._plants,
+			'index': self._index,
+			'species': self._species
+		}
+
+		try:
+			# Written aside and renamed, a start interrupted while writing never leaves a truncated cache behind
+			temp = '{}.tmp'.format(cacheFile)
+			with open(temp, 'wb') as f:
+				pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+			os.replace(temp, cacheFile)
+		except OSError as e:
+			print('Cannot write plant catalog cache: {}'.format(e))
+
+
+	@classmethod
+	def _stamp(cls, file):
+		stat = os.stat(file)
+		return cls._CACHE_VERSION, stat.st_mtime_ns, stat.st_size
+
+
+	def __contains__(self, name):
+		return self.normalize(name) in self._index
+
+
+	def __iter__(self):
+		return iter(self._plants.values())
+
+
+	def __len__(self):
+		return len(self._plants)
+
+
+if __name__ == '__main__':
+	# Compares parsing the json with loading the prebuilt cache, and measures fuzzy lookups, on a generated catalog
+	# Usage: python3 PlantCatalog.py [plants]
+	import random
+	import string
+	import sys
+	import tempfile
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 25000
+	random.seed(1)
+
+	def word():
+		return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 10)))
+
+	values = {'moisture_min': 15, 'moisture_max': 60, 'temperature_min': 10, 'temperature_max': 30, 'humidity_min': 20, 'humidity_max': 80, 'luminosity_min': 20, 'luminosity_max': 80}
+	data = dict()
+	while len(data) < count:
+		data['{} {}'.format(word(), word())] = dict(values, scientific_name='{} {}'.format(word(), word()))
+
+	with tempfile.TemporaryDirectory() as directory:
+		dataFile = os.path.join(directory, 'plantsData.json')
+		cacheFile = os.path.join(directory, 'plantsData.cache')
+		with open(dataFile, 'w') as f:
+			json.dump(data, f)
+
+		start = time.perf_counter()
+		catalog = PlantCatalog()
+		catalog.load(dataFile, cacheFile)
+		print('{} names, json parsed and indexed in {:.0f}ms'.format(len(catalog._species), (time.perf_counter() - start) * 1000))
+
+		start = time.perf_counter()
+		catalog = PlantCatalog()
+		catalog.load(dataFile, cacheFile)
+		print('{} names, prebuilt cache loaded in {:.0f}ms'.format(len(catalog._species), (time.perf_counter() - start) * 1000))
+
+	names = random.sample(list(data), 200)
+	queries = list()
+	for name in names:
+		# One or two typos, like the asr would make
+		letters = list(name)
+		for _ in range(random.randint(1, 2)):
+			letters[random.randrange(len(letters))] = random.choice(string.ascii_lowercase)
+		queries.append((''.join(letters), name))
+
+	timings = list()
+	found = 0
+	for query, expected in queries:
+		start = time.perf_counter()
+		result = catalog.search(query)
+		timings.append(time.perf_counter() - start)
+		found += bool(result) and result[0][0].name == expected
+
+	timings.sort()
+	print('Fuzzy lookups: {}/{} resolved, median {:.2f}ms, p99 {:.2f}ms'.format(found, len(queries), timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000))
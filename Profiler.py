@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+
+class Profiler:
+	"""
+	Time boxed sampling profiler, started on demand in a running unit
+	Every interval, the stack of each thread is read from sys._current_frames(). cProfile only sees the thread that
+	enabled it while our work is spread over the mqtt loop, the workers and the timers, sampling sees them all and its
+	cost doesn't depend on how many calls are made. Nothing runs until start() is called.
+	Threads parked waiting for work are left out, as is the main thread, which only sleeps until we are stopped
+	"""
+
+	# Innermost frames of a thread waiting for work, by file name and function
+	_IDLE = {
+		('threading.py', 'wait'),
+		('selectors.py', 'select'),
+		('client.py', '_loop'),
+		('client.py', 'loop')
+	}
+
+	# Outermost frames every thread starts with, left out of the stacks as they say nothing
+	_ROOTS = {
+		('threading.py', '_bootstrap'),
+		('threading.py', '_bootstrap_inner'),
+		('threading.py', 'run')
+	}
+
+	def __init__(self, directory, interval=5, maxDuration=60):
+		"""
+		:param directory: Path, where the results are written
+		:param interval: integer, milliseconds between two samples
+		:param maxDuration: float, longest profile in seconds that can be asked for
+		"""
+		self._directory = Path(directory)
+		self._interval = interval / 1000
+		self._maxDuration = maxDuration
+		self._thread = None
+		self._stop = threading.Event()
+		self._lock = threading.Lock()
+
+
+	@property
+	def running(self):
+		return self._thread is not None and self._thread.is_alive()
+
+
+	def start(self, duration, onDone, top=20):
+		"""
+		Starts profiling, unless a profile is already running
+		:param duration: float, seconds, capped to maxDuration
+		:param onDone: callable, called with the summary dict once the results are written
+		:param top: integer, functions listed in the summary
+		:return: boolean, False if a profile is already running
+		"""
+		with self._lock:
+			if self.running:
+				return False
+
+			self._stop.clear()
+			self._thread = threading.Thread(target=self._run, args=[max(0.1, min(duration, self._maxDuration)), onDone, top], name='Profiler')
+			self._thread.setDaemon(True)
+			self._thread.start()
+			return True
+
+
+	def onStop(self):
+		"""
+		Cuts a running profile short, its results are still written
+		"""
+		self._stop.set()
+		if self.running:
+			self._thread.join(timeout=5)
+
+
+	def _run(self, duration, onDone, top):
+		started = time.time()
+		stacks, samples = self._sample(duration)
+		try:
+			summary = self._write(stacks, samples, started, top)
+		except OSError as e:
+			print('Cannot write profile: {}'.format(e))
+			return
+
+		try:
+			onDone(summary)
+		except Exception as e:
+			print('Error reporting profile: {}'.format(e))
+
+
+	def _sample(self, duration):
+		"""
+		:param duration: float, seconds
+		:return: tuple, Counter of stacks, outermost frame first, and the number of samples taken
+		"""
+		own = threading.get_ident()
+		main = threading.main_thread().ident
+		stacks = Counter()
+		samples = 0
+		end = time.monotonic() + duration
+		while time.monotonic() < end and not self._stop.wait(self._interval):
+			samples += 1
+			for threadId, frame in sys._current_frames().items():
+				if threadId == own or threadId == main:
+					continue
+
+				code = frame.f_code
+				if (os.path.basename(code.co_filename), code.co_name) in self._IDLE:
+					continue
+
+				stack = list()
+				while frame is not None:
+					code = frame.f_code
+					fileName = os.path.basename(code.co_filename)
+					if (fileName, code.co_name) not in self._ROOTS:
+						stack.append('{}:{}:{}'.format(fileName, code.co_name, code.co_firstlineno))
+					frame = frame.f_back
+				if stack:
+					stack.reverse()
+					stacks[tuple(stack)] += 1
+		return stacks, samples
+
+
+	def _write(self, stacks, samples, started, top):
+		"""
+		Writes the collapsed stacks, one 'outer;inner count' line each, ready for flamegraph.pl, and the top functions
+		:return: dict, summary
+		"""
+		cumulative = Counter()
+		own = Counter()
+		for stack, count in stacks.items():
+			for function in set(stack):
+				cumulative[function] += count
+			own[stack[-1]] += count
+
+		if not self._directory.exists():
+			self._directory.mkdir(parents=True)
+
+		name = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+		with open(str(self._directory / '{}.folded'.format(name)), 'w') as f:
+			for stack, count in stacks.most_common():
+				f.write('{} {}\n'.format(';'.join(stack), count))
+
+		total = sum(stacks.values())
+		functions = [{
+			'function': function,
+			'cumulative': count,
+			'self': own[function],
+			'percent': round(count / total * 100, 1) if total else 0
+		} for function, count in cumulative.most_common(top)]
+
+		with open(str(self._directory / '{}.txt'.format(name)), 'w') as f:
+			f.write('{} samples every {:.0f}ms, {} busy thread samples\n\n'.format(samples, self._interval * 1000, total))
+			f.write('{:>10s} {:>10s} {:>7s}  {}\n'.format('cumulative', 'self', '%', 'function'))
+			for function in functions:
+				f.write('{:10d} {:10d} {:7.1f}  {}\n'.format(function['cumulative'], function['self'], function['percent'], function['function']))
+
+		return {
+			'file': str(self._directory / '{}.txt'.format(name)),
+			'started': int(started),
+			'duration': round(time.time() - started, 3),
+			'samples': samples,
+			'busy': total,
+			'top': functions
+		}
+
+
+if __name__ == '__main__':
+	# Profiles a few busy threads for a couple of seconds and prints the summary
+	# Usage: python3 Profiler.py [seconds]
+	import json
+	import tempfile
+
+	def spin(until):
+		while time.monotonic() < until:
+			sum(i * i for i in range(1000))
+
+	def parked(event):
+		event.wait()
+
+	duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+	until = time.monotonic() + duration + 1
+	event = threading.Event()
+	for target, args in ((spin, [until]), (spin, [until]), (parked, [event])):
+		thread = threading.Thread(target=target, args=args)
+		thread.setDaemon(True)
+		thread.start()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		done = threading.Event()
+		profiler = Profiler(tmp)
+		start = time.perf_counter()
+		profiler.start(duration, lambda summary: (print(json.dumps(summary, indent='\t')), done.set()), top=5)
+		done.wait()
+		print('Took {:.2f}s for {}s asked'.format(time.perf_counter() - start, duration))
+		event.set()
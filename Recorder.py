@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+import threading
+import time
+
+
+class Recorder:
+	"""
+	Captures every mqtt message the main unit receives into an append only file, to be replayed later
+	Each record is a small fixed header, kind, arrival time, topic id and payload length, followed by the raw payload.
+	Topics are written once and then referred to by id. A record cut short by a crash is ignored when reading
+	"""
+
+	MAGIC = b'SMFREC1\n'
+
+	_HEADER = struct.Struct('<BdHI')
+	_TOPIC = 0
+	_MESSAGE = 1
+
+	def __init__(self, file, flushInterval=1.0):
+		"""
+		:param file: Path, capture file, appended to if it exists
+		:param flushInterval: float, seconds between two flushes to disk
+		"""
+		try:
+			# Appending to an older capture, topic ids go on from there and a record cut short is dropped
+			topics, end = self._scan(file)
+		except FileNotFoundError:
+			topics, end = dict(), 0
+
+		self._file = open(str(file), 'ab')
+		if end:
+			self._file.truncate(end)
+		else:
+			self._file.write(self.MAGIC)
+		self._topics = {topic: topicId for topicId, topic in topics.items()}
+		self._lock = threading.Lock()
+		self._flushInterval = flushInterval
+		self._lastFlush = time.monotonic()
+		self._count = 0
+
+
+	def record(self, topic, payload, timestamp=None):
+		"""
+		:param topic: string
+		:param payload: bytes
+		:param timestamp: float, arrival time, now if None
+		"""
+		if timestamp is None:
+			timestamp = time.time()
+
+		with self._lock:
+			if self._file is None:
+				return
+
+			topicId = self._topics.get(topic)
+			if topicId is None:
+				topicId = self._topics[topic] = len(self._topics)
+				name = topic.encode('utf-8')
+				self._file.write(self._HEADER.pack(self._TOPIC, timestamp, topicId, len(name)) + name)
+
+			self._file.write(self._HEADER.pack(self._MESSAGE, timestamp, topicId, len(payload)) + payload)
+			self._count += 1
+
+			now = time.monotonic()
+			if now - self._lastFlush >= self._flushInterval:
+				self._file.flush()
+				self._lastFlush = now
+
+
+	@property
+	def count(self):
+		return self._count
+
+
+	def close(self):
+		with self._lock:
+			if self._file is not None:
+				self._file.close()
+				self._file = None
+
+
+	@classmethod
+	def read(cls, file):
+		"""
+		Reads a capture back
+		:param file: Path
+		:return: generator of (timestamp, topic, payload) tuples, in arrival order
+		:raises ValueError: if the file is not a capture
+		"""
+		topics = dict()
+		with open(str(file), 'rb') as f:
+			if f.read(len(cls.MAGIC)) != cls.MAGIC:
+				raise ValueError('{} is not a message capture'.format(file))
+
+			while True:
+				header = f.read(cls._HEADER.size)
+				if len(header) < cls._HEADER.size:
+					return
+				kind, timestamp, topicId, length = cls._HEADER.unpack(header)
+				data = f.read(length)
+				if len(data) < length:
+					return
+
+				if kind == cls._TOPIC:
+					topics[topicId] = data.decode('utf-8')
+				else:
+					yield timestamp, topics[topicId], data
+
+
+	@classmethod
+	def _scan(cls, file):
+		"""
+		:return: tuple, the topics of a capture and the offset its last complete record ends at, 0 if empty
+		"""
+		topics = dict()
+		with open(str(file), 'rb') as f:
+			magic = f.read(len(cls.MAGIC))
+			if not magic:
+				return topics, 0
+			if magic != cls.MAGIC:
+				raise ValueError('{} is not a message capture'.format(file))
+
+			end = f.tell()
+			while True:
+				header = f.read(cls._HEADER.size)
+				if len(header) < cls._HEADER.size:
+					return topics, end
+				kind, _, topicId, length = cls._HEADER.unpack(header)
+				data = f.read(length)
+				if len(data) < length:
+					return topics, end
+				if kind == cls._TOPIC:
+					topics[topicId] = data.decode('utf-8')
+				end = f.tell()
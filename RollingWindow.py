@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import threading
+
+
+class RollingAverage:
+	"""
+	Fixed size ring buffer keeping a running sum, so that adding a sample and reading the average are both O(1)
+	"""
+
+	def __init__(self, size):
+		"""
+		:param size: integer, number of samples in the window
+		"""
+		self._samples = deque(maxlen=size)
+		self._total = 0.0
+
+
+	def add(self, value):
+		"""
+		Adds a sample, dropping the oldest one if the window is full. None values are ignored
+		:param value: float
+		"""
+		if value is None:
+			return
+
+		if len(self._samples) == self._samples.maxlen:
+			self._total -= self._samples[0]
+		self._samples.append(value)
+		self._total += value
+
+
+	@property
+	def count(self):
+		return len(self._samples)
+
+
+	@property
+	def total(self):
+		return self._total
+
+
+	@property
+	def average(self):
+		"""
+		:return: float, or None if the window is empty
+		"""
+		if not self._samples:
+			return None
+		return self._total / len(self._samples)
+
+
+class RollingWindow:
+	"""
+	Rolling averages of every telemetry metric, per site id
+	"""
+
+	METRICS = ('temperature', 'luminosity', 'moisture', 'water')
+
+	def __init__(self, size):
+		"""
+		:param size: integer, number of samples kept per site and metric
+		"""
+		self._size = size
+		self._sites = dict()
+		self._lock = threading.Lock()
+
+
+	def add(self, siteId, data):
+		"""
+		Adds a telemetry report to the site windows
+		:param siteId: string
+		:param data: dict, metric name to value
+		"""
+		with self._lock:
+			windows = self._sites.get(siteId)
+			if windows is None:
+				windows = self._sites[siteId] = {metric: RollingAverage(self._size) for metric in self.METRICS}
+
+			for metric in self.METRICS:
+				if metric in data:
+					windows[metric].add(data[metric])
+
+
+	def average(self, siteId, metric):
+		"""
+		Returns the rolling average of a metric for the given site
+		:param siteId: string
+		:param metric: string
+		:return: float, or None if we have no sample yet
+		"""
+		with self._lock:
+			if siteId not in self._sites:
+				return None
+			return self._sites[siteId][metric].average
+
+
+	def count(self, siteId):
+		"""
+		:param siteId: string
+		:return: integer, number of reports in the site window
+		"""
+		with self._lock:
+			if siteId not in self._sites:
+				return 0
+			return max(window.count for window in self._sites[siteId].values())
+
+
+	def load(self, siteId, rows):
+		"""
+		Rebuilds a site window from database rows, ordered oldest first
+		:param siteId: string
+		:param rows: iterable of dict, metric name to value
+		"""
+		with self._lock:
+			self._sites.pop(siteId, None)
+
+		for row in rows:
+			self.add(siteId, row)
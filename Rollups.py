@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+
+class Rollups:
+	"""
+	Hourly and daily min/max/sum/count of every telemetry metric, per site id
+	Updated incrementally in the same transaction as the raw inserts, so raw rows can be expired once past the retention
+	while historical questions are still answered from the rollups
+	"""
+
+	METRICS = ('temperature', 'luminosity', 'moisture', 'water')
+
+	_HOUR = 3600
+	_DAY = 86400
+
+	_TABLES = {
+		'telemetry_hourly': _HOUR,
+		'telemetry_daily': _DAY
+	}
+
+	_SCHEMA = """ CREATE TABLE IF NOT EXISTS {table} (
+		siteId TEXT NOT NULL,
+		metric TEXT NOT NULL,
+		bucket integer NOT NULL,
+		minimum REAL,
+		maximum REAL,
+		total REAL NOT NULL,
+		count integer NOT NULL,
+		PRIMARY KEY (siteId, metric, bucket)
+	) WITHOUT ROWID;"""
+
+	_INIT_BUCKET = 'INSERT OR IGNORE INTO {table} (siteId, metric, bucket, minimum, maximum, total, count) VALUES (?, ?, ?, ?, ?, 0, 0)'
+	_UPDATE_BUCKET = 'UPDATE {table} SET minimum = MIN(minimum, ?), maximum = MAX(maximum, ?), total = total + ?, count = count + ? WHERE siteId = ? AND metric = ? AND bucket = ?'
+	_REBUILD = """INSERT OR REPLACE INTO {table} (siteId, metric, bucket, minimum, maximum, total, count)
+		SELECT siteId, '{metric}', (timestamp / {size}) * {size}, MIN({metric}), MAX({metric}), SUM({metric}), COUNT({metric})
+		FROM telemetry WHERE {metric} IS NOT NULL GROUP BY siteId, timestamp / {size}"""
+
+	_AGGREGATE_RAW = 'SELECT MIN({metric}), MAX({metric}), SUM({metric}), COUNT({metric}) FROM telemetry WHERE siteId = ? AND timestamp >= ? AND timestamp < ?'
+	_AGGREGATE_ROLLUP = 'SELECT MIN(minimum), MAX(maximum), SUM(total), SUM(count) FROM {table} WHERE siteId = ? AND metric = ? AND bucket >= ? AND bucket < ?'
+
+	def __init__(self, db, retentionDays=0, retentionMode='delete', archiveFile=None):
+		"""
+		:param db: Database
+		:param retentionDays: integer, raw rows older than this are expired. 0 keeps everything
+		:param retentionMode: string, 'delete' or 'archive'
+		:param archiveFile: Path, database receiving the archived raw rows
+		"""
+		self._db = db
+		self._retentionDays = retentionDays
+		self._retentionMode = retentionMode
+		self._archiveFile = archiveFile
+
+		if retentionMode == 'archive' and archiveFile is None:
+			print('No archive file given, expired telemetry will be deleted')
+			self._retentionMode = 'delete'
+
+
+	def initTables(self):
+		"""
+		Creates the rollup tables. If they are new but we already have raw telemetry, they are built from it
+		"""
+		for table in self._TABLES:
+			self._db.executescript(self._SCHEMA.format(table=table))
+
+		if self._db.iterate('SELECT 1 FROM telemetry_hourly LIMIT 1').first() is None and self._db.iterate('SELECT 1 FROM telemetry LIMIT 1').first() is not None:
+			print('Building telemetry rollups from existing data')
+			self.rebuild()
+
+
+	def rebuild(self):
+		"""
+		Recomputes every rollup from the raw telemetry table
+		"""
+		with self._db.transaction() as con:
+			for table, size in self._TABLES.items():
+				con.execute('DELETE FROM {}'.format(table))
+				for metric in self.METRICS:
+					con.execute(self._REBUILD.format(table=table, metric=metric, size=size))
+
+
+	def update(self, con, batch):
+		"""
+		Folds a batch of raw rows into the rollups. Meant to be called within the transaction inserting the batch
+		:param con: sqlite connection holding the write transaction
+		:param batch: list of tuples, siteId, timestamp, temperature, luminosity, moisture, water
+		"""
+		buckets = dict()
+		for row in batch:
+			siteId, timestamp = row[0], row[1]
+			for metric, value in zip(self.METRICS, row[2:]):
+				if value is None:
+					continue
+
+				for table, size in self._TABLES.items():
+					key = (table, siteId, metric, timestamp // size * size)
+					bucket = buckets.get(key)
+					if bucket is None:
+						buckets[key] = [value, value, value, 1]
+					else:
+						bucket[0] = min(bucket[0], value)
+						bucket[1] = max(bucket[1], value)
+						bucket[2] += value
+						bucket[3] += 1
+
+		for table in self._TABLES:
+			keys = [key for key in buckets if key[0] == table]
+			con.executemany(self._INIT_BUCKET.format(table=table), [key[1:] + tuple(buckets[key][:2]) for key in keys])
+			con.executemany(self._UPDATE_BUCKET.format(table=table), [tuple(buckets[key]) + key[1:] for key in keys])
+
+
+	@property
+	def cutoff(self):
+		"""
+		Timestamp before which raw rows are expired, aligned on the hour so that only the hour a raw range starts in can
+		be partly expired
+		:return: integer, or None if the retention is disabled
+		"""
+		if self._retentionDays <= 0:
+			return None
+		return (int(time.time()) - self._retentionDays * self._DAY) // self._HOUR * self._HOUR
+
+
+	def prune(self):
+		"""
+		Deletes or archives the raw rows older than the retention. They are already part of the rollups
+		:return: integer, number of rows expired
+		"""
+		cutoff = self.cutoff
+		if cutoff is None:
+			return 0
+
+		if self._retentionMode == 'archive':
+			with self._db.transaction() as con:
+				con.execute('ATTACH DATABASE ? AS archive', (str(self._archiveFile),))
+			try:
+				with self._db.transaction() as con:
+					con.execute('CREATE TABLE IF NOT EXISTS archive.telemetry AS SELECT * FROM main.telemetry WHERE 0')
+					con.execute('INSERT INTO archive.telemetry SELECT * FROM main.telemetry WHERE timestamp < ?', (cutoff,))
+					count = con.execute('DELETE FROM main.telemetry WHERE timestamp < ?', (cutoff,)).rowcount
+			finally:
+				with self._db.transaction() as con:
+					con.execute('DETACH DATABASE archive')
+		else:
+			with self._db.transaction() as con:
+				count = con.execute('DELETE FROM telemetry WHERE timestamp < ?', (cutoff,)).rowcount
+
+		return count
+
+
+	def aggregate(self, siteId, metric, start, end):
+		"""
+		Returns min, max, average and count of a metric over a time range
+		Whole days are read from the daily rollups, whole hours from the hourly ones and only the partial hours at both
+		ends from the raw table. Partial hours that have been expired are answered with their full hour rollup
+		:param siteId: string
+		:param metric: string, one of METRICS
+		:param start: integer, timestamp, inclusive
+		:param end: integer, timestamp, inclusive
+		:return: dict, or None if there is no data in that range
+		"""
+		if metric not in self.METRICS:
+			raise ValueError('Unknown metric {}'.format(metric))
+
+		minimum = maximum = None
+		total = 0.0
+		count = 0
+		for query, replace in self._segments(siteId, metric, start, end + 1):
+			row = self._db.iterate(query, replace).first()
+			if not row[3]:
+				continue
+			minimum = row[0] if minimum is None else min(minimum, row[0])
+			maximum = row[1] if maximum is None else max(maximum, row[1])
+			total += row[2]
+			count += row[3]
+
+		if not count:
+			return None
+
+		return {
+			'minimum': minimum,
+			'maximum': maximum,
+			'average': total / count,
+			'count': count
+		}
+
+
+	def _segments(self, siteId, metric, start, end):
+		"""
+		Splits [start, end[ into the queries answering it
+		:return: list of (query, replace) tuples
+		"""
+		hourStart = int(math.ceil(start / self._HOUR)) * self._HOUR
+		hourEnd = end // self._HOUR * self._HOUR
+		if hourStart >= hourEnd:
+			return self._rawSegments(siteId, metric, start, end)
+
+		segments = list()
+		if start < hourStart:
+			segments += self._rawSegments(siteId, metric, start, hourStart)
+		if hourEnd < end:
+			segments += self._rawSegments(siteId, metric, hourEnd, end)
+
+		dayStart = int(math.ceil(hourStart / self._DAY)) * self._DAY
+		dayEnd = hourEnd // self._DAY * self._DAY
+		if dayStart < dayEnd:
+			segments.append(self._rollupSegment('telemetry_daily', siteId, metric, dayStart, dayEnd))
+			ranges = ((hourStart, dayStart), (dayEnd, hourEnd))
+		else:
+			ranges = ((hourStart, hourEnd),)
+
+		for rangeStart, rangeEnd in ranges:
+			if rangeStart < rangeEnd:
+				segments.append(self._rollupSegment('telemetry_hourly', siteId, metric, rangeStart, rangeEnd))
+
+		return segments
+
+
+	def _rawSegments(self, siteId, metric, start, end):
+		"""
+		Raw rows for [start, end[, the part of it before the cutoff, whose raw rows are gone, from the hours containing it
+		:return: list of (query, replace) tuples
+		"""
+		cutoff = self.cutoff
+		segments = list()
+		if cutoff is not None and start < cutoff:
+			segments.append(self._rollupSegment('telemetry_hourly', siteId, metric, start // self._HOUR * self._HOUR, min(end, cutoff)))
+			start = cutoff
+		if start < end:
+			segments.append((self._AGGREGATE_RAW.format(metric=metric), (siteId, start, end)))
+		return segments
+
+
+	def _rollupSegment(self, table, siteId, metric, start, end):
+		return self._AGGREGATE_ROLLUP.format(table=table), (siteId, metric, start, end)
+
+
+if __name__ == '__main__':
+	# Compares raw and rollup answers over a synthetic multi year dataset and enforces the p99 latency budget of interval questions
+	# Usage: python3 Rollups.py [years] [sites]
+	import os
+	import random
+	import sys
+	import tempfile
+	from Database import Database
+
+	budget = 50 # milliseconds, p99 of an interval aggregate
+	years = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+	sites = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+	schema = 'CREATE TABLE IF NOT EXISTS telemetry (id integer PRIMARY KEY, siteId TEXT NOT NULL, timestamp integer NOT NULL, temperature REAL, luminosity REAL, moisture REAL, water INTEGER); CREATE INDEX IF NOT EXISTS telemetry_site_timestamp ON telemetry (siteId, timestamp DESC);'
+
+	with tempfile.TemporaryDirectory() as tmp:
+		db = Database(os.path.join(tmp, 'bench.db'))
+		db.executescript(schema)
+		now = int(time.time())
+		first = now - int(years * 365 * Rollups._DAY)
+		total = 0
+		for site in range(sites):
+			rows = [('bench{}'.format(site), timestamp, random.uniform(15, 25), random.uniform(0, 100), random.uniform(20, 60), random.choice((0, 25, 50, 75, 100))) for timestamp in range(first, now, 300)]
+			db.executemany('INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)', rows)
+			total += len(rows)
+		print('{} raw rows'.format(total))
+
+		rollups = Rollups(db)
+		start = time.perf_counter()
+		rollups.initTables()
+		print('Rollups built in {:.2f}s'.format(time.perf_counter() - start))
+
+		ranges = [(now - days * Rollups._DAY + 1234, now) for days in (1, 30, 365, int(years * 365) - 1)]
+		for rangeStart, rangeEnd in ranges:
+			start = time.perf_counter()
+			raw = db.iterate(Rollups._AGGREGATE_RAW.format(metric='moisture'), ('bench0', rangeStart, rangeEnd + 1)).first()
+			rawTime = (time.perf_counter() - start) * 1000
+
+			start = time.perf_counter()
+			rolled = rollups.aggregate('bench0', 'moisture', rangeStart, rangeEnd)
+			rollupTime = (time.perf_counter() - start) * 1000
+
+			assert raw[3] == rolled['count']
+			print('{:5d} days  raw: {:8.3f}ms  rollups: {:8.3f}ms'.format((rangeEnd - rangeStart) // Rollups._DAY + 1, rawTime, rollupTime))
+
+		latencies = list()
+		for _ in range(1000):
+			rangeStart = random.randint(first, now)
+			rangeEnd = random.randint(rangeStart, now)
+			start = time.perf_counter()
+			rollups.aggregate('bench{}'.format(random.randrange(sites)), random.choice(Rollups.METRICS), rangeStart, rangeEnd)
+			latencies.append((time.perf_counter() - start) * 1000)
+		db.close()
+
+		# A range without a full hour crossing the cutoff must keep the expired rows before it, through their hour rollup
+		db = Database(os.path.join(tmp, 'prune.db'))
+		db.executescript(schema)
+		rollups = Rollups(db, retentionDays=1)
+		cutoff = rollups.cutoff
+		db.executemany('INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)', [('prune', timestamp, 20, 50, 40, 75) for timestamp in range(cutoff - 1800, cutoff + 900, 300)])
+		rollups.initTables()
+		before = rollups.aggregate('prune', 'moisture', cutoff - 1800, cutoff + 900)['count']
+		rollups.prune()
+		after = rollups.aggregate('prune', 'moisture', cutoff - 1800, cutoff + 900)['count']
+		db.close()
+		assert before == after == 9, 'range across the cutoff lost rows after prune: {} then {}'.format(before, after)
+		print('Range across the cutoff after prune: {} rows, as before'.format(after))
+
+	latencies.sort()
+	p99 = latencies[int(len(latencies) * 0.99) - 1]
+	print('Random intervals  p50: {:.3f}ms  p99: {:.3f}ms  budget: {}ms'.format(latencies[len(latencies) // 2], p99, budget))
+	if p99 > budget:
+		print('p99 over budget')
+		sys.exit(1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class RowStream:
+	"""
+	Lazy view over the rows of a query, fetched a fixed size batch at a time
+	Filters and maps are applied batch by batch as the rows are consumed, so that memory stays bounded by the batch size
+	however many rows the query returns. The database connection is held until the stream is exhausted or closed
+	"""
+
+	def __init__(self, batches):
+		"""
+		:param batches: generator of lists of rows
+		"""
+		self._batches = batches
+
+
+	def __iter__(self):
+		try:
+			for batch in self._batches:
+				yield from batch
+		finally:
+			self.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+
+	def batches(self):
+		"""
+		:return: generator of lists of rows
+		"""
+		try:
+			yield from self._batches
+		finally:
+			self.close()
+
+
+	def filter(self, predicate):
+		"""
+		:param predicate: callable taking a row, rows for which it returns False are skipped
+		:return: RowStream
+		"""
+		return RowStream([row for row in batch if predicate(row)] for batch in self.batches())
+
+
+	def map(self, function):
+		"""
+		:param function: callable taking a row and returning the new row
+		:return: RowStream
+		"""
+		return RowStream([function(row) for row in batch] for batch in self.batches())
+
+
+	def reduce(self, function, initial):
+		"""
+		Folds every row into a single value
+		:param function: callable taking the value so far and a row, returning the new value
+		:param initial: starting value
+		:return: the final value
+		"""
+		value = initial
+		for row in self:
+			value = function(value, row)
+		return value
+
+
+	def first(self):
+		"""
+		:return: the first row, or None if there is none. The rest of the query is never fetched
+		"""
+		try:
+			for row in self:
+				return row
+			return None
+		finally:
+			self.close()
+
+
+	def count(self):
+		"""
+		:return: integer, number of rows, consumed without keeping them
+		"""
+		return sum(len(batch) for batch in self.batches())
+
+
+	def close(self):
+		"""
+		Stops the query and gives the connection back. Safe to call more than once
+		"""
+		close = getattr(self._batches, 'close', None)
+		if close is not None:
+			close()
+
+
+if __name__ == '__main__':
+	# Shows that streaming keeps the peak memory flat whatever the number of rows, where fetching them all grows with it
+	# Usage: python3 RowStream.py [millions of rows]
+	from Database import Database
+	import os
+	import sys
+	import tempfile
+	import tracemalloc
+
+	count = int(float(sys.argv[1]) * 1000000) if len(sys.argv) > 1 else 2000000
+	schema = 'CREATE TABLE IF NOT EXISTS telemetry (id integer PRIMARY KEY, siteId TEXT NOT NULL, timestamp integer NOT NULL, temperature REAL, luminosity REAL, moisture REAL, water INTEGER);'
+	query = 'SELECT * FROM telemetry WHERE siteId = ? AND id <= ?'
+
+	with tempfile.TemporaryDirectory() as tmp:
+		db = Database(os.path.join(tmp, 'data.db'))
+		db.executescript(schema)
+		db.executemany(
+			'INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)',
+			(('bench', i, 20.0, 50.0, float(i % 100), 75) for i in range(count))
+		)
+
+		print('{:>10s}  {:>22s}  {:>22s}'.format('rows', 'streamed peak', 'fetched peak'))
+		for rows in (count // 100, count // 10, count):
+			tracemalloc.start()
+			dry = db.iterate(query, ('bench', rows)).filter(lambda row: row[5] < 10).reduce(lambda total, row: total + 1, 0)
+			streamed = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			tracemalloc.start()
+			fetched = sum(1 for row in db.fetch(query, ('bench', rows)) if row[5] < 10)
+			materialized = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			assert dry == fetched
+			print('{:10d}  {:20.1f}MB  {:20.1f}MB'.format(rows, streamed / 1048576, materialized / 1048576))
+		db.close()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from FlowerStates import State
+import numpy as np
+import threading
+
+
+class RuleEngine:
+	"""
+	Holds every site's latest readings and its plant's alert bands in numpy arrays, one row per site, so that all the
+	threshold rules are evaluated for all the sites in a single vectorized pass
+	Rules are listed by priority, the first one a site violates decides its state
+	"""
+
+	# Reading columns
+	WATER = 0
+	MOISTURE = 1
+	TEMPERATURE = 2
+	LUMINOSITY = 3 # Average over the rolling window, at night the instant value is meaningless
+
+	# (telemetry, limit, state, reading column, band the limit comes from, None for an empty tank)
+	# A reading violates a 'min' rule when under its limit, a 'max' rule when over it, and the tank when it reaches 0
+	RULES = (
+		('water', 'min', State.OUT_OF_WATER, WATER, None),
+		('moisture', 'min', State.THIRSTY, MOISTURE, ('moisture', 0)),
+		('moisture', 'max', State.DRAWNED, MOISTURE, ('moisture', 1)),
+		('temperature', 'min', State.COLD, TEMPERATURE, ('temperature', 0)),
+		('temperature', 'max', State.HOT, TEMPERATURE, ('temperature', 1)),
+		('luminosity', 'min', State.TOO_DARK, LUMINOSITY, ('luminosity', 0)),
+		('luminosity', 'max', State.TOO_BRIGHT, LUMINOSITY, ('luminosity', 1))
+	)
+
+	def __init__(self, capacity=64):
+		"""
+		:param capacity: integer, initial number of site rows, grown as needed
+		"""
+		self._rows = dict()
+		self._siteIds = list()
+		self._readings = np.full((capacity, 4), np.nan)
+		self._limits = np.full((capacity, len(self.RULES)), np.nan)
+		self._lock = threading.Lock()
+
+		self._columns = np.array([rule[3] for rule in self.RULES])
+		self._below = np.array([rule[1] == 'min' for rule in self.RULES])
+		self._inclusive = np.array([rule[4] is None for rule in self.RULES])
+
+
+	def setPlant(self, siteId, plant):
+		"""
+		Sets the limits the site is checked against
+		:param siteId: string
+		:param plant: Plant
+		"""
+		limits = [0.0 if band is None else plant.bands[band[0]][band[1]] for _, _, _, _, band in self.RULES]
+		with self._lock:
+			row = self._row(siteId)
+			self._limits[row] = limits
+
+
+	def update(self, siteId, water, moisture, temperature, luminosity):
+		"""
+		Records the latest readings of a site
+		:param siteId: string
+		:param water: float
+		:param moisture: float
+		:param temperature: float
+		:param luminosity: float, rolling average, None if unknown
+		"""
+		with self._lock:
+			row = self._row(siteId)
+			self._readings[row] = [water, moisture, temperature, np.nan if luminosity is None else luminosity]
+
+
+	def evaluate(self):
+		"""
+		Evaluates every rule for every site. Sites without a plant or readings never violate anything
+		:return: tuple, the site ids and a boolean matrix, one row per site and one column per rule
+		"""
+		with self._lock:
+			count = len(self._siteIds)
+			return list(self._siteIds), self._evaluate(self._readings[:count], self._limits[:count])
+
+
+	def check(self, siteId):
+		"""
+		Evaluates every rule for a single site
+		:param siteId: string
+		:return: list of (telemetry, limit, state) tuples, by priority, empty if everything's fine
+		"""
+		with self._lock:
+			row = self._rows.get(siteId)
+			if row is None:
+				return []
+			violations = self._evaluate(self._readings[row:row + 1], self._limits[row:row + 1])[0]
+
+		return [self.RULES[i][:3] for i in np.flatnonzero(violations)]
+
+
+	def sweep(self):
+		"""
+		Evaluates every rule for every site that has both a plant and readings
+		:return: dict, site id to the list of (telemetry, limit, state) tuples it violates, by priority
+		"""
+		with self._lock:
+			count = len(self._siteIds)
+			siteIds = list(self._siteIds)
+			violations = self._evaluate(self._readings[:count], self._limits[:count])
+			ready = ~np.isnan(self._limits[:count, 0]) & ~np.isnan(self._readings[:count, self.WATER])
+
+		result = {siteIds[row]: [] for row in np.flatnonzero(ready).tolist()}
+		rules = [rule[:3] for rule in self.RULES]
+		# Row major order keeps each site's violations by priority
+		rows, columns = np.nonzero(violations & ready[:, None])
+		for row, column in zip(rows.tolist(), columns.tolist()):
+			result[siteIds[row]].append(rules[column])
+		return result
+
+
+	def _evaluate(self, readings, limits):
+		values = readings[:, self._columns]
+		# Comparisons against nan are False, unknown readings or limits raise nothing
+		with np.errstate(invalid='ignore'):
+			return np.where(self._below, values < limits, values > limits) | (self._inclusive & (values == limits))
+
+
+	def _row(self, siteId):
+		row = self._rows.get(siteId)
+		if row is not None:
+			return row
+
+		row = len(self._siteIds)
+		if row >= len(self._readings):
+			self._readings = np.concatenate((self._readings, np.full_like(self._readings, np.nan)))
+			self._limits = np.concatenate((self._limits, np.full_like(self._limits, np.nan)))
+
+		self._rows[siteId] = row
+		self._siteIds.append(siteId)
+		return row
+
+
+	def __len__(self):
+		return len(self._siteIds)
+
+
+if __name__ == '__main__':
+	# Compares one vectorized sweep over every site with the per report if/elif checks it replaces
+	# Usage: python3 RuleEngine.py [sites]
+	from Plant import Plant
+	import random
+	import sys
+	import time
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	random.seed(1)
+	plant = Plant('dragon tree', {'scientific_name': 'dracaena marginata', 'moisture_min': 20, 'moisture_max': 30, 'temperature_min': 10, 'temperature_max': 35, 'humidity_min': 35, 'humidity_max': 55, 'luminosity_min': 40, 'luminosity_max': 70})
+	sites = {
+		'site{}'.format(i): {'water': random.choice((0, 50, 75)), 'moisture': random.uniform(10, 40), 'temperature': random.uniform(5, 40), 'luminosity': random.uniform(30, 80)}
+		for i in range(count)
+	}
+
+	def checkData(data, bands):
+		# The per report path, first violation only
+		if data['water'] <= 0:
+			return State.OUT_OF_WATER
+		elif data['moisture'] < bands['moisture'][0]:
+			return State.THIRSTY
+		if data['moisture'] > bands['moisture'][1]:
+			return State.DRAWNED
+		elif data['temperature'] < bands['temperature'][0]:
+			return State.COLD
+		elif data['temperature'] > bands['temperature'][1]:
+			return State.HOT
+		elif data['luminosity'] < bands['luminosity'][0]:
+			return State.TOO_DARK
+		elif data['luminosity'] > bands['luminosity'][1]:
+			return State.TOO_BRIGHT
+		return State.OK
+
+	engine = RuleEngine()
+	for siteId, data in sites.items():
+		engine.setPlant(siteId, plant)
+		engine.update(siteId, data['water'], data['moisture'], data['temperature'], data['luminosity'])
+
+	start = time.perf_counter()
+	expected = {siteId: checkData(data, plant.bands) for siteId, data in sites.items()}
+	python = time.perf_counter() - start
+
+	start = time.perf_counter()
+	siteIds, violations = engine.evaluate()
+	vectorized = time.perf_counter() - start
+
+	start = time.perf_counter()
+	result = engine.sweep()
+	sweep = time.perf_counter() - start
+
+	states = {siteId: found[0][2] if found else State.OK for siteId, found in result.items()}
+	print('{} sites, {} violations'.format(count, int(violations.sum())))
+	print('per report python checks: {:8.2f}ms'.format(python * 1000))
+	print('vectorized evaluation:    {:8.2f}ms'.format(vectorized * 1000))
+	print('sweep with violation lists: {:6.2f}ms'.format(sweep * 1000))
+	print('same states as the python path: {}'.format(states == expected))
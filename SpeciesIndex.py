@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+
+class SpeciesIndex:
+	"""
+	Fuzzy lookup of plant names, common or scientific, as understood by the speech recognition
+	Candidates are found through a trigram inverted index and then ranked by edit distance, so that only a handful
+	of names are ever compared with the query, whatever the size of the catalog
+	"""
+
+	_CANDIDATES = 30
+
+	def __init__(self):
+		self._names = list() # Normalized names
+		self._plants = list() # Plant name for each entry of _names
+		self._trigrams = defaultdict(list) # Trigram to ids in _names
+
+
+	def add(self, name, plantName):
+		"""
+		:param name: string, normalized name the plant can be called by
+		:param plantName: string, catalog name of the plant
+		"""
+		nameId = len(self._names)
+		self._names.append(name)
+		self._plants.append(plantName)
+		for trigram in set(self._split(name)):
+			ids = self._trigrams[trigram]
+			if isinstance(ids, tuple):
+				# Loaded from the cache as a tuple, turned back into a list the first time it grows
+				ids = self._trigrams[trigram] = list(ids)
+			ids.append(nameId)
+
+
+	def search(self, query, limit=1):
+		"""
+		Finds the closest plant names
+		:param query: string, normalized
+		:param limit: integer, number of results
+		:return: list of (plantName, matchedName, distance) tuples, closest first
+		"""
+		if not query:
+			return []
+
+		counts = defaultdict(int)
+		for trigram in set(self._split(query)):
+			for nameId in self._trigrams.get(trigram, ()):
+				counts[nameId] += 1
+
+		maxDistance = self.maxDistance(query)
+		ranked = list()
+		for nameId in sorted(counts, key=counts.get, reverse=True)[:self._CANDIDATES]:
+			distance = self.distance(query, self._names[nameId], maxDistance)
+			if distance <= maxDistance:
+				ranked.append((distance, -counts[nameId], nameId))
+
+		results = list()
+		seen = set()
+		for distance, _, nameId in sorted(ranked):
+			if self._plants[nameId] in seen:
+				continue
+			seen.add(self._plants[nameId])
+			results.append((self._plants[nameId], self._names[nameId], distance))
+			if len(results) >= limit:
+				break
+
+		return results
+
+
+	@staticmethod
+	def maxDistance(query):
+		"""
+		How many edits we tolerate before a name stops being a match, about one every four characters
+		:param query: string
+		:return: integer
+		"""
+		return max(1, len(query) // 4)
+
+
+	@staticmethod
+	def distance(a, b, limit=None):
+		"""
+		Levenshtein distance, giving up as soon as it exceeds the limit
+		:param a: string
+		:param b: string
+		:param limit: integer, distance above which we don't care about the exact value
+		:return: integer, limit + 1 if over the limit
+		"""
+		if limit is not None and abs(len(a) - len(b)) > limit:
+			return limit + 1
+
+		previous = list(range(len(b) + 1))
+		for i, charA in enumerate(a, 1):
+			current = [i]
+			for j, charB in enumerate(b, 1):
+				current.append(min(
+					previous[j] + 1,
+					current[j - 1] + 1,
+					previous[j - 1] + (charA != charB)
+				))
+			if limit is not None and min(current) > limit:
+				return limit + 1
+			previous = current
+
+		return previous[-1]
+
+
+	@staticmethod
+	def _split(name):
+		padded = '  {} '.format(name)
+		return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+	def __len__(self):
+		return len(self._names)
+
+
+	def __getstate__(self):
+		# defaultdict of lists pickles slower than a plain dict of tuples
+		return {
+			'names': self._names,
+			'plants': self._plants,
+			'trigrams': {trigram: tuple(ids) for trigram, ids in self._trigrams.items()}
+		}
+
+
+	def __setstate__(self, state):
+		# The postings stay tuples, add() turns the ones it extends back into lists
+		self._names = state['names']
+		self._plants = state['plants']
+		self._trigrams = defaultdict(list, state['trigrams'])
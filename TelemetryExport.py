@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+
+
+class TelemetryExport:
+	"""
+	Telemetry history as numpy columns, timestamps as int64 and metrics as float32, for analysis
+	Rows are streamed from sqlite in chunks straight into preallocated arrays. Past ranges can be cached on disk as one
+	.npy file per column, that are memory mapped when asked again, so that a multi year history never has to fit in memory
+	and is never queried twice
+	"""
+
+	FIELDS = ('temperature', 'luminosity', 'moisture', 'water')
+
+	_QUERY_COUNT = 'SELECT COUNT(*) FROM telemetry WHERE siteId = ? AND timestamp >= ? AND timestamp <= ?'
+	_QUERY_HISTORY = 'SELECT timestamp, {} FROM telemetry WHERE siteId = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp LIMIT ?'
+
+	# Reports still waiting in the telemetry writer can land in a range this recent, such ranges are never cached
+	_SETTLE_TIME = 60
+
+	def __init__(self, db, cacheDir=None, chunkSize=4096):
+		"""
+		:param db: Database
+		:param cacheDir: Path, where to cache the exported columns, None to never cache
+		:param chunkSize: integer, rows fetched from sqlite at once
+		"""
+		self._db = db
+		self._cacheDir = Path(cacheDir) if cacheDir is not None else None
+		self._chunkSize = chunkSize
+
+
+	def getHistory(self, siteId, start, end, fields=FIELDS):
+		"""
+		Exports the telemetry a site reported in a time range
+		:param siteId: string
+		:param start: integer, timestamp, inclusive
+		:param end: integer, timestamp, inclusive
+		:param fields: iterable of metric names
+		:return: dict, 'timestamp' and each field to a numpy array, oldest first. Memory mapped, read only, if cached
+		:raises ValueError: on unknown fields, or a site id that can't name a cache directory
+		"""
+		fields = tuple(fields)
+		unknown = set(fields) - set(self.FIELDS)
+		if unknown:
+			raise ValueError('Unknown telemetry fields: {}'.format(', '.join(sorted(unknown))))
+
+		# Site ids come from mqtt payloads, one must never lead the cache outside of its directory
+		siteId = str(siteId)
+		if siteId in ('', '.', '..') or '/' in siteId or '\\' in siteId or '\0' in siteId:
+			raise ValueError('Invalid site id: {!r}'.format(siteId))
+
+		directory = None
+		if self._cacheDir is not None and end < time.time() - self._SETTLE_TIME:
+			directory = self._cacheDir / str(siteId) / '{}-{}'.format(int(start), int(end))
+			history = self._loadCache(directory, ('timestamp',) + fields)
+			if history is not None:
+				return history
+
+		count = self._db.iterate(self._QUERY_COUNT, (siteId, start, end)).first()[0]
+		columns = ('timestamp',) + fields
+		if directory is not None:
+			directory.mkdir(parents=True, exist_ok=True)
+			# Columns are written straight to disk, they never have to fit in memory
+			history = {column: np.lib.format.open_memmap(self._tmpFile(directory, column), mode='w+', dtype=self._dtype(column), shape=(count,)) for column in columns}
+		else:
+			history = {column: np.empty(count, dtype=self._dtype(column)) for column in columns}
+
+		filled = self._stream(siteId, start, end, fields, count, history)
+
+		if directory is None:
+			return {column: array[:filled] for column, array in history.items()}
+
+		if filled < count:
+			# Rows expired by the retention between the count and the query, this export is not worth caching
+			history = {column: np.array(array[:filled]) for column, array in history.items()}
+			for column in columns:
+				os.remove(self._tmpFile(directory, column))
+			return history
+
+		for array in history.values():
+			array.flush()
+		history.clear()
+		for column in columns:
+			os.replace(self._tmpFile(directory, column), str(directory / '{}.npy'.format(column)))
+
+		return self._loadCache(directory, columns)
+
+
+	def clearCache(self, siteId=None):
+		"""
+		Removes the cached exports, of a site or of every site
+		:param siteId: string
+		"""
+		if self._cacheDir is None:
+			return
+
+		directory = self._cacheDir / str(siteId) if siteId is not None else self._cacheDir
+		shutil.rmtree(str(directory), ignore_errors=True)
+
+
+	def _stream(self, siteId, start, end, fields, count, history):
+		"""
+		Copies the rows into the arrays, one chunk at a time
+		:return: integer, number of rows copied
+		"""
+		query = self._QUERY_HISTORY.format(', '.join(fields))
+		columns = [history['timestamp']] + [history[field] for field in fields]
+		filled = 0
+		# Rows reported after the count are left out by the limit, the arrays can't overflow
+		for rows in self._db.batches(query, (siteId, start, end, count), self._chunkSize):
+			chunk = np.array(rows, dtype=np.float64)
+			# Null metrics become nan
+			for i, column in enumerate(columns):
+				column[filled:filled + len(rows)] = chunk[:, i]
+			filled += len(rows)
+		return filled
+
+
+	@staticmethod
+	def _tmpFile(directory, column):
+		"""
+		Where a column is written before being moved in the cache. Named after the process and thread writing it, so that
+		concurrent exports of the same range never write the same file, whichever finishes last wins
+		:return: string
+		"""
+		return str(directory / '{}.{}-{}.tmp.npy'.format(column, os.getpid(), threading.get_ident()))
+
+
+	def _loadCache(self, directory, columns):
+		history = dict()
+		for column in columns:
+			file = directory / '{}.npy'.format(column)
+			if not file.exists():
+				return None
+			history[column] = np.load(str(file), mmap_mode='r')
+		return history
+
+
+	@staticmethod
+	def _dtype(column):
+		return np.int64 if column == 'timestamp' else np.float32
+
+
+if __name__ == '__main__':
+	# Exports a generated multi year history, compares it with fetching python tuples, then reopens the cache
+	# Usage: python3 TelemetryExport.py [years]
+	from Database import Database
+	import resource
+	import sys
+	import tempfile
+
+	years = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+	count = int(years * 365 * 288)
+	now = int(time.time()) - 3600
+	schema = 'CREATE TABLE IF NOT EXISTS telemetry (id integer PRIMARY KEY, siteId TEXT NOT NULL, timestamp integer NOT NULL, temperature REAL, luminosity REAL, moisture REAL, water INTEGER);' \
+		'CREATE INDEX IF NOT EXISTS telemetry_site_timestamp ON telemetry (siteId, timestamp DESC);'
+
+	with tempfile.TemporaryDirectory() as tmp:
+		db = Database(os.path.join(tmp, 'data.db'))
+		db.executescript(schema)
+		db.executemany(
+			'INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)',
+			(('bench', now - 300 * i, 20.0 + i % 7, 50.0, 40.0 - i % 11, 75) for i in range(count))
+		)
+
+		export = TelemetryExport(db, Path(tmp, 'exports'))
+		start = now - count * 300
+
+		began = time.perf_counter()
+		export.getHistory('bench', start, now)
+		cached = time.perf_counter() - began
+
+		began = time.perf_counter()
+		history = export.getHistory('bench', start, now)
+		average = float(history['moisture'].mean())
+		reopened = time.perf_counter() - began
+		del history
+		exportPeak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+		began = time.perf_counter()
+		history = TelemetryExport(db).getHistory('bench', start, now)
+		exported = time.perf_counter() - began
+		del history
+
+		began = time.perf_counter()
+		rows = db.fetch('SELECT * FROM telemetry WHERE siteId = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp', ('bench', start, now))
+		assert abs(sum(row[5] for row in rows) / len(rows) - average) < 0.01
+		fetched = time.perf_counter() - began
+		del rows
+		fetchPeak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		db.close()
+
+	print('{} rows'.format(count))
+	print('fetchall into python tuples: {:8.0f}ms'.format(fetched * 1000))
+	print('chunked numpy export:        {:8.0f}ms'.format(exported * 1000))
+	print('export written to the cache: {:8.0f}ms'.format(cached * 1000))
+	print('cache reopened and averaged: {:8.1f}ms'.format(reopened * 1000))
+	print('peak rss after the cached export: {:.0f}MB, after fetchall: {:.0f}MB'.format(exportPeak / 1024, fetchPeak / 1024))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+try:
+	import queue as Queue
+except ImportError:
+	import Queue as Queue
+
+
+class TelemetryWriter:
+	"""
+	Background ingestion of the telemetry reports
+	Reports are queued and a writer thread inserts them in batches, in one single transaction,
+	once it has enough rows or once the oldest row waited long enough
+	"""
+
+	_INSERT = 'INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)'
+	_STOP = object()
+
+	def __init__(self, db, batchSize=100, flushInterval=500, maxQueue=10000, putTimeout=2.0, listeners=None):
+		"""
+		Starts the writer thread
+		:param db: Database
+		:param batchSize: integer, rows that trigger a flush
+		:param flushInterval: integer, milliseconds a row can wait before being flushed
+		:param maxQueue: integer, queued rows before producers are blocked
+		:param putTimeout: float, seconds a producer waits on a full queue before the row is dropped
+		:param listeners: list of callables, called with the connection and the batch inside the insert transaction
+		"""
+		self._db = db
+		self._batchSize = batchSize
+		self._flushInterval = flushInterval / 1000
+		self._putTimeout = putTimeout
+		self._listeners = listeners or list()
+		self._queue = Queue.Queue(maxsize=maxQueue)
+		self._lock = threading.Lock()
+		self._stats = {
+			'queued': 0,
+			'dropped': 0,
+			'batches': 0,
+			'rows': 0,
+			'errors': 0,
+			'lastBatchSize': 0,
+			'maxBatchSize': 0,
+			'lastFlushLatency': 0.0,
+			'maxFlushLatency': 0.0,
+			'totalFlushLatency': 0.0
+		}
+		self._thread = threading.Thread(target=self._run, name='TelemetryWriter')
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+
+	def put(self, row):
+		"""
+		Queues a row for insertion. Blocks the caller while the queue is full, which slows the producers down
+		:param row: list or tuple, siteId, timestamp, temperature, luminosity, moisture, water
+		:return: boolean, False if the row had to be dropped
+		"""
+		try:
+			self._queue.put(tuple(row), timeout=self._putTimeout)
+		except Queue.Full:
+			with self._lock:
+				self._stats['dropped'] += 1
+			print('Telemetry queue is full, dropping report from {}'.format(row[0]))
+			return False
+
+		with self._lock:
+			self._stats['queued'] += 1
+		return True
+
+
+	def stats(self):
+		"""
+		Returns the writer counters along with the actual queue depth
+		:return: dict
+		"""
+		with self._lock:
+			stats = dict(self._stats)
+		stats['queueDepth'] = self._queue.qsize()
+		stats['averageBatchSize'] = stats['rows'] / stats['batches'] if stats['batches'] else 0
+		stats['averageFlushLatency'] = stats['totalFlushLatency'] / stats['batches'] if stats['batches'] else 0
+		return stats
+
+
+	def onStop(self):
+		"""
+		Flushes everything still queued and stops the writer thread
+		"""
+		self._queue.put(self._STOP)
+		self._thread.join()
+
+
+	def _run(self):
+		"""
+		Writer thread, waits for a first row and then gathers more until the batch is full or the interval has passed
+		"""
+		running = True
+		while running:
+			item = self._queue.get()
+			if item is self._STOP:
+				break
+
+			batch = [item]
+			deadline = time.monotonic() + self._flushInterval
+			while len(batch) < self._batchSize:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					item = self._queue.get(timeout=remaining)
+				except Queue.Empty:
+					break
+
+				if item is self._STOP:
+					running = False
+					break
+				batch.append(item)
+
+			self._flush(batch)
+
+		# Whatever made it in the queue before the stop must reach the disk
+		batch = list()
+		while not self._queue.empty():
+			item = self._queue.get_nowait()
+			if item is not self._STOP:
+				batch.append(item)
+		if batch:
+			self._flush(batch)
+
+
+	def _flush(self, batch):
+		"""
+		Inserts the batch in one transaction, along with whatever the listeners derive from it
+		Any error rolls the batch back and is counted, a failing listener must not kill the writer thread
+		:param batch: list of tuples
+		"""
+		start = time.perf_counter()
+		try:
+			with self._db.transaction() as con:
+				con.executemany(self._INSERT, batch)
+				for listener in self._listeners:
+					listener(con, batch)
+		except Exception as e:
+			print('Error writing telemetry batch: {}'.format(e))
+			with self._lock:
+				self._stats['errors'] += 1
+			return
+
+		latency = time.perf_counter() - start
+		with self._lock:
+			self._stats['batches'] += 1
+			self._stats['rows'] += len(batch)
+			self._stats['lastBatchSize'] = len(batch)
+			self._stats['maxBatchSize'] = max(self._stats['maxBatchSize'], len(batch))
+			self._stats['lastFlushLatency'] = latency
+			self._stats['maxFlushLatency'] = max(self._stats['maxFlushLatency'], latency)
+			self._stats['totalFlushLatency'] += latency
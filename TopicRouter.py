@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class TopicRouter:
+	"""
+	Maps mqtt topics to their handler, built once at startup
+	Exact topics are found with a dict lookup, wildcard topics ('+' for one level, '#' for the rest) are matched once
+	and then remembered. Each handler declares the payload fields it needs, they are validated before it is called
+	"""
+
+	_MAX_CACHED_TOPICS = 1024
+
+	def __init__(self, metrics=None):
+		"""
+		:param metrics: Metrics, handler timings and dropped messages are recorded there too if given
+		"""
+		self._metrics = metrics
+		self._instruments = dict()
+		self._routes = dict()
+		self._wildcards = list()
+		self._matched = dict()
+		self._lock = threading.Lock()
+		self._stats = dict()
+
+
+	def register(self, topic, handler, fields=None):
+		"""
+		Registers a handler for a topic
+		:param topic: string, may contain '+' and '#' wildcards
+		:param handler: callable, called with the topic and the payload
+		:param fields: list of strings, payload fields the handler needs, dotted for nested ones, like 'data.moisture'
+		"""
+		route = (topic, handler, tuple(field.split('.') for field in fields or ()))
+		if '+' in topic or '#' in topic:
+			self._wildcards.append((topic.split('/'), route))
+		else:
+			self._routes[topic] = route
+
+		with self._lock:
+			self._stats[topic] = {
+				'calls': 0,
+				'invalid': 0,
+				'errors': 0,
+				'totalTime': 0.0,
+				'maxTime': 0.0
+			}
+
+		if self._metrics is not None:
+			labels = {'topic': topic}
+			self._instruments[topic] = {
+				'calls': self._metrics.histogram('mqtt_handler_seconds', 'Time spent in the handler of a topic', labels),
+				'invalid': self._metrics.counter('mqtt_invalid_total', 'Messages dropped for missing a field their handler needs', labels),
+				'errors': self._metrics.counter('mqtt_errors_total', 'Messages whose handler raised', labels)
+			}
+
+
+	@property
+	def topics(self):
+		"""
+		Every registered topic, to subscribe to
+		:return: list
+		"""
+		return list(self._routes) + [route[0] for _, route in self._wildcards]
+
+
+	def route(self, topic, payload):
+		"""
+		Calls the handler registered for that topic if the payload holds the fields it needs
+		:param topic: string
+		:param payload: dict
+		:return: boolean, True if a handler was called
+		"""
+		route = self._routes.get(topic) or self._matched.get(topic)
+		if route is None:
+			route = self._match(topic)
+			if route is None:
+				return False
+
+		pattern, handler, fields = route
+		for path in fields:
+			value = payload
+			for key in path:
+				if not isinstance(value, dict) or key not in value:
+					print('Dropping message on {}, missing field "{}"'.format(topic, '.'.join(path)))
+					self._record(pattern, 'invalid')
+					return False
+				value = value[key]
+
+		start = time.perf_counter()
+		try:
+			handler(topic, payload)
+		except Exception as e:
+			print('Error handling {}: {}'.format(topic, e))
+			self._record(pattern, 'errors')
+		self._record(pattern, 'calls', time.perf_counter() - start)
+		return True
+
+
+	def stats(self):
+		"""
+		Per topic call counts and handler timings in seconds
+		:return: dict
+		"""
+		with self._lock:
+			stats = {topic: dict(values) for topic, values in self._stats.items()}
+
+		for values in stats.values():
+			values['averageTime'] = values['totalTime'] / values['calls'] if values['calls'] else 0
+		return stats
+
+
+	def _match(self, topic):
+		levels = topic.split('/')
+		for pattern, route in self._wildcards:
+			if self.matches(pattern, levels):
+				if len(self._matched) < self._MAX_CACHED_TOPICS:
+					self._matched[topic] = route
+				return route
+		return None
+
+
+	@staticmethod
+	def matches(pattern, levels):
+		"""
+		Mqtt topic filter matching
+		:param pattern: list, filter split on '/'
+		:param levels: list, topic split on '/'
+		:return: boolean
+		"""
+		for i, level in enumerate(pattern):
+			if level == '#':
+				return True
+			if i >= len(levels) or (level != '+' and level != levels[i]):
+				return False
+		return len(pattern) == len(levels)
+
+
+	def _record(self, topic, counter, elapsed=None):
+		with self._lock:
+			stats = self._stats[topic]
+			stats[counter] += 1
+			if elapsed is not None:
+				stats['totalTime'] += elapsed
+				stats['maxTime'] = max(stats['maxTime'], elapsed)
+
+		instruments = self._instruments.get(topic)
+		if instruments is not None:
+			if elapsed is not None:
+				instruments[counter].observe(elapsed)
+			else:
+				instruments[counter].inc()
+
+
+if __name__ == '__main__':
+	# Measures the dispatch cost per message with the main unit topic set registered
+	# Usage: python3 TopicRouter.py [messages]
+	import sys
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	topics = [
+		'hermes/intent/Psychokiller1888:water',
+		'hermes/intent/Psychokiller1888:telemetry',
+		'hermes/intent/Psychokiller1888:flowerNames',
+		'hermes/intent/Psychokiller1888:waterFilling',
+		'hermes/intent/Psychokiller1888:emptyWater',
+		'hermes/intent/Psychokiller1888:whatsup',
+		'snipsmyflower/flowers/telemetryData',
+		'snipsmyflower/flowers/refillFull',
+		'snipsmyflower/flowers/waterEmptied',
+		'snipsmyflower/flowers/refused',
+		'snipsmyflower/flowers/alertUser',
+		'snipsmyflower/sites/+/status'
+	]
+
+	router = TopicRouter()
+	for name in topics:
+		router.register(name, lambda topic, payload: None, fields=('siteId', 'data.moisture'))
+
+	payload = {'siteId': 'bench', 'data': {'moisture': 40}}
+	for topic in ('snipsmyflower/flowers/telemetryData', 'hermes/intent/Psychokiller1888:water', 'snipsmyflower/sites/bench/status'):
+		start = time.perf_counter()
+		for _ in range(count):
+			router.route(topic, payload)
+		print('{:45s} {:6.3f}µs per message'.format(topic, (time.perf_counter() - start) / count * 1000000))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class WaterLevel:
+	"""
+	Keeps track of the tank water level from edge interrupts on the level pins instead of polling them
+	The level sensor is only powered while tracking. On every edge all the level pins are read again, so an edge
+	swallowed by the debounce is caught up with by the next one, or by the re-read a wait does when it times out
+	"""
+
+	EMPTY = -1
+
+	def __init__(self, gpio, sensorPin, levelPins, bounceTime=50, listener=None):
+		"""
+		:param gpio: RPi.GPIO or FakeGpio, pins already set up
+		:param sensorPin: integer, output powering the level sensor
+		:param levelPins: list of (pin, level) tuples, highest level first. No pin high means EMPTY
+		:param bounceTime: integer, milliseconds during which edges following an edge are ignored
+		:param listener: callable, called with the new level whenever it changes while tracking
+		"""
+		self._gpio = gpio
+		self._sensorPin = sensorPin
+		self._levelPins = list(levelPins)
+		self._bounceTime = bounceTime
+		self._listener = listener
+		self._level = self.EMPTY
+		self._tracking = False
+		self._changed = threading.Condition()
+
+
+	@property
+	def level(self):
+		return self._level
+
+
+	@property
+	def tracking(self):
+		return self._tracking
+
+
+	def start(self):
+		"""
+		Powers the sensor and arms edge detection on every level pin
+		:return: integer, current level
+		"""
+		with self._changed:
+			if self._tracking:
+				return self._level
+			self._tracking = True
+
+		self._gpio.output(self._sensorPin, self._gpio.HIGH)
+		for pin, _ in self._levelPins:
+			self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=self._onEdge, bouncetime=self._bounceTime)
+		return self._refresh(force=True)
+
+
+	def stop(self):
+		"""
+		Disarms edge detection and powers the sensor down
+		"""
+		with self._changed:
+			if not self._tracking:
+				return
+			self._tracking = False
+
+		for pin, _ in self._levelPins:
+			self._gpio.remove_event_detect(pin)
+		self._gpio.output(self._sensorPin, self._gpio.LOW)
+
+
+	def read(self):
+		"""
+		Current level, read from the pins unless we are tracking it already
+		:return: integer
+		"""
+		if self._tracking:
+			return self._refresh()
+
+		self._gpio.output(self._sensorPin, self._gpio.HIGH)
+		try:
+			return self._readPins()
+		finally:
+			self._gpio.output(self._sensorPin, self._gpio.LOW)
+
+
+	def wait(self, predicate, timeout=None):
+		"""
+		Blocks until the level satisfies the predicate, or the timeout expires
+		:param predicate: callable, called with the level
+		:param timeout: float, seconds
+		:return: boolean, the predicate result
+		"""
+		with self._changed:
+			if self._changed.wait_for(lambda: predicate(self._level), timeout):
+				return True
+
+		return predicate(self._refresh())
+
+
+	def _onEdge(self, channel):
+		"""
+		Called on the gpio event thread
+		"""
+		if self._tracking:
+			self._refresh()
+
+
+	def _readPins(self):
+		for pin, level in self._levelPins:
+			if self._gpio.input(pin):
+				return level
+		return self.EMPTY
+
+
+	def _refresh(self, force=False):
+		"""
+		Reads the pins, wakes up the waiters and calls the listener if the level changed
+		:param force: boolean, call the listener even if the level didn't change, for the initial read
+		:return: integer, level
+		"""
+		# Held while calling the listener too, so that it sees the levels in the order they were read
+		with self._changed:
+			level = self._readPins()
+			changed = level != self._level
+			self._level = level
+			if changed:
+				self._changed.notify_all()
+
+			if (changed or force) and self._listener is not None:
+				self._listener(level)
+		return level
+
+
+if __name__ == '__main__':
+	# Fills a simulated tank a level at a time and compares polling the pins every 250ms, like the refill loop used to,
+	# with the edge driven tracker: gpio reads, cpu time and how late each level change is seen
+	# Usage: python3 WaterLevel.py [changes]
+	from FakeGpio import FakeGpio
+	import random
+	import sys
+	import time
+
+	changes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+	sensorPin = 23
+	levelPins = [(16, 100), (22, 75), (27, 50), (25, 25), (5, 0)]
+
+	def setup():
+		gpio = FakeGpio()
+		gpio.setmode(gpio.BCM)
+		gpio.setup(sensorPin, gpio.OUT)
+		for pin, _ in levelPins:
+			gpio.setup(pin, gpio.IN, gpio.PUD_DOWN)
+		return gpio
+
+	def fill(gpio, seen):
+		"""
+		Raises the water one pin at a time, from the bottom, and returns how late each change was seen
+		"""
+		random.seed(1)
+		delays = list()
+		pins = [pin for pin, _ in reversed(levelPins)]
+		for i in range(changes):
+			time.sleep(random.uniform(0.1, 0.4))
+			pin = pins[i % len(pins)]
+			if i % len(pins) == 0:
+				for other in pins:
+					gpio.drive(other, gpio.LOW)
+			changed = time.perf_counter()
+			gpio.drive(pin, gpio.HIGH)
+			seen.clear()
+			seen.wait(2)
+			delays.append(time.perf_counter() - changed)
+		return delays
+
+	def report(name, gpio, delays, cpu):
+		print('{:8s} reads: {:6d}  cpu: {:6.1f}ms  seen late by avg: {:6.1f}ms  max: {:6.1f}ms'.format(name, gpio.reads, cpu * 1000, sum(delays) / len(delays) * 1000, max(delays) * 1000))
+
+	# Polling, the pins are read every 250ms
+	gpio = setup()
+	seen = threading.Event()
+	running = threading.Event()
+	running.set()
+
+	def poll():
+		was = None
+		while running.is_set():
+			level = WaterLevel.EMPTY
+			for pin, value in levelPins:
+				if gpio.input(pin):
+					level = value
+					break
+			if level != was:
+				was = level
+				seen.set()
+			time.sleep(0.25)
+
+	thread = threading.Thread(target=poll)
+	thread.start()
+	time.sleep(0.05)
+	cpu = time.process_time()
+	delays = fill(gpio, seen)
+	cpu = time.process_time() - cpu
+	running.clear()
+	thread.join()
+	report('polling', gpio, delays, cpu)
+
+	# Edge driven
+	gpio = setup()
+	tracker = WaterLevel(gpio, sensorPin, levelPins, listener=lambda level: seen.set())
+	tracker.start()
+	cpu = time.process_time()
+	delays = fill(gpio, seen)
+	cpu = time.process_time() - cpu
+	tracker.stop()
+	gpio.cleanup()
+	report('edges', gpio, delays, cpu)
@@ -1,30 +1,46 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from Codec import Codec
+from Config import Config
 import datetime
+from Database import Database
+from Dispatcher import Dispatcher
 import sqlite3
 from FlowerStates import State
+from Forecast import Forecast
 from I18n import I18n
-import json
+from Metrics import Metrics
 import os
 import paho.mqtt.client as mqtt
 from pathlib import Path
 import pytoml
-from Plant import Plant
+from PlantCatalog import PlantCatalog
+from Profiler import Profiler
+from Recorder import Recorder
+from RollingWindow import RollingWindow
+from Rollups import Rollups
+from RowStream import RowStream
+from RuleEngine import RuleEngine
 from Slot import Slot
 import sys
+from TelemetryWriter import TelemetryWriter
+from TopicRouter import TopicRouter
+import threading
 import time
 
 
 class SnipsMyFlower:
 	""" Snips app for My Snips Flower by Psycho """
 
+	_INTENT_PREFIX = 'hermes/intent/'
 	_INTENT_WATER = 'hermes/intent/Psychokiller1888:water'
 	_INTENT_TELEMETRY = 'hermes/intent/Psychokiller1888:telemetry'
 	_INTENT_ANSWER_FLOWER = 'hermes/intent/Psychokiller1888:flowerNames'
 	_INTENT_WATER_FILLING = 'hermes/intent/Psychokiller1888:waterFilling'
 	_INTENT_EMPTY_WATER = 'hermes/intent/Psychokiller1888:emptyWater'
 	_INTENT_WHATSUP = 'hermes/intent/Psychokiller1888:whatsup'
+	_INTENT_WHEN_THIRSTY = 'hermes/intent/Psychokiller1888:whenThirsty'
 
 	_MQTT_GET_TELEMETRY = 'snipsmyflower/flowers/getTelemetry'
 	_MQTT_TELEMETRY_REPORT = 'snipsmyflower/flowers/telemetryData'
@@ -37,6 +53,9 @@ class SnipsMyFlower:
 
 	_MQTT_REFUSED = 'snipsmyflower/flowers/refused'
 	_MQTT_ALERT_USER = 'snipsmyflower/flowers/alertUser'
+	_MQTT_STATS = 'snipsmyflower/stats'
+	_MQTT_PROFILE = 'snipsmyflower/admin/profile'
+	_MQTT_PROFILE_RESULT = 'snipsmyflower/admin/profileResult'
 
 	_TELEMETRY_TABLE = """ CREATE TABLE IF NOT EXISTS telemetry (
 		id integer PRIMARY KEY,
@@ -48,6 +67,37 @@ class SnipsMyFlower:
 		water INTEGER
 	);"""
 
+	# The plant each site was told it is, through the flowerNames intent
+	_SITES_TABLE = """ CREATE TABLE IF NOT EXISTS sites (
+		siteId TEXT PRIMARY KEY,
+		plant TEXT NOT NULL
+	);"""
+
+	_QUERY_SITES = 'SELECT siteId, plant FROM sites'
+	_QUERY_SITE_PLANT = 'INSERT OR REPLACE INTO sites (siteId, plant) VALUES (?, ?)'
+
+	# What the user can ask for over a time interval, as said in the aggregation slot
+	_AGGREGATIONS = {
+		'average': 'average',
+		'mean': 'average',
+		'minimum': 'minimum',
+		'min': 'minimum',
+		'lowest': 'minimum',
+		'maximum': 'maximum',
+		'max': 'maximum',
+		'highest': 'maximum'
+	}
+
+	_TELEMETRY_WINDOW = 12 * 24 # Our telemetry reports data every 5 minutes, 12 reports per hour times 24 makes a day
+
+	_TELEMETRY_INDEX = 'CREATE INDEX IF NOT EXISTS telemetry_site_timestamp ON telemetry (siteId, timestamp DESC);'
+
+	# Every query the app runs against the telemetry table, checked against the index at startup
+	_QUERY_TELEMETRY = 'SELECT * FROM telemetry WHERE siteId = ? ORDER BY timestamp DESC'
+	_QUERY_TELEMETRY_LIMIT = 'SELECT * FROM telemetry WHERE siteId = ? ORDER BY timestamp DESC LIMIT ?'
+	_QUERY_TELEMETRY_SITES = 'SELECT DISTINCT siteId FROM telemetry'
+	_QUERY_TELEMETRY_INSTANT = 'SELECT * FROM telemetry WHERE timestamp >= ? AND timestamp <= ? AND siteId = ? ORDER BY timestamp DESC'
+
 	_TELEMETRY_TABLE_CORRESPONDANCE = {
 		'id': [
 			0,
@@ -79,191 +129,431 @@ class SnipsMyFlower:
 		]
 	}
 
-	def __init__(self):
+	def __init__(self, mqttClient=None, userDir=None, configOverrides=None):
 		"""
 		Initialize this class
 		Checks if config folder is available
-		Instanciates the translation class, connects to mqtt, intializes the sqlite database connection and loads plants data
+		Instanciates the translation class, intializes the sqlite database connection, loads plants data,
+		starts the message workers and connects to mqtt
+		:param mqttClient: paho client like object to use instead of a new paho client, the simulator passes a fake one
+		:param userDir: Path, where to keep our data instead of ~/snipsflower
+		:param configOverrides: dict, section to dict of settings overriding config.default and config.ini
 		"""
-		self._userDir = Path(os.path.expanduser('~'), 'snipsflower')
+		self._userDir = Path(userDir) if userDir is not None else Path(os.path.expanduser('~'), 'snipsflower')
 		if not self._userDir.exists():
-			self._userDir.mkdir()
+			self._userDir.mkdir(parents=True)
 		self._dbFile = self._userDir / 'data.db'
+		self._config = Config(configOverrides)
+		self._metrics = Metrics()
+		self._received = self._metrics.counter('mqtt_received_total', 'Mqtt messages received')
+		self._receivedBytes = self._metrics.counter('mqtt_received_bytes_total', 'Mqtt payload bytes received')
+		self._db = None
+		self._rollups = None
+		self._telemetryWriter = None
+		self._maintenance = None
+		self._sweep = None
+		self._telemetryWindow = RollingWindow(self._TELEMETRY_WINDOW)
+		self._latestTelemetry = dict()
+		self._forecast = Forecast(self._TELEMETRY_WINDOW)
 
 		self._i18n = I18n()
-		self._mqtt = self._connectMqtt()
-		if not self._mqtt:
-			print('Cannot connect mqtt')
-			sys.exit()
-
-		if self._initDB() is None:
+		if not self._initDB():
 			print('Error initializing database')
 			sys.exit()
+		self._loadTelemetryCaches()
+		self._onHour()
 
-		self._plantsData = dict()
+		self._plantCatalog = PlantCatalog()
 		self._loadPlantsData()
+		self._sitePlants = dict()
+		self._loadSitePlants()
 		self._plantStates = dict()
+		self._violations = dict()
+		self._rules = RuleEngine()
+
+		self._profiler = self._createProfiler()
+		self._router = self._buildRouter()
+		self._recorder = self._startRecorder()
+		self._dispatcher = Dispatcher(
+			self._handleMessage,
+			workers=self._config.getInt('dispatcher', 'workers', 4),
+			maxQueue=self._config.getInt('dispatcher', 'maxQueue', 1000),
+			policy=self._config.get('dispatcher', 'policy', Dispatcher.POLICY_BLOCK),
+			blockTimeout=self._config.getFloat('dispatcher', 'blockTimeout', 1.0)
+		)
+
+		self._mqtt = self._connectMqtt(mqttClient)
+		if not self._mqtt:
+			print('Cannot connect mqtt')
+			self._dispatcher.onStop()
+			sys.exit()
+
+		self._sweepInterval = self._config.getFloat('rules', 'sweepInterval', 300)
+		if self._sweepInterval > 0:
+			self._startSweep()
+
+		self._registerMetrics()
+		self._startMetrics()
 
 
 	def _onMessage(self, client, userdata, message):
 		"""
-		Whenever a message we are subscribed to enters, this function is called
+		Whenever a message we are subscribed to enters, this function is called on the mqtt network thread
+		The payload is decoded here and the message handed to the workers, keyed by site id so that each site's messages stay in order
 		"""
+		self._received.inc()
+		self._receivedBytes.inc(len(message.payload))
+		if self._recorder is not None:
+			self._recorder.record(message.topic, message.payload)
+
 		try:
-			payload = json.loads(message.payload.decode('utf-8'))
+			payload = Codec.loads(message.payload)
 		except:
 			payload = dict()
 
-		topic = message.topic
 		siteId = 'default'
-		sessionId = -1
-		if 'siteId' in payload:
-			siteId = payload['siteId']
-		if 'sessionId' in payload:
-			sessionId = payload['sessionId']
-
-		if 'intent' in payload and payload['intent']['confidenceScore'] < 0.4:
-			self.continueSession(sessionId=sessionId, text=self._i18n.getRandomText('notUnderstood'))
+		if isinstance(payload, dict) and 'siteId' in payload:
+			siteId = str(payload['siteId'])
+
+		self._dispatcher.dispatch(siteId, message.topic, message.topic, payload)
+
+
+	def _handleMessage(self, topic, payload):
+		"""
+		Handles a message, on one of the dispatcher workers
+		:param topic: string
+		:param payload: dict
+		"""
+		if not isinstance(payload, dict):
+			payload = dict()
+
+		if topic.startswith(self._INTENT_PREFIX) and 'intent' in payload and payload['intent']['confidenceScore'] < 0.4:
+			self.continueSession(sessionId=payload.get('sessionId', -1), text=self._i18n.getRandomText('notUnderstood'))
 			return
 
+		self._router.route(topic, payload)
+
+
+	def _buildRouter(self):
+		"""
+		Maps every topic we handle to its handler, along with the payload fields that handler needs
+		:return: TopicRouter
+		"""
+		router = TopicRouter(self._metrics)
+		router.register(self._INTENT_TELEMETRY, self._onTelemetryIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_WATER, self._onWaterIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_ANSWER_FLOWER, self._onFlowerNamesIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_WATER_FILLING, self._onWaterFillingIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_EMPTY_WATER, self._onEmptyWaterIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_WHATSUP, self._onWhatsupIntent, fields=('siteId', 'sessionId'))
+		router.register(self._INTENT_WHEN_THIRSTY, self._onWhenThirstyIntent, fields=('siteId', 'sessionId'))
+		router.register(self._MQTT_TELEMETRY_REPORT, self._onTelemetryReport, fields=('siteId', 'plant', 'data.temperature', 'data.luminosity', 'data.moisture', 'data.water'))
+		router.register(self._MQTT_REFILL_FULL, self._onRefillFull, fields=('siteId',))
+		router.register(self._MQTT_WATER_EMPTIED, self._onWaterEmptied, fields=('siteId',))
+		router.register(self._MQTT_REFUSED, self._onRefused, fields=('siteId',))
+		router.register(self._MQTT_ALERT_USER, self._onAlertUser, fields=('siteId', 'telemetry', 'limit'))
+		if self._profiler is not None:
+			router.register(self._MQTT_PROFILE, self._onProfile)
+		return router
+
+
+	def _onTelemetryIntent(self, topic, payload):
+		"""
+		User is asking for some data
+		"""
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
 		slots = self._parseSlots(payload)
 
-		wasIntent = ''
-		if 'wasIntent' in slots:
-			wasIntent = slots['wasIntent']
+		latest = self._getLatestTelemetry(siteId)
+		if latest is None:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+			return
 
-		if topic == self._INTENT_TELEMETRY:
-			# User is asking for some data
-			data = self._getTelemetryData(siteId)
-			if len(data) <= 0:
-				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+		item = self._TELEMETRY_TABLE_CORRESPONDANCE[slots['type']]
+		if 'when' not in slots:
+			# If the user did not provide a timeframe info, return him the actual data
+			self.endDialog(sessionId=sessionId, text='{} {}'.format(latest[item[0]], item[1]))
+		else:
+			# User asked for a time specific data
+			when = self._getSlotInfo('when', payload)
+			if len(when) <= 0:
+				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
 				return
 
-			item = self._TELEMETRY_TABLE_CORRESPONDANCE[slots['type']]
-			if 'when' not in slots:
-				# If the user did not provide a timeframe info, return him the actual data
-				self.endDialog(sessionId=sessionId, text='{} {}'.format(data[0][item[0]], item[1]))
-			else:
-				# User asked for a time specific data
-				when = self._getSlotInfo('when', payload)
-				if len(when) <= 0:
+			when = when[0]
+			if when.value['kind'] == 'TimeInterval':
+				# The aggregation is done by sqlite, on the rollups for whatever whole hours and days the interval covers
+				try:
+					start = self._parseSnipsDate(when.value['from']) if when.value.get('from') else 0
+					# Snips intervals end exclusively
+					end = self._parseSnipsDate(when.value['to']) - 1 if when.value.get('to') else int(time.time())
+				except ValueError as e:
+					print(e)
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
+					return
+
+				aggregation = self._AGGREGATIONS.get(slots.get('aggregation', '').lower(), 'average')
+				try:
+					aggregate = self._rollups.aggregate(siteId, slots['type'], start, end)
+				except (ValueError, sqlite3.Error) as e:
+					print(e)
 					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
 					return
 
-				when = when[0]
-				if when.value['kind'] == 'TimeInterval':
-					print('Unfortunately this is not yet implemented')
-					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('notImplemented'))
+				if aggregate is None:
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+				else:
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('timeIntervalReply').format(
+						slots['when'],
+						self._i18n.getRandomText(aggregation),
+						self._i18n.getRandomText(slots['type']),
+						round(aggregate[aggregation], 1),
+						item[1]
+					))
+				return
+
+			elif when.value['kind'] == 'InstantTime':
+				# This is a precise point in time, we only fetch the value and return it without calculation
+				try:
+					timestamp = self._parseSnipsDate(when.value['value'])
+				except ValueError as e:
+					print(e)
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
 					return
-				elif when.value['kind'] == 'InstantTime':
-					# This is a precise point in time, we only fetch the value and return it without calculation
-					# Snips returns a non pythonic date, as the timezone %z doesn't take a ':' so we get rid of it or we'll fail getting the timestamp
-					t = self._rreplace(when.value['value'], ':', '', 1)
+
+				start = timestamp - 900 # Query for data that are max 15 minutes older than the timestamp
+				cutoff = self._rollups.cutoff
+				if cutoff is not None and timestamp < cutoff:
+					# Raw data for that time has expired, the hourly rollup gives us the average around it
 					try:
-						timestamp = round(datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S %z').timestamp())
-					except Exception as e:
+						aggregate = self._rollups.aggregate(siteId, slots['type'], start, timestamp)
+					except (ValueError, sqlite3.Error) as e:
 						print(e)
 						self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
 						return
-
-					start = timestamp - 900 # Query for data that are max 15 minutes older than the timestamp
-					query = 'SELECT * FROM telemetry WHERE timestamp >= ? AND timestamp <= ? AND siteId = ? ORDER BY timestamp DESC'
-					data = self._sqlFetch(query, (start, timestamp, siteId))
-
-					if data is None:
+					value = round(aggregate['average'], 1) if aggregate is not None else None
+				else:
+					try:
+						row = self._db.iterate(self._QUERY_TELEMETRY_INSTANT, (start, timestamp, siteId)).first()
+					except sqlite3.Error as e:
+						print(e)
 						self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
 						return
-					elif len(data) <= 0:
-						self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
-					else:
-						# TODO unhardcode language
-						self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('instantTimeReply').format(
-							self._i18n.getRandomText(slots['when'], lang='en'),
-							self._i18n.getRandomText(slots['type'], lang='en'),
-							item[0],
-							item[1]
-						))
-
-					return
+					value = row[item[0]] if row is not None else None
+
+				if value is None:
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+				else:
+					# TODO unhardcode language
+					self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('instantTimeReply').format(
+						self._i18n.getRandomText(slots['when'], lang='en'),
+						self._i18n.getRandomText(slots['type'], lang='en'),
+						value,
+						item[1]
+					))
 
-		elif topic == self._MQTT_TELEMETRY_REPORT:
-			# Store telemetry data reported by connected plants, check data and alert the plant if needed
-			if siteId == 'default':
 				return
 
-			self._checkData(payload)
 
-			self._storeTelemetryData([
-				payload['plant'],
-				payload['data']['temperature'],
-				payload['data']['luminosity'],
-				payload['data']['moisture'],
-				payload['data']['water']
-			])
+	def _onTelemetryReport(self, topic, payload):
+		"""
+		Store telemetry data reported by connected plants, check data and alert the plant if needed
+		"""
+		siteId = payload['siteId']
+		if siteId == 'default':
 			return
 
+		self._storeTelemetryData([
+			siteId,
+			payload['data']['temperature'],
+			payload['data']['luminosity'],
+			payload['data']['moisture'],
+			payload['data']['water']
+		])
 
-		elif topic == self._INTENT_WATER:
-			# User asking for the plant to activate its internal pump
-			if siteId == 'default':
-				self.endDialog(sessionId=sessionId)
-				return
-			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('thankyou'))
-			self._mqtt.publish(topic=self._MQTT_DO_WATER, payload=json.dumps({'siteId': siteId}))
+		self._checkData(payload)
 
 
-		elif topic == self._INTENT_WATER_FILLING:
-			# User wants to fill the water tank
-			if siteId == 'default':
-				self.endDialog(sessionId=sessionId)
-				return
+	def _onWaterIntent(self, topic, payload):
+		"""
+		User asking for the plant to activate its internal pump
+		"""
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
+		if siteId == 'default':
+			self.endDialog(sessionId=sessionId)
+			return
+		self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('thankyou'))
+		self._mqtt.publish(topic=self._MQTT_DO_WATER, payload=Codec.siteIdPayload(siteId))
 
-			data = self._getTelemetryData(siteId, 1)
-			if len(data) <= 0:
-				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
-				return
-			elif data[0][6] >= 100:
-				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('refillNotNeeded'))
-				return
-			else:
-				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('refilling'))
-				self._mqtt.publish(topic=self._MQTT_REFILL_MODE, payload=json.dumps({'siteId': siteId}))
-
-		elif topic == self._MQTT_REFILL_FULL:
-			# Plant reports tank as full
-			self.say(text=self._i18n.getRandomText('refillingDone'), client=siteId)
-			self._checkData(payload)
+
+	def _onWaterFillingIntent(self, topic, payload):
+		"""
+		User wants to fill the water tank
+		"""
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
+		if siteId == 'default':
+			self.endDialog(sessionId=sessionId)
 			return
 
-		elif topic == self._INTENT_EMPTY_WATER:
-			# User wants to empty the water tank
-			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('confirm'))
-			self._mqtt.publish(topic=self._MQTT_EMPTY_WATER, payload=json.dumps({'siteId': siteId}))
+		latest = self._getLatestTelemetry(siteId)
+		if latest is None:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+		elif latest[self._TELEMETRY_TABLE_CORRESPONDANCE['water'][0]] >= 100:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('refillNotNeeded'))
+		else:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('refilling'))
+			self._mqtt.publish(topic=self._MQTT_REFILL_MODE, payload=Codec.siteIdPayload(siteId))
+
+
+	def _onRefillFull(self, topic, payload):
+		"""
+		Plant reports tank as full
+		"""
+		self.say(text=self._i18n.getRandomText('refillingDone'), client=payload['siteId'])
+		self._checkData(payload)
+
+
+	def _onEmptyWaterIntent(self, topic, payload):
+		"""
+		User wants to empty the water tank
+		"""
+		self.endDialog(sessionId=payload['sessionId'], text=self._i18n.getRandomText('confirm'))
+		self._mqtt.publish(topic=self._MQTT_EMPTY_WATER, payload=Codec.siteIdPayload(payload['siteId']))
+
+
+	def _onWaterEmptied(self, topic, payload):
+		"""
+		Plant reports as emptied
+		"""
+		self.say(text=self._i18n.getRandomText('waterEmptied'), client=payload['siteId'])
+		self._checkData(payload)
+
+
+	def _onRefused(self, topic, payload):
+		"""
+		The plant refused a command that was sent to her
+		"""
+		self.say(text=self._i18n.getRandomText('refused'), client=payload['siteId'])
+
+
+	def _onAlertUser(self, topic, payload):
+		"""
+		A plant has changed state to an alert state, let's warn the user
+		Pots sharing a satellite report their own site id, the satellite they are spoken through comes along
+		"""
+		if payload['limit'] == 'max':
+			limit = self._i18n.getRandomText('high')
+		else:
+			limit = self._i18n.getRandomText('low')
+		self.say(text=self._i18n.getRandomText('telemetry_alert').format(payload['telemetry'], limit), client=payload.get('satellite', payload['siteId']))
+
+
+	def _onProfile(self, topic, payload):
+		"""
+		Starts a cpu profile of this unit for the asked duration, the satellites answer those sent with their site id
+		"""
+		if payload.get('siteId', 'default') != 'default':
 			return
 
-		elif topic == self._MQTT_WATER_EMPTIED:
-			# Plant reports as emptied
-			self.say(text=self._i18n.getRandomText('waterEmptied'), client=siteId)
-			self._checkData(payload)
+		try:
+			duration = float(payload.get('duration', 10))
+		except (TypeError, ValueError):
+			print('Invalid profile duration: {}'.format(payload.get('duration')))
 			return
 
-		elif topic == self._MQTT_REFUSED:
-			# The plant refused a command that was sent to her
-			self.say(text=self._i18n.getRandomText('refused'), client=siteId)
-
-		elif topic == self._MQTT_ALERT_USER:
-			# A plant has changed state to an alert state, let's warn the user
-			if payload['limit'] == 'max':
-				limit = self._i18n.getRandomText('high')
-			else:
-				limit = self._i18n.getRandomText('low')
-			self.say(text=self._i18n.getRandomText('telemetry_alert').format(payload['telemetry'], limit), client=siteId)
-
-		elif topic == self._INTENT_WHATSUP:
-			if siteId not in self._plantStates or self._plantStates[siteId] == State.OK:
-				self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('everythingOk'))
-				return
-			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('alertState_{}'.format(self._plantStates[siteId].value)))
+		if not self._profiler.start(duration, self._publishProfile):
+			print('A profile is already running')
+
+
+	def _publishProfile(self, summary):
+		"""
+		:param summary: dict, where the profile was written and the functions we spent the most time in
+		"""
+		summary['siteId'] = 'default'
+		self._mqtt.publish(topic=self._MQTT_PROFILE_RESULT, payload=Codec.dumps(summary))
+
+
+	def _onFlowerNamesIntent(self, topic, payload):
+		"""
+		User is telling us what plant lives on that site. Whatever was understood is matched against the species
+		catalog, common or scientific names, forgiving a few misheard letters
+		"""
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
+		if siteId == 'default':
+			self.endDialog(sessionId=sessionId)
+			return
+
+		slots = self._parseSlots(payload)
+		name = slots.get('flower') or payload.get('input', '')
+		results = self._plantCatalog.search(name)
+		if not results:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('plantUnknown'))
+			return
+
+		plant = results[0][0]
+		try:
+			self._db.execute(self._QUERY_SITE_PLANT, (siteId, plant.name))
+		except sqlite3.Error as e:
+			print(e)
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('error'))
+			return
+
+		self._sitePlants[siteId] = plant.name
+		# The next sweep checks the site against its new plant
+		self._rules.setPlant(siteId, plant)
+		self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('plantAssigned').format(plant.name))
+
+
+	def _onWhatsupIntent(self, topic, payload):
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
+		violations = self._violations.get(siteId)
+		if not violations:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('everythingOk'))
+			return
+		# Everything that's wrong, most urgent first
+		self.endDialog(sessionId=sessionId, text=' '.join(self._i18n.getRandomText('alertState_{}'.format(state.value)) for _, _, state in violations))
+
+
+	def _onWhenThirstyIntent(self, topic, payload):
+		"""
+		User asking when the plant will need water. Answered from the cached forecasts, the database is never queried
+		"""
+		siteId = payload['siteId']
+		sessionId = payload['sessionId']
+		forecast = self._forecast.get(siteId)
+		if forecast is None:
+			self.endDialog(sessionId=sessionId, text=self._i18n.getRandomText('noData'))
+			return
+
+		now = time.time()
+		if self._plantStates.get(siteId) == State.THIRSTY or (forecast['thirsty'] is not None and forecast['thirsty'] <= now):
+			text = self._i18n.getRandomText('thirstyNow')
+		elif forecast['thirsty'] is None:
+			text = self._i18n.getRandomText('thirstyUnknown')
+		else:
+			text = self._i18n.getRandomText('thirstyIn').format(self._delayText(forecast['thirsty'] - now))
+
+		if forecast['empty'] is not None and forecast['empty'] > now:
+			text = '{} {}'.format(text, self._i18n.getRandomText('tankEmptyIn').format(self._delayText(forecast['empty'] - now)))
+
+		self.endDialog(sessionId=sessionId, text=text)
+
+
+	def _delayText(self, seconds):
+		"""
+		A delay as we would say it, in hours up to two days, in days after that
+		:param seconds: float
+		:return: string
+		"""
+		hours = seconds / 3600
+		if hours < 48:
+			return self._i18n.getRandomText('hours').format(max(1, int(round(hours))))
+		return self._i18n.getRandomText('days').format(int(round(hours / 24)))
 
 
 	def onStop(self):
@@ -271,8 +561,23 @@ class SnipsMyFlower:
 		Called when the skill goes down, for a pi reboot per exemple
 		Stops the mqtt loop and disconnects from mqtt
 		"""
+		if self._maintenance is not None and self._maintenance.is_alive():
+			self._maintenance.cancel()
+		if self._sweep is not None and self._sweep.is_alive():
+			self._sweep.cancel()
+		self._metrics.onStop()
+		if self._profiler is not None:
+			self._profiler.onStop()
+
 		self._mqtt.loop_stop(force=True)
 		self._mqtt.disconnect()
+		if self._recorder is not None:
+			self._recorder.close()
+		self._dispatcher.onStop()
+		if self._telemetryWriter is not None:
+			self._telemetryWriter.onStop()
+		if self._db is not None:
+			self._db.close()
 
 
 	def endDialog(self, sessionId, text=None):
@@ -282,12 +587,12 @@ class SnipsMyFlower:
 		:param text: string
 		"""
 		if text is not None:
-			self._mqtt.publish('hermes/dialogueManager/endSession', json.dumps({
+			self._mqtt.publish('hermes/dialogueManager/endSession', Codec.dumps({
 				'sessionId': sessionId,
 				'text'     : text
 			}))
 		else:
-			self._mqtt.publish('hermes/dialogueManager/endSession', json.dumps({
+			self._mqtt.publish('hermes/dialogueManager/endSession', Codec.dumps({
 				'sessionId': sessionId
 			}))
 
@@ -313,7 +618,7 @@ class SnipsMyFlower:
 		if intentFilter is not None:
 			jsonDict['intentFilter'] = intentFilter
 
-		self._mqtt.publish('hermes/dialogueManager/continueSession', json.dumps(jsonDict))
+		self._mqtt.publish('hermes/dialogueManager/continueSession', Codec.dumps(jsonDict))
 
 
 	def askUser(self, text, client='default', intentFilter=None, customData=None):
@@ -347,7 +652,7 @@ class SnipsMyFlower:
 		if intentFilter is not None:
 			initDict['intentFilter'] = intentFilter
 
-		self._mqtt.publish('hermes/dialogueManager/startSession', json.dumps(jsonDict))
+		self._mqtt.publish('hermes/dialogueManager/startSession', Codec.dumps(jsonDict))
 
 
 	def say(self, text, client='default', customData=''):
@@ -358,7 +663,7 @@ class SnipsMyFlower:
 		:param client: string
 		"""
 		client = 'default'
-		self._mqtt.publish('hermes/dialogueManager/startSession', json.dumps({
+		self._mqtt.publish('hermes/dialogueManager/startSession', Codec.dumps({
 			'siteId'    : client,
 			'init'      : {
 				'type': 'notification',
@@ -371,85 +676,84 @@ class SnipsMyFlower:
 	def _checkData(self, payload):
 		"""
 		Let's check the data we got, first, and then check the long term data
-		Send alert to the plant if needed
+		Every rule is evaluated by the rule engine, the plant is alerted about the most urgent one
 		:param payload: dict
 		"""
-		if payload['plant'] not in self._plantsData.keys():
-			# Maybe he's using the scientific name?
-			name = ''
-			for plant in self._plantsData:
-				if plant.scientificName == payload['plant']:
-					name = plant.scientificName
-					break
-
-			if not name:
-				print('Now this is very weird, but this plant does not exist in our lexic')
-				return False
+		if 'plant' not in payload:
+			# Tank state reports don't carry any data, the plant sends a telemetry report right after them
+			return False
 
-			payload['plant'] = name
+		# The plant the user told us about wins over the one the satellite is configured for
+		# Common name, scientific name or alias, it's a single lookup
+		plant = self._plantCatalog.get(self._sitePlants.get(payload['siteId'], payload['plant']))
+		if plant is None:
+			print('Now this is very weird, but this plant does not exist in our lexic')
+			return False
 
+		siteId = payload['siteId']
 		try:
 			data = payload['data']
-			safeData = self._plantsData[payload['plant']]
+			self._forecast.setThreshold(siteId, plant.bands['moisture'][0])
+			# For the luminosity, we need to check upon an interval, as of course at night it will be too dark.
+			# The rolling window holds the luminosity for the last day
+			self._rules.setPlant(siteId, plant)
+			self._rules.update(siteId, data['water'], data['moisture'], data['temperature'], self._telemetryWindow.average(siteId, 'luminosity'))
+			self._applyViolations(siteId, self._rules.check(siteId))
+		except Exception as e:
+			print(e)
 
-			#Do we still have water?
-			if data['water'] <= 0:
-				self._alertPlant(payload['siteId'], 'water', 'min')
-				self._plantStates[payload['siteId']] = State.OUT_OF_WATER
-				return
 
-			# Is the soil humid enough?
-			elif data['moisture'] < safeData.moistureMin * 0.9:
-				self._alertPlant(payload['siteId'], 'moisture', 'min')
-				self._plantStates[payload['siteId']] = State.THIRSTY
-				return
+	def _applyViolations(self, siteId, violations, changesOnly=False):
+		"""
+		Sets the site state from the rules it violates, the first one, by priority, decides the state and the alert
+		:param siteId: string
+		:param violations: list of (telemetry, limit, state) tuples
+		:param changesOnly: boolean, only alert the plant if its state changed
+		"""
+		self._violations[siteId] = violations
+		telemetry, limit, state = violations[0] if violations else ('all', 'ok', State.OK)
+		if changesOnly and self._plantStates.get(siteId) == state:
+			return
 
-			# But not too humid?
-			if data['moisture'] > safeData.moistureMax * 1.1:
-				self._alertPlant(payload['siteId'], 'moisture', 'max')
-				self._plantStates[payload['siteId']] = State.DRAWNED
-				return
+		self._plantStates[siteId] = state
+		self._alertPlant(siteId, telemetry, limit)
 
-			# How about the temperature, too cold?
-			elif data['temperature'] < safeData.temperatureMin * 0.9:
-				self._alertPlant(payload['siteId'], 'temperature', 'min')
-				self._plantStates[payload['siteId']] = State.COLD
-				return
 
-			# Or too hot?
-			elif data['temperature'] > safeData.temperatureMax * 1.1:
-				self._alertPlant(payload['siteId'], 'temperature', 'max')
-				self._plantStates[payload['siteId']] = State.HOT
-				return
+	def _startSweep(self):
+		self._sweep = threading.Timer(interval=self._sweepInterval, function=self._onSweep)
+		self._sweep.setDaemon(True)
+		self._sweep.start()
 
-			# For the luminosity, we need to check upon an interval, as of course at night it will be too dark.
-			# Our telemetry reports data every 5 minutes, let's take the luminosity for the last day
-			limit = 12 * 24 # 12 reports per hour times 24
-			dbData = self._getTelemetryData(payload['siteId'], limit)
-			total = 0
-			length = 0
-			for row in dbData:
-				length += 1
-				total += row[3]
-			average = total / length
-
-			if average < safeData.luminosityMin * 0.9:
-				self._alertPlant(payload['siteId'], 'luminosity', 'min')
-				self._plantStates[payload['siteId']] = State.TOO_DARK
-				return
 
-			elif average > safeData.luminosityMax * 1.1:
-				self._alertPlant(payload['siteId'], 'luminosity', 'max')
-				self._plantStates[payload['siteId']] = State.TOO_BRIGHT
-				return
+	def _onSweep(self):
+		"""
+		Periodically checks every site against its plant at once, catching sites whose plant changed since their last report
+		"""
+		self._startSweep()
 
-			# Everything's clear!
-			self._plantStates[payload['siteId']] = State.OK
-			self._alertPlant(payload['siteId'], 'all', 'ok')
+		try:
+			for siteId, violations in self._rules.sweep().items():
+				self._applyViolations(siteId, violations, changesOnly=True)
 		except Exception as e:
 			print(e)
 
 
+	def _onHour(self):
+		"""
+		Called every hour, expires the raw telemetry that is past the retention. It lives on in the rollups
+		"""
+		self._maintenance = threading.Timer(interval=3600, function=self._onHour)
+		self._maintenance.setDaemon(True)
+		self._maintenance.start()
+
+		try:
+			count = self._rollups.prune()
+			if count:
+				print('Expired {} telemetry rows'.format(count))
+		except sqlite3.Error as e:
+			print(e)
+
+
 	def _alertPlant(self, siteId, telemetry, limit):
 		# if telemetry != 'all' and limit != 'ok':
 		# 	self._mqtt.publish(topic='hermes/dialogueManager/configure', payload=json.dumps(
@@ -475,7 +779,7 @@ class SnipsMyFlower:
 		# 			]
 		# 		}
 		# 	))
-		self._mqtt.publish(topic=self._MQTT_PLANT_ALERT, payload=json.dumps({'siteId': siteId, 'telemetry': telemetry, 'limit': limit}))
+		self._mqtt.publish(topic=self._MQTT_PLANT_ALERT, payload=Codec.constant(('siteId', siteId), ('telemetry', telemetry), ('limit', limit)))
 
 
 	@staticmethod
@@ -513,6 +817,17 @@ class SnipsMyFlower:
 		return slots
 
 
+	@classmethod
+	def _parseSnipsDate(cls, value):
+		"""
+		Snips returns a non pythonic date, as the timezone %z doesn't take a ':' so we get rid of it or we'll fail getting the timestamp
+		:param value: string, as found in a snips time slot
+		:return: integer, timestamp
+		"""
+		t = cls._rreplace(value, ':', '', 1)
+		return round(datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S %z').timestamp())
+
+
 	@staticmethod
 	def _rreplace(string, old, new, occurence):
 		"""
@@ -528,9 +843,10 @@ class SnipsMyFlower:
 		return new.join(l)
 
 
-	def _connectMqtt(self):
+	def _connectMqtt(self, mqttClient=None):
 		"""
 		Tries to connect to mqtt. Options are read from snips.toml
+		:param mqttClient: client to connect, a new paho client if None
 		:return: boolean
 		"""
 		try:
@@ -540,7 +856,8 @@ class SnipsMyFlower:
 			mqttHost = 'localhost:1883'
 
 		try:
-			mqttClient = mqtt.Client()
+			if mqttClient is None:
+				mqttClient = mqtt.Client()
 			mqttClient.on_connect = self._onConnect
 			mqttClient.on_message = self._onMessage
 			mqttClient.connect(mqttHost.split(':')[0], int(mqttHost.split(':')[1]))
@@ -554,124 +871,145 @@ class SnipsMyFlower:
 	def _onConnect(self, client, userdata, flags, rc):
 		"""
 		Called whenever mqtt connects. It does subscribe our intents
+		This can run before _connectMqtt returned, the client is the one given here
 		"""
-		self._mqtt.subscribe([
-			(self._MQTT_TELEMETRY_REPORT, 0),
-			(self._INTENT_WATER, 0),
-			(self._INTENT_TELEMETRY, 0),
-			(self._INTENT_ANSWER_FLOWER, 0),
-			(self._INTENT_WATER_FILLING, 0),
-			(self._MQTT_REFILL_FULL, 0),
-			(self._INTENT_EMPTY_WATER, 0),
-			(self._MQTT_WATER_EMPTIED, 0),
-			(self._MQTT_REFUSED, 0),
-			(self._MQTT_ALERT_USER, 0),
-			(self._INTENT_WHATSUP, 0)
-		])
+		client.subscribe([(topic, 0) for topic in self._router.topics])
 
 
 	def _storeTelemetryData(self, data):
 		"""
-		Stores telemetry data from the connected flowers in internal database
-		:param data: list
+		Queues telemetry data from the connected flowers for the writer thread to store in internal database
+		and updates the in memory rolling windows and latest values
+		:param data: list, siteId, temperature, luminosity, moisture, water
 		:return: boolean
 		"""
 		try:
-			con = self._sqlConnection()
-			if con is None:
-				return False
+			self._telemetryWindow.add(data[0], dict(zip(RollingWindow.METRICS, data[1:])))
 			data.insert(1, int(round(time.time())))
-			cursor = con.cursor()
-			sql = 'INSERT INTO telemetry (siteId, timestamp, temperature, luminosity, moisture, water) VALUES (?, ?, ?, ?, ?, ?)'
-			cursor.execute(sql, data)
-			con.commit()
-			con.close()
-		except sqlite3.Error as e:
-			print(e)
+			# Same layout as a database row, the id is only known once the writer has flushed it
+			self._latestTelemetry[data[0]] = tuple([None] + data)
+			self._forecast.add(data[0], data[1], data[4], data[5])
+			return self._telemetryWriter.put(data)
 		except Exception as e:
 			print(e)
 
 		return False
 
 
-	def _getTelemetryData(self, siteId: str, limit: int = -1) -> list:
+	def _getTelemetryData(self, siteId: str, limit: int = -1) -> RowStream:
 		"""
-		Get telemetry data from database for the given site id
+		Get telemetry data from database for the given site id, newest first, fetched as it is consumed
 		:param siteId: string
-		:return: list
+		:param limit: integer, -1 for the whole history
+		:return: RowStream, raises sqlite3.Error once consumed if the query fails
 		"""
-		try:
-			con = self._sqlConnection()
-			if con is None:
-				return []
-			if limit == -1:
-				rows = con.cursor().execute('SELECT * FROM telemetry WHERE siteId = ? ORDER BY timestamp DESC', [siteId]).fetchall()
-			else:
-				rows = con.cursor().execute('SELECT * FROM telemetry WHERE siteId = ? ORDER BY timestamp DESC LIMIT ?', [siteId, limit]).fetchall()
-			con.close()
-			return rows
-		except sqlite3.Error as e:
-			print(e)
-			return []
+		if limit == -1:
+			return self._db.iterate(self._QUERY_TELEMETRY, (siteId,))
+		else:
+			return self._db.iterate(self._QUERY_TELEMETRY_LIMIT, (siteId, limit))
 
 
-	def _sqlFetch(self, query, replace):
+	def _getLatestTelemetry(self, siteId):
 		"""
-		Executes a query on the database and returns the result
-		:param query: string to execute
-		:param replace: tuple, if your query has placeholders
-		:return: tuple
+		Returns the latest telemetry reported by the given site, without touching the database
+		:param siteId: string
+		:return: tuple, same layout as a telemetry row, or None if the site never reported
+		"""
+		return self._latestTelemetry.get(siteId)
+
+
+	def _loadTelemetryCaches(self):
+		"""
+		Rebuilds the rolling windows, the forecasts and the latest values of every known site from the database, done once at startup
 		"""
 		try:
-			con = self._sqlConnection()
-			if con is None:
-				return None
-			rows = con.cursor().execute(query, replace).fetchall()
-			con.close()
-			return rows
+			# Site ids are collected first, so that a single reader is held at a time
+			sites = [site for site, in self._db.iterate(self._QUERY_TELEMETRY_SITES)]
+			for siteId in sites:
+				# At most a window worth of rows, reversed to replay them oldest first
+				rows = list(self._getTelemetryData(siteId, self._TELEMETRY_WINDOW))
+				if rows:
+					self._latestTelemetry[siteId] = rows[0]
+				self._telemetryWindow.load(siteId, [
+					{metric: row[self._TELEMETRY_TABLE_CORRESPONDANCE[metric][0]] for metric in RollingWindow.METRICS} for row in reversed(rows)
+				])
+				for row in reversed(rows):
+					self._forecast.add(siteId, row[2], row[5], row[6])
 		except sqlite3.Error as e:
 			print(e)
-			return None
 
 
 	def _initDB(self):
 		"""
 		Initializes the internal database as well as calls for table initialization
-		:return: connection
+		The connections are kept open for the whole life of the app
+		:return: boolean
 		"""
-		con = self._sqlConnection()
-		if con is not None:
-			self._initTable(con, self._TELEMETRY_TABLE)
-			con.close()
-			return True
-
-		return False
+		try:
+			# A reader for every message worker, plus the sweep and the hourly maintenance timers
+			self._db = Database(self._dbFile, readers=self._config.getInt('dispatcher', 'workers', 4) + 2, metrics=self._metrics)
+		except sqlite3.Error as e:
+			print(e)
+			return False
 
+		self._initTable(self._TELEMETRY_TABLE)
+		self._initTable(self._TELEMETRY_INDEX)
+		self._initTable(self._SITES_TABLE)
+		if not self._checkQueryPlans():
+			# A telemetry query falling back to a full scan is a regression, refuse to start rather than slow down
+			return False
 
-	def _sqlConnection(self):
-		"""
-		Connects to a sqlite3 database
-		:return: connection
-		"""
+		self._rollups = Rollups(
+			self._db,
+			retentionDays=self._config.getInt('database', 'retentionDays', 0),
+			retentionMode=self._config.get('database', 'retentionMode', 'delete'),
+			archiveFile=self._userDir / 'archive.db'
+		)
 		try:
-			con = sqlite3.connect(str(self._dbFile))
-			return con
+			self._rollups.initTables()
 		except sqlite3.Error as e:
 			print(e)
+			return False
 
-		return None
+		self._telemetryWriter = TelemetryWriter(self._db, listeners=[self._rollups.update])
+		return True
 
 
-	@staticmethod
-	def _initTable(con, statement):
+	def _checkQueryPlans(self):
+		"""
+		Makes sure every telemetry query is served by the (siteId, timestamp) index, without a scan or a temporary sort
+		A schema change that silently brings the full table scans back fails the startup here
+		:return: boolean, False if a query doesn't use the index
+		"""
+		queries = {
+			self._QUERY_TELEMETRY: ('',),
+			self._QUERY_TELEMETRY_LIMIT: ('', 1),
+			self._QUERY_TELEMETRY_INSTANT: (0, 0, ''),
+			self._QUERY_TELEMETRY_SITES: ()
+		}
+
+		ok = True
+		for query, replace in queries.items():
+			try:
+				plan = self._db.explain(query, replace)
+			except sqlite3.Error as e:
+				print(e)
+				return False
+
+			if 'INDEX telemetry_site_timestamp' not in plan or 'TEMP B-TREE' in plan:
+				print('Query not using the telemetry index: {}\n{}'.format(query, plan))
+				ok = False
+
+		return ok
+
+
+	def _initTable(self, statement):
 		"""
 		Initializes database tables given through the statement argument
-		:param con: sqlite connection object
 		:param statement: string
 		"""
 		try:
-			cursor = con.cursor()
-			cursor.execute(statement)
+			self._db.executescript(statement)
 		except sqlite3.Error as e:
 			print(e)
 
@@ -680,14 +1018,92 @@ class SnipsMyFlower:
 		"""
 		Load the flower data file. This file holds the values for each supported flowers
 		"""
-		data = None
-		with open('plantsData.json', 'r') as f:
-			data = f.read()
-			data = json.loads(data)
+		try:
+			self._plantCatalog.load('plantsData.json', cacheFile=self._userDir / 'plantsData.cache')
+		except (OSError, ValueError, KeyError) as e:
+			print('Error loading plants data: {}'.format(e))
+
+
+	def _createProfiler(self):
+		"""
+		Profiling on demand is only possible if enabled in config, otherwise the topic isn't even subscribed to
+		:return: Profiler, or None
+		"""
+		if not self._config.getBoolean('profiler', 'enabled', False):
+			return None
+
+		return Profiler(
+			self._userDir / 'profiles',
+			interval=self._config.getInt('profiler', 'interval', 5),
+			maxDuration=self._config.getFloat('profiler', 'maxDuration', 60)
+		)
+
 
-		if data is not None:
-			for name, data in data.items():
-				self._plantsData[name] = Plant(name, data)
+	def _startRecorder(self):
+		"""
+		Starts capturing every message we receive if a capture file is configured, for replay.py to play them back
+		:return: Recorder, or None
+		"""
+		file = self._config.get('recorder', 'file', '')
+		if not file:
+			return None
+
+		try:
+			return Recorder(self._userDir / file)
+		except (OSError, ValueError) as e:
+			print('Cannot record messages: {}'.format(e))
+			return None
+
+
+	def _registerMetrics(self):
+		"""
+		Exposes what the workers, the telemetry writer and the recorder already count, read when the metrics are exported
+		"""
+		dispatcher = lambda key: sum(values[key] for values in self._dispatcher.stats()['handlers'].values())
+		self._metrics.callback('dispatcher_queue_depth', 'Messages waiting for a worker', lambda: sum(self._dispatcher.stats()['queueDepths']))
+		self._metrics.callback('dispatcher_processed_total', 'Messages handled by the workers', lambda: dispatcher('processed'), kind=Metrics.COUNTER)
+		self._metrics.callback('dispatcher_dropped_total', 'Messages dropped or evicted because a worker was saturated', lambda: dispatcher('dropped') + dispatcher('evicted'), kind=Metrics.COUNTER)
+
+		writer = lambda key: self._telemetryWriter.stats()[key]
+		self._metrics.callback('telemetry_queue_depth', 'Telemetry rows waiting for the writer', lambda: writer('queueDepth'))
+		self._metrics.callback('telemetry_rows_total', 'Telemetry rows stored', lambda: writer('rows'), kind=Metrics.COUNTER)
+		self._metrics.callback('telemetry_dropped_total', 'Telemetry rows dropped on a full queue', lambda: writer('dropped'), kind=Metrics.COUNTER)
+		self._metrics.callback('telemetry_write_errors_total', 'Telemetry batches that failed to be stored', lambda: writer('errors'), kind=Metrics.COUNTER)
+		self._metrics.callback('telemetry_sites', 'Sites that reported telemetry', lambda: len(self._latestTelemetry))
+
+		if self._recorder is not None:
+			self._metrics.callback('recorder_messages_total', 'Messages captured to the recorder file', lambda: self._recorder.count, kind=Metrics.COUNTER)
+
+
+	def _startMetrics(self):
+		"""
+		Serves our metrics over http and publishes them on mqtt, each if enabled in config
+		"""
+		port = self._config.getInt('metrics', 'port', 9108)
+		if port > 0:
+			self._metrics.serve(port, self._config.get('metrics', 'host', '127.0.0.1'))
+
+		interval = self._config.getFloat('metrics', 'statsInterval', 60)
+		if interval > 0:
+			self._metrics.report(self._publishStats, interval)
+
+
+	def _publishStats(self, snapshot):
+		"""
+		:param snapshot: dict, our metrics
+		"""
+		self._mqtt.publish(topic=self._MQTT_STATS, payload=Codec.dumps({'siteId': 'default', 'metrics': snapshot}))
+
+
+	def _loadSitePlants(self):
+		"""
+		Loads the plant each site was assigned by the user
+		"""
+		try:
+			for siteId, plant in self._db.iterate(self._QUERY_SITES):
+				self._sitePlants[siteId] = plant
+		except sqlite3.Error as e:
+			print(e)
 
 
 
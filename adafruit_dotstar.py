@@ -28,9 +28,6 @@
 
 * Author(s): Damien P. George, Limor Fried & Scott Shawcroft
 """
-import busio
-import digitalio
-
 __version__ = "0.0.0-auto.0"
 __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_DotStar.git"
 
@@ -64,6 +61,8 @@ class DotStar:
         using 'soft' SPI). This is only a recommendation; the actual clock
         rate may be slightly different depending on what the system hardware
         can provide.
+    :param spi: An already opened SPI bus to write to, instead of opening one
+        on the clock and data pins. busio and digitalio are then not needed.
 
 
     Example for Gemma M0:
@@ -82,15 +81,20 @@ class DotStar:
     """
 
     def __init__(self, clock, data, n, *, brightness=1.0, auto_write=True,
-                 pixel_order=BGR, baudrate=4000000):
+                 pixel_order=BGR, baudrate=4000000, spi=None):
         self._spi = None
         try:
-            self._spi = busio.SPI(clock, MOSI=data)
+            if spi is None:
+                # Imported only when needed, so the driver loads off a board
+                import busio
+                spi = busio.SPI(clock, MOSI=data)
+            self._spi = spi
             while not self._spi.try_lock():
                 pass
             self._spi.configure(baudrate=baudrate)
 
         except (NotImplementedError, ValueError):
+            import digitalio
             self.dpin = digitalio.DigitalInOut(data)
             self.cpin = digitalio.DigitalInOut(clock)
             self.dpin.direction = digitalio.Direction.OUTPUT
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Replays a message capture into a fresh main unit, to benchmark it on real traffic
+Captures are recorded by the main unit itself when [recorder] file is set in config.ini. The main unit replayed into
+runs in this process against a fake mqtt broker, with its database in a temporary directory. Whatever config.ini says,
+it neither serves metrics nor records the replay. Results can be saved and compared with the ones of another version
+
+Usage: python3 replay.py capture.rec --speed max --output after.json --compare before.json
+"""
+
+import argparse
+from FakeMqtt import FakeBroker, FakeClient
+import json
+from Recorder import Recorder
+from simulator import loadMainUnit, MAIN_UNIT_CONFIG
+import sys
+import tempfile
+import time
+
+
+def drained(unit):
+	"""
+	:return: boolean, True once every message went through the mqtt loop, the workers and the telemetry writer
+	"""
+	if unit._mqtt.pending or any(values['depth'] for values in unit._dispatcher.stats()['handlers'].values()):
+		return False
+	writer = unit._telemetryWriter.stats()
+	return writer['errors'] > 0 or writer['rows'] >= writer['queued']
+
+
+def replay(capture, speed):
+	"""
+	:param capture: Path, capture file
+	:param speed: float, 1 for real time, 10 for ten times faster, 0 for as fast as possible
+	:return: dict, results
+	"""
+	broker = FakeBroker()
+	with tempfile.TemporaryDirectory() as directory:
+		unit = loadMainUnit()(mqttClient=FakeClient(broker), userDir=directory, configOverrides=MAIN_UNIT_CONFIG)
+		unit._mqtt.connected.wait(5)
+		player = FakeClient(broker)
+		player.connect()
+
+		count = 0
+		first = None
+		start = time.monotonic()
+		for timestamp, topic, payload in Recorder.read(capture):
+			if first is None:
+				first = timestamp
+			if speed > 0:
+				delay = start + (timestamp - first) / speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			player.publish(topic, payload)
+			count += 1
+		published = time.monotonic() - start
+
+		while not drained(unit):
+			time.sleep(0.001)
+		elapsed = time.monotonic() - start
+
+		routes = unit._router.stats()
+		dispatched = unit._dispatcher.stats()['handlers']
+		writer = unit._telemetryWriter.stats()
+		unit.onStop()
+
+	topics = dict()
+	for topic, values in dispatched.items():
+		route = routes.get(topic, {})
+		topics[topic] = {
+			'messages': values['processed'],
+			'dropped': values['dropped'] + values['evicted'],
+			'averageTime': route.get('averageTime', values['averageLatency']),
+			'maxTime': route.get('maxTime', values['maxLatency']),
+			'averageWait': values['averageWait']
+		}
+
+	return {
+		'capture': str(capture),
+		'speed': speed,
+		'messages': count,
+		'publishTime': published,
+		'elapsed': elapsed,
+		'throughput': count / elapsed if elapsed else 0,
+		'rows': writer['rows'],
+		'averageFlush': writer['averageFlushLatency'],
+		'topics': topics
+	}
+
+
+def report(results, baseline=None):
+	"""
+	Prints the results, next to the baseline ones if given
+	"""
+	def change(key, value, source=None):
+		if baseline is None:
+			return ''
+		before = (source or baseline).get(key)
+		if not before:
+			return ''
+		return '  ({:+.1f}%)'.format((value - before) / before * 100)
+
+	speed = 'max' if not results['speed'] else '{}x'.format(results['speed'])
+	print('{} messages replayed at {} speed in {:.2f}s'.format(results['messages'], speed, results['elapsed']))
+	print('Throughput: {:.1f} messages/s{}'.format(results['throughput'], change('throughput', results['throughput'])))
+	print('Rows stored: {}, average flush {:.2f}ms{}'.format(results['rows'], results['averageFlush'] * 1000, change('averageFlush', results['averageFlush'])))
+	print('')
+	print('{:50s} {:>9s} {:>8s} {:>11s} {:>11s} {:>11s}'.format('topic', 'messages', 'dropped', 'avg ms', 'max ms', 'wait ms'))
+	for topic, values in sorted(results['topics'].items()):
+		before = baseline['topics'].get(topic) if baseline is not None else None
+		print('{:50s} {:9d} {:8d} {:11.3f} {:11.3f} {:11.3f}{}'.format(
+			topic,
+			values['messages'],
+			values['dropped'],
+			values['averageTime'] * 1000,
+			values['maxTime'] * 1000,
+			values['averageWait'] * 1000,
+			change('averageTime', values['averageTime'], before) if before else ''
+		))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Replays a message capture into a fresh main unit')
+	parser.add_argument('capture', help='capture file recorded by the main unit')
+	parser.add_argument('--speed', default='1', help='1 for real time, N for N times faster, max for as fast as possible')
+	parser.add_argument('--output', help='saves the results to this json file')
+	parser.add_argument('--compare', help='results of a previous replay to compare with')
+	args = parser.parse_args()
+
+	speed = 0 if args.speed == 'max' else float(args.speed)
+	baseline = None
+	if args.compare:
+		with open(args.compare, 'r') as f:
+			baseline = json.load(f)
+
+	results = replay(args.capture, speed)
+	report(results, baseline)
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent='\t')
+
+
+if __name__ == '__main__':
+	sys.exit(main())
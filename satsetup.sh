@@ -89,7 +89,6 @@ sed -i -e "s/snipsMyFlower[0-9\.abv_]*/snipsMyFlower_${VERSION}/" /etc/systemd/s
 
 rm /home/pi/snipsMyFlower_download.sh
 rm action-snips-my-flower.py
-rm config.default
 rm i18n.json
 rm I18n.py
 rm plantsData.json
@@ -98,6 +97,11 @@ rm requirements.txt
 rm setup.sh
 mkdir logs
 
+if [ ! -e config.ini ]; then
+    cp config.default config.ini
+    chmod a+w config.ini
+fi
+
 #grep -qF 'dtparam=i2c_arm=on' '/boot/config.txt' || echo 'dtparam=i2c_arm=on' | tee --append '/boot/config.txt'
 grep -qF 'dtparam=i2c1_baudrate=30000' '/boot/config.txt' || echo 'dtparam=i2c1_baudrate=30000' | tee --append '/boot/config.txt'
 #grep -qF 'dtparam=spi=on' '/boot/config.txt' || echo 'dtparam=spi=on' | tee --append '/boot/config.txt'
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fleet simulator, load tests the main unit with thousands of virtual flowers
+The flowers speak the satellite protocol, telemetry reports, refillFull, waterEmptied, refused and alertUser, with
+sensor curves following the day. By default the main unit runs in this process against a fake mqtt broker, with its
+database in a temporary directory, and neither serves metrics nor records. With --broker, the flowers connect to a real
+broker and the main unit is expected to run on its own, pass its database with --db to measure its growth
+
+Usage: python3 simulator.py --flowers 2000 --duration 60 --interval 5
+"""
+
+import argparse
+from Codec import Codec
+from FakeMqtt import FakeBroker, FakeClient
+import importlib.util
+import math
+from pathlib import Path
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+
+_TELEMETRY_REPORT = 'snipsmyflower/flowers/telemetryData'
+_DO_WATER = 'snipsmyflower/flowers/doWater'
+_PLANT_ALERT = 'snipsmyflower/flowers/alert'
+_REFILL_MODE = 'snipsmyflower/flowers/refillMode'
+_REFILL_FULL = 'snipsmyflower/flowers/refillFull'
+_EMPTY_WATER = 'snipsmyflower/flowers/emptyWater'
+_WATER_EMPTIED = 'snipsmyflower/flowers/waterEmptied'
+_REFUSED = 'snipsmyflower/flowers/refused'
+_ALERT_USER = 'snipsmyflower/flowers/alertUser'
+_INTENT_WATER_FILLING = 'hermes/intent/Psychokiller1888:waterFilling'
+_INTENT_EMPTY_WATER = 'hermes/intent/Psychokiller1888:emptyWater'
+
+_PLANTS = ('cactus', 'dragon tree')
+
+# A main unit run by us must not get in the way of the installed one: no metrics server on its port, no stats
+# published, and no recording of the simulated or replayed traffic
+MAIN_UNIT_CONFIG = {
+	'metrics': {'port': 0, 'statsInterval': 0},
+	'recorder': {'file': ''}
+}
+
+
+def loadMainUnit():
+	"""
+	The main unit lives in a file python can't import by name
+	:return: the SnipsMyFlower class
+	"""
+	file = Path(__file__).resolve().parent / 'action-snips-my-flower.py'
+	spec = importlib.util.spec_from_file_location('snipsMyFlower', str(file))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module.SnipsMyFlower
+
+
+def percentiles(values):
+	"""
+	:param values: list of floats
+	:return: dict, p50, p95, p99 and max, None if there are no values
+	"""
+	if not values:
+		return None
+	values = sorted(values)
+	pick = lambda p: values[min(len(values) - 1, int(len(values) * p))]
+	return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1]}
+
+
+class VirtualFlower:
+	"""
+	A satellite without hardware. Sensors follow a day cycle, the soil dries out and the tank empties as the plant is watered
+	"""
+
+	def __init__(self, siteId, plant, rng):
+		self.siteId = siteId
+		self.plant = plant
+		self._rng = rng
+		self._moisture = rng.uniform(20, 60)
+		self._water = rng.choice((25, 50, 75, 100))
+		self._dryRate = rng.uniform(0.2, 1.5) # Moisture points per hour
+		self._baseTemperature = rng.uniform(16, 26)
+		self._window = rng.uniform(40, 100) # Luminosity at noon
+		self._busyUntil = 0
+		self.state = 'ok'
+
+
+	@property
+	def busy(self):
+		"""
+		:return: boolean, True while filling or emptying the tank, the flower doesn't report nor accept requests then
+		"""
+		return time.monotonic() < self._busyUntil
+
+
+	def occupy(self, seconds):
+		self._busyUntil = time.monotonic() + seconds
+
+
+	def report(self, clock):
+		"""
+		Moves the sensors to the given simulated time and returns the telemetry
+		:param clock: float, simulated seconds
+		:return: dict
+		"""
+		hour = (clock / 3600) % 24
+		self._moisture = max(0.0, self._moisture - self._dryRate * 300 / 3600 + self._rng.gauss(0, 0.2))
+		day = max(0.0, math.sin((hour - 6) / 12 * math.pi))
+		return {
+			'siteId': self.siteId,
+			'temperature': round(self._baseTemperature + 4 * math.sin((hour - 9) / 12 * math.pi) + self._rng.gauss(0, 0.3), 2),
+			'luminosity': round(max(0.0, self._window * day + self._rng.gauss(0, 2)), 2),
+			'moisture': round(min(100.0, self._moisture), 2),
+			'water': self._water
+		}
+
+
+	def water(self):
+		"""
+		The pump runs for a few seconds
+		:return: boolean, False if the tank is empty
+		"""
+		if self._water <= 0:
+			return False
+		self._moisture += self._rng.uniform(15, 30)
+		self._water = max(0, self._water - 25)
+		return True
+
+
+	def refill(self):
+		self._water = 100
+
+
+	def empty(self):
+		self._water = 0
+
+
+class Fleet:
+	"""
+	Every virtual flower behind one mqtt client, the way a satellite talks to the main unit
+	"""
+
+	_OPERATION_TIME = 2.0 # Seconds a tank takes to be filled or emptied
+
+	def __init__(self, client, flowers, interval, intents, seed):
+		"""
+		:param client: paho like client
+		:param flowers: integer, number of virtual flowers
+		:param interval: float, real seconds between two reports of a flower
+		:param intents: float, probability a report comes with a refill or empty request from the user
+		:param seed: integer
+		"""
+		self._client = client
+		self._interval = interval
+		self._intents = intents
+		self._rng = random.Random(seed)
+		self._flowers = {
+			'virtual{}'.format(i): VirtualFlower('virtual{}'.format(i), self._rng.choice(_PLANTS), random.Random(seed + i))
+			for i in range(flowers)
+		}
+		self._payloads = {siteId: Codec.partial({'siteId': siteId, 'plant': flower.plant}, 'data') for siteId, flower in self._flowers.items()}
+		self._pending = dict() # Site id to the time its last report was sent, until the alert comes back
+		self._lock = threading.Lock()
+		self._running = False
+		self._thread = None
+
+		self.latencies = list()
+		self.sent = dict()
+		self.received = dict()
+
+		client.on_message = self._onMessage
+		client.subscribe([(topic, 0) for topic in (_DO_WATER, _PLANT_ALERT, _REFILL_MODE, _EMPTY_WATER)])
+
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+
+	def stop(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+
+
+	def _publish(self, topic, payload):
+		self._client.publish(topic, payload)
+		with self._lock:
+			self.sent[topic] = self.sent.get(topic, 0) + 1
+
+
+	def _run(self):
+		"""
+		Spreads the reports of every flower evenly over the interval
+		"""
+		siteIds = list(self._flowers)
+		step = self._interval / len(siteIds)
+		clock = self._rng.uniform(0, 86400) # Simulated time of day the fleet starts at
+		due = time.monotonic()
+		while self._running:
+			for siteId in siteIds:
+				if not self._running:
+					return
+				due += step
+				delay = due - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+
+				flower = self._flowers[siteId]
+				if flower.busy:
+					continue
+
+				data = flower.report(clock)
+				with self._lock:
+					self._pending[siteId] = time.monotonic()
+				self._publish(_TELEMETRY_REPORT, self._payloads[siteId](data))
+
+				if self._rng.random() < self._intents:
+					intent = self._rng.choice((_INTENT_WATER_FILLING, _INTENT_EMPTY_WATER))
+					self._publish(intent, Codec.dumps({'siteId': siteId, 'sessionId': 'simulator', 'intent': {'confidenceScore': 1.0}}))
+			clock += 300 # Each round is five minutes in the life of the plants
+
+
+	def _onMessage(self, client, userdata, message):
+		received = time.monotonic()
+		try:
+			payload = Codec.loads(message.payload)
+			flower = self._flowers.get(payload.get('siteId'))
+		except (ValueError, AttributeError):
+			return
+		if flower is None:
+			return
+
+		with self._lock:
+			self.received[message.topic] = self.received.get(message.topic, 0) + 1
+
+		if message.topic == _PLANT_ALERT:
+			with self._lock:
+				sent = self._pending.pop(flower.siteId, None)
+				if sent is not None:
+					self.latencies.append(received - sent)
+			self._onAlert(flower, payload.get('telemetry'), payload.get('limit'))
+
+		elif message.topic == _DO_WATER:
+			if not flower.busy and not flower.water():
+				self._alertUser(flower, 'water', 'min')
+
+		elif message.topic == _REFILL_MODE:
+			self._operate(flower, flower.refill, _REFILL_FULL)
+
+		elif message.topic == _EMPTY_WATER:
+			self._operate(flower, flower.empty, _WATER_EMPTIED)
+
+
+	def _operate(self, flower, operation, doneTopic):
+		"""
+		Fills or empties a tank, which keeps the flower busy for a while before it says it's done
+		"""
+		if flower.busy:
+			self._publish(_REFUSED, Codec.siteIdPayload(flower.siteId))
+			return
+
+		flower.occupy(self._OPERATION_TIME)
+
+		def done():
+			operation()
+			self._publish(doneTopic, Codec.siteIdPayload(flower.siteId))
+
+		timer = threading.Timer(interval=self._OPERATION_TIME, function=done)
+		timer.setDaemon(True)
+		timer.start()
+
+
+	def _onAlert(self, flower, telemetry, limit):
+		# Same reactions as the satellite: thirsty plants water themselves, the other problems are told to the user once
+		if telemetry == 'moisture' and limit == 'min':
+			if not flower.water():
+				self._alertUser(flower, 'water', 'min')
+			return
+
+		state = '{}/{}'.format(telemetry, limit)
+		if telemetry == 'all':
+			flower.state = 'ok'
+		elif flower.state != state:
+			flower.state = state
+			self._alertUser(flower, telemetry, limit)
+
+
+	def _alertUser(self, flower, telemetry, limit):
+		self._publish(_ALERT_USER, Codec.constant(('siteId', flower.siteId), ('telemetry', telemetry), ('limit', limit)))
+
+
+def databaseSize(dbFile):
+	"""
+	:param dbFile: Path
+	:return: tuple, bytes on disk with the wal file, and telemetry rows
+	"""
+	if dbFile is None or not Path(dbFile).exists():
+		return 0, 0
+
+	size = sum(Path('{}{}'.format(dbFile, suffix)).stat().st_size for suffix in ('', '-wal') if Path('{}{}'.format(dbFile, suffix)).exists())
+	try:
+		con = sqlite3.connect('file:{}?mode=ro'.format(dbFile), uri=True)
+		rows = con.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0]
+		con.close()
+	except sqlite3.Error:
+		rows = 0
+	return size, rows
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Load tests the main unit with a fleet of virtual flowers')
+	parser.add_argument('--flowers', type=int, default=1000, help='number of virtual flowers')
+	parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+	parser.add_argument('--interval', type=float, default=5, help='seconds between two reports of a same flower, a real one waits 300')
+	parser.add_argument('--intents', type=float, default=0.001, help='probability a report comes with a refill or empty request')
+	parser.add_argument('--broker', help='host:port of a real broker, the main unit then has to run on its own')
+	parser.add_argument('--db', help='main unit database, to measure its growth when using --broker')
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+
+	unit = None
+	directory = None
+	if args.broker:
+		import paho.mqtt.client as mqtt
+		client = mqtt.Client()
+		client.connect(args.broker.split(':')[0], int(args.broker.split(':')[1]))
+		dbFile = Path(args.db) if args.db else None
+	else:
+		broker = FakeBroker()
+		directory = tempfile.TemporaryDirectory()
+		unit = loadMainUnit()(mqttClient=FakeClient(broker), userDir=directory.name, configOverrides=MAIN_UNIT_CONFIG)
+		unit._mqtt.connected.wait(5)
+		client = FakeClient(broker)
+		client.connect()
+		client.connected.wait(5)
+		dbFile = unit._dbFile
+
+	fleet = Fleet(client, args.flowers, args.interval, args.intents, args.seed)
+	client.loop_start()
+	sizeBefore, rowsBefore = databaseSize(dbFile)
+
+	print('{} virtual flowers reporting every {}s for {}s'.format(args.flowers, args.interval, args.duration))
+	start = time.monotonic()
+	fleet.start()
+	try:
+		while time.monotonic() - start < args.duration:
+			time.sleep(min(5.0, args.duration - (time.monotonic() - start)))
+			print('{:6.0f}s  sent: {:8d}  alerts back: {:8d}'.format(time.monotonic() - start, fleet.sent.get(_TELEMETRY_REPORT, 0), len(fleet.latencies)))
+	except KeyboardInterrupt:
+		pass
+	fleet.stop()
+	elapsed = time.monotonic() - start
+
+	# Gives the main unit a moment to drain what's in flight
+	time.sleep(1)
+	writer = None
+	if unit is not None:
+		writer = unit._telemetryWriter.stats()
+		unit.onStop()
+	client.loop_stop()
+	client.disconnect()
+	sizeAfter, rowsAfter = databaseSize(dbFile)
+
+	reports = fleet.sent.get(_TELEMETRY_REPORT, 0)
+	print('')
+	print('Reports sent:   {:10d}  {:10.1f}/s'.format(reports, reports / elapsed))
+	if writer is not None:
+		print('Rows stored:    {:10d}  {:10.1f}/s  dropped: {}  batches: {}  average flush: {:.2f}ms'.format(
+			writer['rows'], writer['rows'] / elapsed, writer['dropped'], writer['batches'], writer['averageFlushLatency'] * 1000))
+	latency = percentiles(fleet.latencies)
+	if latency is not None:
+		print('Alert round trip ms, p50: {:.2f}  p95: {:.2f}  p99: {:.2f}  max: {:.2f}  ({} alerts)'.format(
+			latency['p50'] * 1000, latency['p95'] * 1000, latency['p99'] * 1000, latency['max'] * 1000, len(fleet.latencies)))
+	if dbFile is not None:
+		rows = rowsAfter - rowsBefore
+		print('Database growth: {} rows, {:.1f}KB, {:.0f} bytes per row'.format(rows, (sizeAfter - sizeBefore) / 1024, (sizeAfter - sizeBefore) / rows if rows else 0))
+	print('Flowers sent:     {}'.format(', '.join('{} {}'.format(topic.rsplit('/', 1)[-1], count) for topic, count in sorted(fleet.sent.items()))))
+	print('Flowers received: {}'.format(', '.join('{} {}'.format(topic.rsplit('/', 1)[-1], count) for topic, count in sorted(fleet.received.items()))))
+
+	if directory is not None:
+		directory.cleanup()
+
+
+if __name__ == '__main__':
+	sys.exit(main())